@@ -0,0 +1,65 @@
+"""
+Measures how long importing the package takes in a fresh interpreter, for the names extensions use at startup.
+
+Every statement runs in its own process so nothing is cached between runs. Names that need the Windows APIs
+are reported as unavailable on other platforms.
+
+Run with `python benchmarks/bench_import_time.py [runs]`
+"""
+import statistics
+import subprocess
+import sys
+
+from checkout import ROOT
+
+RUNS = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+
+STATEMENTS = [
+    "import mvdt_utilities",
+    "from mvdt_utilities import get_communication_endpoint",
+    "from mvdt_utilities import debug_execution_time",
+    "from mvdt_utilities import ResultCache",
+    "from mvdt_utilities.windows.powershell.output_format import parse_format_list",
+    "from mvdt_utilities import PowershellHelper",
+    "from mvdt_utilities import WMIConnection",
+]
+
+# Times the statement inside the child, so interpreter startup isn't included
+CHILD = """
+import sys, time
+modules = len(sys.modules)
+start = time.perf_counter()
+{statement}
+print(time.perf_counter() - start, len(sys.modules) - modules)
+"""
+
+
+def measure(statement: str):
+    seconds = []
+    modules = 0
+    for _ in range(RUNS):
+        completed = subprocess.run(
+            [sys.executable, "-c", CHILD.format(statement=statement)], cwd=ROOT, capture_output=True, text=True
+        )
+        if completed.returncode != 0:
+            return None, completed.stderr.strip().splitlines()[-1]
+        elapsed, modules = completed.stdout.split()
+        seconds.append(float(elapsed))
+    return seconds, int(modules)
+
+
+def main():
+    print(f"Import time in a fresh interpreter, {RUNS} runs each")
+    for statement in STATEMENTS:
+        seconds, modules = measure(statement)
+        if seconds is None:
+            print(f"{statement:<80} unavailable: {modules}")
+            continue
+        print(
+            f"{statement:<80} median {statistics.median(seconds) * 1000:>7.2f} ms "
+            f"min {min(seconds) * 1000:>7.2f} ms {modules:>4} modules"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Compares building metric lines with MetricLineBuilder against formatting them with f-strings.
+
+The lines are shaped like the service states of `Get-Service`, one gauge per service with static host, domain
+and site dimensions and a service dimension, some of the service names need quoting.
+The plain f-string variant doesn't escape anything, the number of lines it gets wrong is reported next to it.
+
+Run with `python benchmarks/bench_metric_lines.py [lines]`
+"""
+import sys
+import timeit
+from typing import List
+
+import checkout
+from mvdt_utilities.metric_lines import MAX_PAYLOAD_BYTES, MetricLineBuilder, escape_dimension_value
+
+LINES = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+REPEAT = 5
+
+HOST = "dc01.example.com"
+DOMAIN = "example.com"
+SITE = "Default-First-Site-Name"
+KEY = "win.service.state"
+
+
+def make_services(count: int) -> List[dict]:
+    return [
+        {"Name": f"Service {i}" if i % 4 == 0 else f"Service{i}", "Status": "Running" if i % 3 else "Stopped"}
+        for i in range(count)
+    ]
+
+
+def fstrings(services: List[dict]) -> List[bytes]:
+    # The usual ad-hoc code: format every line, join and split into payloads by hand
+    payloads: List[bytes] = []
+    batch: List[str] = []
+    size = 0
+    for service in services:
+        value = 1 if service["Status"] == "Running" else 0
+        line = f"{KEY},host={HOST},domain={DOMAIN},site={SITE},service={service['Name']} gauge,{value}"
+        if size + len(line) + 1 > MAX_PAYLOAD_BYTES:
+            payloads.append("\n".join(batch).encode())
+            batch, size = [], 0
+        batch.append(line)
+        size += len(line) + 1
+    if batch:
+        payloads.append("\n".join(batch).encode())
+    return payloads
+
+
+def fstrings_escaped(services: List[dict]) -> List[bytes]:
+    # The same with every dimension value escaped, the least it takes to get the lines right
+    payloads: List[bytes] = []
+    batch: List[str] = []
+    size = 0
+    for service in services:
+        value = 1 if service["Status"] == "Running" else 0
+        host, domain, site = escape_dimension_value(HOST), escape_dimension_value(DOMAIN), escape_dimension_value(SITE)
+        name = escape_dimension_value(service["Name"])
+        line = f"{KEY},host={host},domain={domain},site={site},service={name} gauge,{value}"
+        if size + len(line) + 1 > MAX_PAYLOAD_BYTES:
+            payloads.append("\n".join(batch).encode())
+            batch, size = [], 0
+        batch.append(line)
+        size += len(line) + 1
+    if batch:
+        payloads.append("\n".join(batch).encode())
+    return payloads
+
+
+def builder(services: List[dict]) -> List[bytes]:
+    lines = MetricLineBuilder()
+    prefix = lines.prefix(KEY, {"host": HOST, "domain": DOMAIN, "site": SITE})
+    for service in services:
+        lines.gauge(prefix, 1 if service["Status"] == "Running" else 0, {"service": service["Name"]})
+    return lines.payloads()
+
+
+def wrong_lines(payloads: List[bytes], services: List[dict]) -> int:
+    lines = [line for payload in payloads for line in payload.decode().split("\n")]
+    expected = [f",service={escape_dimension_value(service['Name'])} " for service in services]
+    return sum(1 for line, service in zip(lines, expected) if service not in line)
+
+
+def bench(name: str, func, services: List[dict]):
+    payloads = func(services)
+    seconds = min(timeit.repeat(lambda: func(services), number=1, repeat=REPEAT))
+    print(
+        f"{name:<10} {seconds * 1000:>8.1f} ms {LINES / seconds:>12,.0f} lines/s {len(payloads):>3} payloads "
+        f"{wrong_lines(payloads, services):>6} lines wrong"
+    )
+
+
+def main():
+    services = make_services(LINES)
+    print(f"Building {LINES} lines, best of {REPEAT}")
+    bench("f-strings", fstrings, services)
+    bench("escaped", fstrings_escaped, services)
+    bench("builder", builder, services)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Compares parsing the Format-List output of a command against its JSON and CSV output.
+
+The outputs are shaped like `Get-Service | Select Name, DisplayName, Status, StartType, Description`
+and include values that are wrapped by Format-List and values that contain the Format-List delimiter.
+
+Run with `python benchmarks/bench_output_format.py [records]`
+"""
+import csv
+import io
+import json
+import sys
+import timeit
+from typing import Dict, List
+
+import checkout
+from mvdt_utilities.windows.powershell.output_format import (
+    parse_csv_output,
+    parse_format_list,
+    parse_json_output,
+)
+
+# Only read when run directly, bench_suite.py imports the generators below
+RECORDS = int(sys.argv[1]) if __name__ == "__main__" and len(sys.argv) > 1 else 10_000
+REPEAT = 5
+
+# Format-List wraps values at the console width, continuation lines are indented to the value column.
+FORMAT_LIST_WIDTH = 120
+
+
+def legacy_format_command_output(lines: List[str]) -> List[Dict[str, str]]:
+    # The parser PowershellHelper._format_command_output used before the output formats were added.
+    delimeter = " : "
+
+    result: List[Dict[str, str]] = []
+    tmp: Dict[str, str] = {}
+    previous_key: str | None = None
+    for line in lines:
+        if line and delimeter in line:
+            split = line.split(delimeter)
+            previous_key = split[0].strip()
+            tmp[split[0].strip()] = split[1] if len(split) > 1 else ""
+        elif line and tmp and previous_key:
+            tmp[previous_key] = tmp[previous_key] + line.strip()
+            previous_key = None
+            continue
+        elif tmp:
+            result.append(tmp)
+            tmp = {}
+    return result
+
+
+def make_records(count: int) -> List[Dict[str, str]]:
+    return [
+        {
+            "Name": f"Service{i}",
+            "DisplayName": f"Example Service {i}",
+            "Status": "Running" if i % 3 else "Stopped",
+            "StartType": "Automatic",
+            "Description": (
+                f"Provides example functionality number {i} : used to exercise values containing the delimiter "
+                "and long enough to be wrapped across several lines by Format-List in the recorded output."
+            ),
+        }
+        for i in range(count)
+    ]
+
+
+def to_format_list(records: List[Dict[str, str]]) -> str:
+    width = max(len(key) for key in records[0])
+    indent = " " * (width + 3)
+    out = ["", ""]
+    for record in records:
+        for key, value in record.items():
+            line = f"{key.ljust(width)} : {value}"
+            out.append(line[:FORMAT_LIST_WIDTH])
+            rest = line[FORMAT_LIST_WIDTH:]
+            step = FORMAT_LIST_WIDTH - len(indent)
+            for start in range(0, len(rest), step):
+                out.append(indent + rest[start:start + step])
+        out.append("")
+    out.append("")
+    return "\r\n".join(out)
+
+
+def to_json(records: List[Dict[str, str]]) -> str:
+    return json.dumps(records, separators=(",", ":"))
+
+
+def to_csv(records: List[Dict[str, str]]) -> str:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=list(records[0]), quoting=csv.QUOTE_ALL, lineterminator="\r\n")
+    writer.writeheader()
+    writer.writerows(records)
+    return buffer.getvalue()
+
+
+def bench(name: str, func, output: str, expected: List[Dict[str, str]]):
+    result = func(output)
+    correct = sum(1 for a, b in zip(result, expected) if a == b)
+    seconds = min(timeit.repeat(lambda: func(output), number=1, repeat=REPEAT))
+    print(
+        f"{name:<14} {seconds * 1000:>9.1f} ms {RECORDS / seconds:>12,.0f} records/s "
+        f"{len(output) / 1024 / 1024:>7.1f} MiB  {correct}/{len(expected)} records intact"
+    )
+
+
+def main():
+    records = make_records(RECORDS)
+    format_list_output = to_format_list(records)
+
+    print(f"Parsing {RECORDS} records, best of {REPEAT}")
+    bench("legacy list", lambda o: legacy_format_command_output(o.splitlines()), format_list_output, records)
+    bench("format list", lambda o: parse_format_list(o.splitlines()), format_list_output, records)
+    bench("json", parse_json_output, to_json(records), records)
+    bench("csv", parse_csv_output, to_csv(records), records)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+"""
+Benchmarks PowershellHelper and WMIConnection end to end on any machine, Windows or not.
+
+powershell.exe and WMI are replaced by stand-ins serving recorded outputs: a ProcessLauncher that returns
+the recorded output of every command and a SWbemLocator whose queries return recorded instances.
+The outputs are shaped like `Get-Service` and `Win32_Service`, see bench_output_format.py, at several sizes.
+
+Measured for every size:
+- parse: records per second parsing the recorded output of every format
+- call: seconds per run_command/iter_command and per WMI query, the overhead on top of parsing is what the
+  helpers add (formatting the command, timing, decoding, error checks)
+- memory: peak bytes allocated by run_command compared to iter_command, with tracemalloc
+- cache: seconds per run_command served from a ResultCache, and per ResultCache.get hit
+
+Run with `python benchmarks/bench_suite.py [--sizes 10,1000,10000] [--output results.json]`
+"""
+import argparse
+import json
+import logging
+import platform
+import sys
+import time
+import timeit
+import tracemalloc
+from subprocess import CompletedProcess
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Iterator, List
+
+import checkout
+from bench_output_format import make_records, to_csv, to_format_list, to_json
+
+from mvdt_utilities.result_cache import ResultCache
+from mvdt_utilities.windows.powershell.launcher import ProcessLauncher
+from mvdt_utilities.windows.powershell.output_format import (
+    FORMAT_CSV,
+    FORMAT_JSON,
+    FORMAT_LIST,
+    format_command,
+    parse_output,
+)
+from mvdt_utilities.windows.powershell.powershell import PowershellHelper
+from mvdt_utilities.windows.wmi_connection import WMIConnection
+
+COMMAND = "Get-Service | Select Name, DisplayName, Status, StartType, Description"
+QUERY = "Select Name, DisplayName, State, StartMode, ProcessId from Win32_Service"
+PROPERTIES = ["Name", "DisplayName", "State", "StartMode", "ProcessId"]
+ACCOUNT = ("EXAMPLE\\monitoring", "secret")
+FORMATS = [FORMAT_LIST, FORMAT_JSON, FORMAT_CSV]
+
+# The helpers log every command, only the measurements should be printed
+logging.basicConfig(level=logging.WARNING)
+LOGGER = logging.getLogger("bench_suite")
+
+
+def to_json_lines(records: List[Dict[str, str]]) -> str:
+    # What iter_command reads for FORMAT_JSON, one object per line
+    return "".join(json.dumps(record, separators=(",", ":")) + "\r\n" for record in records)
+
+
+def recorded_outputs(records: List[Dict[str, str]]) -> Dict[str, str]:
+    """
+    The output of every formatted command the helpers can run for COMMAND.
+    """
+    return {
+        format_command(COMMAND, FORMAT_LIST): to_format_list(records),
+        format_command(COMMAND, FORMAT_JSON): to_json(records),
+        format_command(COMMAND, FORMAT_CSV): to_csv(records),
+        format_command(COMMAND, FORMAT_LIST, streaming=True): to_format_list(records),
+        format_command(COMMAND, FORMAT_JSON, streaming=True): to_json_lines(records),
+        format_command(COMMAND, FORMAT_CSV, streaming=True): to_csv(records),
+    }
+
+
+class _RecordedStdout:
+    # The stdout pipe of a process, iterated line by line like the text pipe of subprocess.Popen
+    def __init__(self, lines: List[str]):
+        self._lines = iter(lines)
+
+    def __iter__(self) -> Iterator[str]:
+        return self._lines
+
+    def close(self):
+        self._lines = iter(())
+
+
+class _RecordedProcess:
+    # Shaped like a RunasPopen once run, or like a running Popen when `lines` are given
+    def __init__(self, args, stdout: str | None = None, lines: List[str] | None = None):
+        self.args = args
+        self.pid = 0
+        self.returncode = 0
+        self.stdout = stdout if lines is None else _RecordedStdout(lines)
+        self.stderr = ""
+
+    def wait(self, timeout: float | None = None) -> int:
+        return self.returncode
+
+    def kill(self):
+        pass
+
+
+class RecordedLauncher(ProcessLauncher):
+    """
+    Serves the recorded output of the last argument of every command line instead of starting powershell.exe.
+    """
+
+    def __init__(self, outputs: Dict[str, str]):
+        self._outputs = outputs
+        self._encoded = {command: output.encode() for command, output in outputs.items()}
+        self._lines = {command: output.splitlines(keepends=True) for command, output in outputs.items()}
+
+    def run(self, command: List[str], timeout: float | None = None, **kwargs) -> CompletedProcess:
+        return CompletedProcess(command, 0, self._encoded[command[-1]], b"")
+
+    def run_as(self, command: List[str], username: str, password: str, domain: str, timeout=None, **kwargs):
+        return _RecordedProcess(command, stdout=self._outputs[command[-1]])
+
+    def popen(self, command: List[str], **kwargs):
+        return _RecordedProcess(command, lines=self._lines[command[-1]])
+
+    def popen_as(self, command: List[str], username: str, password: str, domain: str, **kwargs):
+        return _RecordedProcess(command, lines=self._lines[command[-1]])
+
+
+class RecordedResult:
+    """
+    Shaped like the SWbemObjectSet returned by ExecQuery: its rows are only enumerated when it is iterated,
+    and taking its length enumerates all of them like Count does, so `query` pays for the enumeration.
+    """
+
+    def __init__(self, instances: List[Any]):
+        self._instances = instances
+
+    def __iter__(self) -> Iterator[Any]:
+        for instance in self._instances:
+            yield instance
+
+    def __len__(self) -> int:
+        count = 0
+        for _ in self:
+            count += 1
+        return count
+
+
+class RecordedLocator:
+    """
+    A SWbemLocator whose services return the same recorded instances for every query.
+    """
+
+    def __init__(self, instances: List[Any]):
+        self._instances = instances
+
+    def __call__(self) -> "RecordedLocator":
+        return self
+
+    def ConnectServer(self, server: str, namespace: str) -> "RecordedLocator":
+        return self
+
+    def ExecQuery(self, query: str, language: str = "WQL", flags: int = 0) -> RecordedResult:
+        return RecordedResult(self._instances)
+
+
+def recorded_instances(records: List[Dict[str, str]]) -> List[Any]:
+    return [
+        SimpleNamespace(
+            Name=record["Name"],
+            DisplayName=record["DisplayName"],
+            State=record["Status"],
+            StartMode=record["StartType"],
+            ProcessId=i,
+        )
+        for i, record in enumerate(records)
+    ]
+
+
+def seconds_per_call(func: Callable[[], Any], repeat: int) -> float:
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def peak_bytes(func: Callable[[], Any]) -> int:
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def consume(records: Iterator[Dict[str, str]]) -> int:
+    count = 0
+    for _ in records:
+        count += 1
+    return count
+
+
+def bench_size(size: int, repeat: int) -> List[Dict[str, Any]]:
+    records = make_records(size)
+    outputs = recorded_outputs(records)
+    launcher = RecordedLauncher(outputs)
+    local = PowershellHelper(logger=LOGGER, launcher=launcher)
+    account = PowershellHelper(ACCOUNT, LOGGER, launcher=launcher)
+    results: List[Dict[str, Any]] = []
+
+    def add(benchmark: str, name: str, unit: str, value: float):
+        results.append({"benchmark": benchmark, "name": name, "size": size, "unit": unit, "value": value})
+
+    for output_format in FORMATS:
+        output = outputs[format_command(COMMAND, output_format)]
+        seconds = seconds_per_call(lambda: parse_output(output, output_format), repeat)
+        add("parse", output_format, "records/s", size / seconds)
+
+        add("call", f"run_command {output_format}", "s", seconds_per_call(
+            lambda: local.run_command(COMMAND, output_format), repeat
+        ))
+        add("call", f"run_command {output_format} account", "s", seconds_per_call(
+            lambda: account.run_command(COMMAND, output_format), repeat
+        ))
+        add("call", f"iter_command {output_format}", "s", seconds_per_call(
+            lambda: consume(local.iter_command(COMMAND, output_format)), repeat
+        ))
+
+        add("memory", f"run_command {output_format}", "bytes", peak_bytes(
+            lambda: local.run_command(COMMAND, output_format)
+        ))
+        add("memory", f"iter_command {output_format}", "bytes", peak_bytes(
+            lambda: consume(local.iter_command(COMMAND, output_format))
+        ))
+
+        cached = PowershellHelper(logger=LOGGER, cache=ResultCache(ttl=3600), launcher=launcher)
+        cached.run_command(COMMAND, output_format)
+        add("cache", f"run_command {output_format} hit", "s", seconds_per_call(
+            lambda: cached.run_command(COMMAND, output_format), repeat
+        ))
+
+    cache = ResultCache(ttl=3600)
+    cache.get("key", lambda: records)
+    add("cache", "ResultCache.get hit", "s", seconds_per_call(lambda: cache.get("key", lambda: records), repeat))
+
+    connection = WMIConnection(ACCOUNT, LOGGER, locator=RecordedLocator(recorded_instances(records)))
+    # Connected without the 'with' block, there is no logon to impersonate for recorded instances
+    connection._connect()
+    add("call", "WMIConnection.query", "s", seconds_per_call(lambda: consume(iter(connection.query(QUERY))), repeat))
+    add("call", "WMIConnection.iter_query", "s", seconds_per_call(
+        lambda: consume(connection.iter_query(QUERY)), repeat
+    ))
+    add("call", "WMIConnection.query_rows", "s", seconds_per_call(
+        lambda: connection.query_rows(QUERY, PROPERTIES), repeat
+    ))
+    add("call", "WMIConnection.query_rows columnar", "s", seconds_per_call(
+        lambda: connection.query_rows(QUERY, PROPERTIES, columnar=True), repeat
+    ))
+    return results
+
+
+def print_results(results: List[Dict[str, Any]]):
+    for result in results:
+        if result["unit"] == "s":
+            value = f"{result['value'] * 1e6:>14,.1f} us"
+        elif result["unit"] == "bytes":
+            value = f"{result['value'] / 1024:>14,.1f} KiB"
+        else:
+            value = f"{result['value']:>14,.0f} {result['unit']}"
+        print(f"{result['benchmark']:<8} {result['name']:<36} {result['size']:>7} {value}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="10,1000,10000", help="Comma separated numbers of recorded records")
+    parser.add_argument("--repeat", type=int, default=5, help="Best of how many runs")
+    parser.add_argument("--output", help="Also writes the results to this JSON file")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    results: List[Dict[str, Any]] = []
+    for size in sizes:
+        size_results = bench_size(size, args.repeat)
+        print_results(size_results)
+        results.extend(size_results)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "timestamp": int(time.time()),
+                    "python": platform.python_version(),
+                    "implementation": platform.python_implementation(),
+                    "platform": platform.platform(),
+                    "sizes": sizes,
+                    "repeat": args.repeat,
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,11 @@
+"""
+Puts the checkout the benchmarks live in on sys.path, so they run without installing the package.
+Every benchmark imports it before mvdt_utilities.
+"""
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
@@ -1,10 +1,96 @@
-from .windows import (
-    PowershellHelper,
-    PowershellException,
-    WMIConnection,
-    LdapAttributes,
-    get_ldap_attributes,
-    get_ldap_attributes_no_cache,
-) 
-from .oneagent_info import get_communication_endpoint
-from .execution_time import debug_execution_time
\ No newline at end of file
+from typing import TYPE_CHECKING
+
+from ._lazy_imports import lazy_attributes
+
+# Names are imported on first use, so e.g. get_communication_endpoint can be used without loading COM
+# and the Windows APIs, and without failing on other platforms.
+_ATTRIBUTES = {
+    "PowershellHelper": ".windows.powershell.powershell",
+    "PowershellException": ".windows.powershell.powershell",
+    "PowershellTimeoutException": ".windows.powershell.powershell",
+    "AsyncPowershellHelper": ".windows.powershell.async_powershell",
+    "PowershellPool": ".windows.powershell.powershell_pool",
+    "FORMAT_LIST": ".windows.powershell.output_format",
+    "FORMAT_JSON": ".windows.powershell.output_format",
+    "FORMAT_CSV": ".windows.powershell.output_format",
+    "WMIConnection": ".windows.wmi_connection",
+    "WMIConnectionPool": ".windows.wmi_connection",
+    "WMIQueryException": ".windows.wmi_connection",
+    "WMIRefresher": ".windows.wmi_refresher",
+    "WMIQueryExecutor": ".windows.wmi_executor",
+    "WMIJobResult": ".windows.wmi_executor",
+    "UsnChangeTracker": ".windows.usn_tracker",
+    "UsnChange": ".windows.usn_tracker",
+    "LdapAttributes": ".windows.ldap_attributes",
+    "configure_ldap_attributes_cache": ".windows.ldap_attributes",
+    "get_ldap_attributes": ".windows.ldap_attributes",
+    "get_ldap_attributes_bulk": ".windows.ldap_attributes",
+    "get_ldap_attributes_no_cache": ".windows.ldap_attributes",
+    "get_selected_ldap_attributes": ".windows.ldap_attributes",
+    "TraceRecorder": ".windows.replay",
+    "Trace": ".windows.replay",
+    "RecordingLauncher": ".windows.replay",
+    "ReplayLauncher": ".windows.replay",
+    "RecordingLocator": ".windows.replay",
+    "ReplayLocator": ".windows.replay",
+    "ReplayException": ".windows.replay",
+    "get_communication_endpoint": ".oneagent_info",
+    "get_deployment_config": ".oneagent_info",
+    "DeploymentConfig": ".oneagent_info",
+    "DeploymentConfigWatcher": ".oneagent_info",
+    "ResultCache": ".result_cache",
+    "debug_execution_time": ".execution_time",
+    "timed": ".execution_time",
+    "timings": ".execution_time",
+    "SelfMonitoring": ".self_monitoring",
+    "MetricLineBuilder": ".metric_lines",
+    "MetricsIngestClient": ".ingest_client",
+    "IngestException": ".ingest_client",
+}
+
+__all__ = list(_ATTRIBUTES)
+__getattr__, __dir__ = lazy_attributes(__name__, _ATTRIBUTES)
+
+if TYPE_CHECKING:
+    from .windows import (
+        PowershellHelper,
+        AsyncPowershellHelper,
+        PowershellException,
+        PowershellTimeoutException,
+        PowershellPool,
+        FORMAT_LIST,
+        FORMAT_JSON,
+        FORMAT_CSV,
+        WMIConnection,
+        WMIConnectionPool,
+        WMIQueryException,
+        WMIRefresher,
+        WMIQueryExecutor,
+        WMIJobResult,
+        UsnChangeTracker,
+        UsnChange,
+        LdapAttributes,
+        configure_ldap_attributes_cache,
+        get_ldap_attributes,
+        get_ldap_attributes_bulk,
+        get_ldap_attributes_no_cache,
+        get_selected_ldap_attributes,
+        TraceRecorder,
+        Trace,
+        RecordingLauncher,
+        ReplayLauncher,
+        RecordingLocator,
+        ReplayLocator,
+        ReplayException,
+    )
+    from .oneagent_info import (
+        get_communication_endpoint,
+        get_deployment_config,
+        DeploymentConfig,
+        DeploymentConfigWatcher,
+    )
+    from .result_cache import ResultCache
+    from .execution_time import debug_execution_time, timed, timings
+    from .self_monitoring import SelfMonitoring
+    from .metric_lines import MetricLineBuilder
+    from .ingest_client import MetricsIngestClient, IngestException
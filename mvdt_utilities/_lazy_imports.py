@@ -0,0 +1,27 @@
+import importlib
+import sys
+from typing import Any, Callable, Dict, List, Tuple
+
+
+def lazy_attributes(package: str, attributes: Dict[str, str]) -> Tuple[Callable[[str], Any], Callable[[], List[str]]]:
+    """
+    Returns the module level `__getattr__` and `__dir__` (PEP 562) of `package`, which import the module
+    defining a public name only when the name is first used.
+    `attributes` maps every public name to its module, relative to `package`.
+    `__getattr__, __dir__ = lazy_attributes(__name__, {"ResultCache": ".result_cache"})`
+    """
+    module_globals = sys.modules[package].__dict__
+
+    def __getattr__(name: str) -> Any:
+        module = attributes.get(name)
+        if module is None:
+            raise AttributeError(f"module {package!r} has no attribute {name!r}")
+        value = getattr(importlib.import_module(module, package), name)
+        # Later lookups find the name directly and don't go through __getattr__ anymore
+        module_globals[name] = value
+        return value
+
+    def __dir__() -> List[str]:
+        return sorted(set(module_globals) | set(attributes))
+
+    return __getattr__, __dir__
@@ -1,25 +1,248 @@
+import functools
+import inspect
+import logging
+import math
+import threading
 import time
-from functools import wraps
+from typing import Any, Callable, Dict, List, Optional
 
+# Sub-buckets per power of two, the percentiles are within about 5% of the exact value
+_SUB_BUCKETS = 8
 
 
-def debug_execution_time(func):
+class Histogram:
     """
-    This decorator can be placed above functions to log their execution time.
-    This only works on functions that are part of a class containing a logger field with the name 'logger'
+    Durations in nanoseconds counted in logarithmic buckets, so recording is constant time and memory stays
+    small no matter how many durations are recorded.
+    """
+
+    __slots__ = ("count", "errors", "total_ns", "min_ns", "max_ns", "_buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_ns = 0
+        self.min_ns = 0
+        self.max_ns = 0
+        self._buckets: Dict[int, int] = {}
+
+    def record(self, duration_ns: int, error: bool = False):
+        mantissa, exponent = math.frexp(max(duration_ns, 1))
+        bucket = exponent * _SUB_BUCKETS + int((mantissa - 0.5) * 2 * _SUB_BUCKETS)
+        self._buckets[bucket] = self._buckets.get(bucket, 0) + 1
+
+        if not self.count or duration_ns < self.min_ns:
+            self.min_ns = duration_ns
+        if duration_ns > self.max_ns:
+            self.max_ns = duration_ns
+        self.count += 1
+        self.total_ns += duration_ns
+        if error:
+            self.errors += 1
+
+    def percentile(self, p: float) -> int:
+        """
+        The duration in nanoseconds below which `p` percent of the recorded durations are.
+        """
+        if not self.count:
+            return 0
+        rank = math.ceil(self.count * p / 100)
+        seen = 0
+        for bucket in sorted(self._buckets):
+            seen += self._buckets[bucket]
+            if seen >= rank:
+                exponent, sub_bucket = divmod(bucket, _SUB_BUCKETS)
+                # The middle of the bucket
+                value = (0.5 + (sub_bucket + 0.5) / (2 * _SUB_BUCKETS)) * 2.0 ** exponent
+                return min(max(int(value), self.min_ns), self.max_ns)
+        return self.max_ns
+
+    def snapshot(self) -> Dict[str, float]:
+        """
+        The statistics of the histogram, durations are in seconds.
+        """
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "sum": self.total_ns / 1e9,
+            "min": self.min_ns / 1e9,
+            "max": self.max_ns / 1e9,
+            "p50": self.percentile(50) / 1e9,
+            "p95": self.percentile(95) / 1e9,
+            "p99": self.percentile(99) / 1e9,
+        }
+
+
+# Called with the name, duration in nanoseconds, error flag and dimensions of every recorded duration
+TimingListener = Callable[[str, int, bool, Optional[Dict[str, str]]], None]
+
+
+class Timings:
+    """
+    The histograms of every timed name. Set `enabled` to False to stop timing altogether.
+    Listeners also get the dimensions of every duration, e.g. the namespace of a WMI query,
+    which the histograms don't keep apart.
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self._lock = threading.Lock()
+        self._histograms: Dict[str, Histogram] = {}
+        self._listeners: List[TimingListener] = []
+
+    def record(self, name: str, duration_ns: int, error: bool = False, dimensions: Optional[Dict[str, str]] = None):
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram()
+            histogram.record(duration_ns, error)
+            listeners = self._listeners
+
+        for listener in listeners:
+            listener(name, duration_ns, error, dimensions)
+
+    def add_listener(self, listener: TimingListener):
+        with self._lock:
+            # Replaced instead of changed in place, record iterates over it without the lock
+            self._listeners = self._listeners + [listener]
+
+    def remove_listener(self, listener: TimingListener):
+        with self._lock:
+            self._listeners = [l for l in self._listeners if l is not listener]
+
+    def snapshot(self, reset: bool = False) -> Dict[str, Dict[str, float]]:
+        """
+        The statistics of every name, see Histogram.snapshot.
+        `reset` - Starts new histograms, e.g. to report the timings of every cycle separately
+        """
+        with self._lock:
+            histograms = self._histograms
+            if reset:
+                self._histograms = {}
+            return {name: histogram.snapshot() for name, histogram in histograms.items()}
+
+    def reset(self):
+        with self._lock:
+            self._histograms = {}
+
+
+timings = Timings()
+
+
+Dimensions = Optional[Dict[str, str]]
+
+
+class timed:
+    """
+    Times a block of code under `name`, a block that raises is counted as an error.
+    `dimensions` are passed on to the listeners of the timings, with a `logger` the duration is also logged.
+    Dimensions that are costly to compute can be given as a function, it's only called when timings are enabled.
+    The duration is logged whether timings are enabled or not.
+    `with timed("ad.replication", {"dc": dc}):`
+    After the block `elapsed` holds its duration in seconds, measured whether timings are enabled or not.
+    """
+
+    __slots__ = ("_name", "_dimensions", "_logger", "_start", "elapsed")
+
+    def __init__(
+        self,
+        name: str,
+        dimensions: Dimensions | Callable[[], Dimensions] = None,
+        logger: Optional[logging.Logger] = None,
+    ):
+        self._name = name
+        self._dimensions = dimensions
+        self._logger = logger
+        self._start = 0
+        self.elapsed = 0.0
+
+    def __enter__(self):
+        self._start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter_ns() - self._start
+        self.elapsed = elapsed / 1e9
+        if timings.enabled:
+            dimensions = self._dimensions() if callable(self._dimensions) else self._dimensions
+            timings.record(self._name, elapsed, exc_type is not None, dimensions)
+        if self._logger:
+            self._logger.debug(f"{self._name} took {self.elapsed}s")
+        return False
+
+
+def _log(name: str, logger: Optional[logging.Logger], args: tuple, duration_ns: int):
+    if logger is None and args:
+        # Methods of classes with a logger keep logging their execution time
+        logger = getattr(args[0], "logger", None)
+    if logger:
+        logger.debug(f"Completed metric collection for function '{name}' in {duration_ns / 1e9}s")
+
+
+def _is_method(func: Callable) -> bool:
+    try:
+        parameters = list(inspect.signature(func).parameters)
+    except (TypeError, ValueError):
+        return False
+    return bool(parameters) and parameters[0] == "self"
+
+
+def debug_execution_time(
+    func: Optional[Callable] = None, *, name: Optional[str] = None, logger: Optional[logging.Logger] = None
+):
+    """
+    This decorator can be placed above functions, methods and coroutines to time them.
+    Durations are recorded in the histogram of `name`, by default the qualified name of the function,
+    see `timings.snapshot()`, while timings are enabled. The execution time is always logged to `logger`,
+    or for methods whose first parameter is `self` to the field named 'logger' of the instance.
     """
     # Ex:
     # class Test:
-    #   @log_execution_time
+    #   @debug_execution_time
     #   def testing(self):
     #       pass
-    @wraps(func)
-    def wrapper(self, *args, **kwargs):
-        start_time = time.time()
-        result = func(self, *args, **kwargs)
-        elapsed = time.time() - start_time
-
-        if hasattr(self, "logger") and self.logger:
-            self.logger.debug(f"Completed metric collection for function '{func.__name__}' in {elapsed}s")
-        return result
-    return wrapper
\ No newline at end of file
+    #
+    #   @debug_execution_time(name="test.collect")
+    #   async def collect(self):
+    #       pass
+    if func is None:
+        return functools.partial(debug_execution_time, name=name, logger=logger)
+
+    timer_name = name or func.__qualname__
+    function_name = func.__name__
+    # Free functions never guess a logger from their first argument
+    log_self = logger is None and _is_method(func)
+
+    if inspect.iscoroutinefunction(func):
+
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs) -> Any:
+            start = time.perf_counter_ns()
+            error = True
+            try:
+                result = await func(*args, **kwargs)
+                error = False
+                return result
+            finally:
+                elapsed = time.perf_counter_ns() - start
+                if timings.enabled:
+                    timings.record(timer_name, elapsed, error)
+                _log(function_name, logger, args if log_self else (), elapsed)
+
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs) -> Any:
+        start = time.perf_counter_ns()
+        error = True
+        try:
+            result = func(*args, **kwargs)
+            error = False
+            return result
+        finally:
+            elapsed = time.perf_counter_ns() - start
+            if timings.enabled:
+                timings.record(timer_name, elapsed, error)
+            _log(function_name, logger, args if log_self else (), elapsed)
+
+    return wrapper
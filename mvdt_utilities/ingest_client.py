@@ -0,0 +1,319 @@
+import gzip
+import http.client
+import logging
+import queue
+import random
+import socket
+import ssl
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+from urllib.parse import urlsplit
+
+from .oneagent_info import get_deployment_config
+from .metric_lines import MAX_PAYLOAD_BYTES
+
+INGEST_PATH = "/api/v2/metrics/ingest"
+
+# Flush markers and the stop marker share the queue with the lines, so they're handled after the lines before them
+_STOP = object()
+
+
+class IngestException(Exception):
+    pass
+
+
+class _Server:
+    __slots__ = ("url", "scheme", "netloc", "path")
+
+    def __init__(self, url: str):
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.netloc:
+            raise ValueError(f"Invalid ingest base URL: {url}")
+        self.url = url
+        self.scheme = parts.scheme
+        self.netloc = parts.netloc
+        self.path = parts.path.rstrip("/") + INGEST_PATH
+
+
+class MetricsIngestClient:
+    """
+    Sends metric lines to the metrics ingest API of the tenant the OneAgent reports to.
+    Lines are queued and sent by a background thread in gzipped payloads of at most `max_payload_bytes`,
+    at least every `flush_interval` seconds. Connections are kept alive between payloads.
+    Failed payloads are retried with jittered exponential backoff, moving on to the next server of
+    deployment.conf when a server can't be reached or fails.
+    `client = MetricsIngestClient(token=api_token)`
+    `client.add_payloads(monitoring.payloads())`
+    `client.close()`
+
+    `base_urls` - The tenant URLs to send to in priority order, by default the endpoints of deployment.conf,
+    e.g. `["http://127.0.0.1:8080"]` to send to a local server
+    `queue_size` - Lines that can wait to be sent, a payload counts for the lines it holds. When the queue is full
+    `add` blocks for up to `put_timeout` seconds, None blocks until there is room, then the lines are dropped.
+    Lines added once the client is closed are dropped too.
+    """
+
+    def __init__(
+        self,
+        base_urls: Optional[List[str]] = None,
+        token: Optional[str] = None,
+        max_payload_bytes: int = MAX_PAYLOAD_BYTES,
+        flush_interval: float = 10,
+        queue_size: int = 100_000,
+        put_timeout: Optional[float] = 0,
+        max_retries: int = 3,
+        backoff: float = 0.5,
+        max_backoff: float = 30,
+        timeout: float = 10,
+        ssl_context: Optional[ssl.SSLContext] = None,
+        logger: logging.Logger | None = None,
+    ):
+        self.logger = logger or logging.getLogger(__name__)
+        self._token = token
+        self._max_payload_bytes = max_payload_bytes
+        self._flush_interval = flush_interval
+        self._put_timeout = put_timeout
+        self._max_retries = max_retries
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._timeout = timeout
+        self._ssl_context = ssl_context
+
+        self._servers_lock = threading.Lock()
+        self._servers: List[_Server] = []
+        self._server_index = 0
+        self.set_endpoints(base_urls if base_urls is not None else get_deployment_config().endpoints())
+
+        # Only used by the thread sending the payloads
+        self._connections: Dict[str, http.client.HTTPConnection] = {}
+
+        # The queue itself is unbounded, it's bounded by the lines it holds
+        self._queue: "queue.Queue" = queue.Queue()
+        self._queue_size = queue_size
+        self._queued_lines = 0
+        self._space = threading.Condition()
+        self._closed = False
+        self._stop = threading.Event()
+
+        self.sent_lines = 0
+        self.sent_payloads = 0
+        self.failed_payloads = 0
+        self.dropped_lines = 0
+        self.retries = 0
+
+        self._thread = threading.Thread(target=self._run, name="metrics ingest", daemon=True)
+        self._thread.start()
+
+    def set_endpoints(self, base_urls: List[str]):
+        """
+        Replaces the servers payloads are sent to, e.g. from a DeploymentConfigWatcher.
+        """
+        servers = [_Server(url) for url in base_urls]
+        if not servers:
+            raise ValueError("At least one ingest base URL is required")
+        with self._servers_lock:
+            self._servers = servers
+            self._server_index = 0
+
+    def add(self, line: str | bytes) -> bool:
+        """
+        Queues a line, or several encoded lines separated by newlines.
+        Returns False when they were dropped because the queue was full or the client is closed.
+        """
+        lines = line.count("\n" if isinstance(line, str) else b"\n") + 1
+        with self._space:
+            if not self._closed and self._put_timeout != 0:
+                self._space.wait_for(lambda: self._closed or self._has_room(lines), self._put_timeout)
+            if self._closed or not self._has_room(lines):
+                first_drop = not self.dropped_lines
+                self.dropped_lines += lines
+                if first_drop:
+                    reason = "closed" if self._closed else "full"
+                    self.logger.warning(f"The metrics ingest queue is {reason}, dropping lines")
+                return False
+            self._queued_lines += lines
+            # Under the lock, so a line is never queued behind the stop marker of close
+            self._queue.put(line)
+        return True
+
+    def _has_room(self, lines: int) -> bool:
+        # A payload larger than the whole queue still goes through once the queue is empty
+        return self._queued_lines + lines <= self._queue_size or not self._queued_lines
+
+    def add_lines(self, lines: Iterable[str]) -> int:
+        """
+        Queues the lines, returns how many were dropped because the queue was full.
+        """
+        return sum(1 for line in lines if not self.add(line))
+
+    def add_payloads(self, payloads: Iterable[bytes]) -> int:
+        """
+        Queues payloads built by a MetricLineBuilder, each counts for the lines it holds.
+        Returns how many payloads were dropped because the queue was full.
+        """
+        return sum(1 for payload in payloads if not self.add(payload))
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Waits until the lines queued so far were sent or given up on, returns False on timeout.
+        """
+        flushed = threading.Event()
+        self._queue.put(flushed)
+        return flushed.wait(timeout)
+
+    def close(self, timeout: Optional[float] = None):
+        """
+        Sends the queued lines and stops the background thread, lines added afterwards are dropped.
+        """
+        with self._space:
+            self._closed = True
+            self._queue.put(_STOP)
+            self._space.notify_all()
+        self._thread.join(timeout)
+        # Interrupts the retries of a payload that didn't make it within the timeout,
+        # closing its connection ends a request that is still waiting for the server
+        self._stop.set()
+        # Copied at once, the background thread may still be replacing a connection
+        for connection in self._connections.copy().values():
+            if connection.sock is not None:
+                try:
+                    # Closing alone doesn't wake up a thread blocked reading from the socket
+                    connection.sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+            connection.close()
+        self._connections.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "sent_lines": self.sent_lines,
+            "sent_payloads": self.sent_payloads,
+            "failed_payloads": self.failed_payloads,
+            "dropped_lines": self.dropped_lines,
+            "retries": self.retries,
+            "queued_lines": self._queued_lines,
+        }
+
+    def _run(self):
+        batch: List[bytes] = []
+        size = 0
+        deadline = 0.0
+        while True:
+            wait = self._flush_interval if not batch else max(deadline - time.monotonic(), 0)
+            try:
+                item = self._queue.get(timeout=wait)
+            except queue.Empty:
+                item = None
+
+            if isinstance(item, (str, bytes)):
+                line = item.encode() if isinstance(item, str) else item
+                with self._space:
+                    self._queued_lines -= line.count(b"\n") + 1
+                    self._space.notify_all()
+                if batch and size + len(line) + 1 > self._max_payload_bytes:
+                    self._send(batch)
+                    batch, size = [], 0
+                if not batch:
+                    deadline = time.monotonic() + self._flush_interval
+                batch.append(line)
+                size += len(line) + 1
+                continue
+
+            if batch:
+                self._send(batch)
+                batch, size = [], 0
+            if isinstance(item, threading.Event):
+                item.set()
+            elif item is _STOP:
+                return
+
+    def _send(self, batch: List[bytes]):
+        body = b"\n".join(batch)
+        # Payloads of a MetricLineBuilder hold several lines
+        lines = body.count(b"\n") + 1
+        try:
+            self._post(gzip.compress(body, compresslevel=6))
+            self.sent_lines += lines
+            self.sent_payloads += 1
+        except Exception as e:
+            self.failed_payloads += 1
+            self.logger.error(f"Could not send {lines} metric lines: {e}")
+
+    def _post(self, body: bytes):
+        attempt = 0
+        while True:
+            with self._servers_lock:
+                server = self._servers[self._server_index % len(self._servers)]
+
+            failover = True
+            try:
+                status, response = self._request(server, body)
+                if status < 300:
+                    return
+                error: Exception = IngestException(f"{server.url} returned {status}: {response}")
+                if status != 429 and status < 500:
+                    # The payload itself was rejected, sending it again won't help
+                    raise error
+                # Too many requests is about the payload rate, not about the server
+                failover = status != 429
+            except (OSError, http.client.HTTPException) as e:
+                error = e
+
+            attempt += 1
+            if attempt > self._max_retries:
+                raise IngestException(f"Giving up after {attempt} attempts: {error}")
+
+            if failover:
+                with self._servers_lock:
+                    if len(self._servers) > 1:
+                        self._server_index = (self._server_index + 1) % len(self._servers)
+                        self.logger.warning(f"Failing over from {server.url}: {error}")
+
+            self.retries += 1
+            delay = random.uniform(0, min(self._max_backoff, self._backoff * 2 ** (attempt - 1)))
+            if self._stop.wait(delay):
+                raise IngestException(f"Closed while retrying: {error}")
+
+    def _request(self, server: _Server, body: bytes):
+        connection = self._connections.get(server.url)
+        # Servers close idle keep-alive connections, which only shows when the next request is sent on it
+        reused = connection is not None and connection.sock is not None
+        if connection is None:
+            connection = self._connect(server)
+
+        headers = {
+            "Content-Type": "text/plain; charset=utf-8",
+            "Content-Encoding": "gzip",
+        }
+        if self._token:
+            headers["Authorization"] = f"Api-Token {self._token}"
+
+        try:
+            return self._exchange(connection, server, body, headers)
+        except (ConnectionResetError, BrokenPipeError, ConnectionAbortedError) as e:
+            # RemoteDisconnected is a ConnectionResetError. A stale connection isn't a failure of the server,
+            # send once more on a new connection before it counts as one
+            if not reused:
+                raise
+            self.logger.debug(f"Reconnecting to {server.url}, the kept alive connection was closed: {e}")
+            return self._exchange(self._connect(server), server, body, headers)
+
+    def _connect(self, server: _Server) -> http.client.HTTPConnection:
+        if server.scheme == "https":
+            connection = http.client.HTTPSConnection(server.netloc, timeout=self._timeout, context=self._ssl_context)
+        else:
+            connection = http.client.HTTPConnection(server.netloc, timeout=self._timeout)
+        self._connections[server.url] = connection
+        return connection
+
+    def _exchange(self, connection: http.client.HTTPConnection, server: _Server, body: bytes, headers: Dict[str, str]):
+        try:
+            connection.request("POST", server.path, body, headers)
+            response = connection.getresponse()
+            return response.status, response.read().decode(errors="replace")
+        except Exception:
+            # The connection can't be reused after an error, the next request opens a new one
+            connection.close()
+            self._connections.pop(server.url, None)
+            raise
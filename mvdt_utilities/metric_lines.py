@@ -0,0 +1,210 @@
+import math
+import re
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+# The ingest API rejects payloads larger than 1 MB
+MAX_PAYLOAD_BYTES = 1_000_000
+
+# https://docs.dynatrace.com/docs/extend-dynatrace/extend-metrics/reference/metric-ingestion-protocol
+MAX_METRIC_KEY_LENGTH = 250
+MAX_DIMENSION_KEY_LENGTH = 100
+MAX_DIMENSION_VALUE_LENGTH = 250
+
+_INVALID_KEY_CHARACTERS = re.compile(r"[^a-z0-9_.:-]")
+_INVALID_METRIC_KEY_CHARACTERS = re.compile(r"[^A-Za-z0-9_.:-]")
+_QUOTED_CHARACTERS = re.compile(r'[ ,="\\]')
+_CONTROL_CHARACTERS = re.compile(r"[\x00-\x1f]")
+
+
+def normalize_metric_key(key: str) -> str:
+    """
+    Replaces the characters the protocol doesn't allow in metric keys with underscores.
+    Throws: A ValueError when the key doesn't start with a letter.
+    """
+    normalized = _INVALID_METRIC_KEY_CHARACTERS.sub("_", key)[:MAX_METRIC_KEY_LENGTH]
+    if not normalized or not ("a" <= normalized[0].lower() <= "z"):
+        raise ValueError(f"Invalid metric key {key!r}, metric keys must start with a letter")
+    return normalized
+
+
+@lru_cache(maxsize=1024)
+def normalize_dimension_key(key: str) -> str:
+    """
+    Lowercases the key and replaces the characters the protocol doesn't allow with underscores.
+    """
+    key = _INVALID_KEY_CHARACTERS.sub("_", key.lower())[:MAX_DIMENSION_KEY_LENGTH]
+    if not key or not key[0].isalpha():
+        key = f"_{key}"[:MAX_DIMENSION_KEY_LENGTH]
+    return key
+
+
+def escape_dimension_value(value: str) -> str:
+    """
+    Quotes the value when it contains a space, comma, equal sign, quote or backslash,
+    escaping the quotes and backslashes in it. Line breaks and other control characters become spaces.
+    `escape_dimension_value('C:\\Program Files')` -> `"C:\\\\Program Files"`
+    """
+    if value.isalnum() and len(value) <= MAX_DIMENSION_VALUE_LENGTH:
+        return value
+    if not value.isprintable():
+        value = _CONTROL_CHARACTERS.sub(" ", value)
+    value = value[:MAX_DIMENSION_VALUE_LENGTH]
+    if _QUOTED_CHARACTERS.search(value) is None:
+        return value
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def format_number(value: float) -> Optional[str]:
+    """
+    The shortest representation of the value, None for NaN and infinity which the protocol doesn't accept.
+    Booleans become 1 and 0.
+    """
+    if type(value) is int:
+        return str(value)
+    if isinstance(value, int):
+        # bool and int enums would otherwise be written by name
+        return str(int(value))
+    value = float(value)
+    if not math.isfinite(value):
+        return None
+    if value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+def encode_dimensions(dimensions: Dict[str, str]) -> str:
+    """
+    The dimensions as they follow the metric key, dimensions without a value are left out.
+    """
+    return "".join(
+        f",{normalize_dimension_key(k)}={escape_dimension_value(str(v))}"
+        for k, v in dimensions.items()
+        if v is not None and v != ""
+    )
+
+
+class MetricLineBuilder:
+    """
+    Builds metric lines straight into a reusable buffer, split into payloads of at most `max_payload_bytes`.
+    The metric key and the dimensions that don't change between lines are validated, escaped and encoded
+    once as a prefix, per line only the varying dimensions and the value are added.
+    Dimensions without a value are left out, values that aren't finite numbers skip the line.
+    `services = builder.prefix("win.service.state", {"host": host})`
+    `for service in helper.run_command("Get-Service"):`
+    `    builder.gauge(services, 1 if service["Status"] == "Running" else 0, {"service": service["Name"]})`
+    `client.add_payloads(builder.payloads())`
+    """
+
+    def __init__(
+        self, max_payload_bytes: int = MAX_PAYLOAD_BYTES, default_dimensions: Optional[Dict[str, str]] = None
+    ):
+        # The leading newline of the buffer isn't part of the payload
+        self._buffer_limit = max_payload_bytes + 1
+        self._default_dimensions = encode_dimensions(default_dimensions) if default_dimensions else ""
+        self._prefixes: Dict[tuple, bytes] = {}
+        self._keys: Dict[str, str] = {}
+        # Every line starts with a newline, the one of the first line is left out of the payload
+        self._buffer = bytearray()
+        self._payloads: List[bytes] = []
+        self.skipped = 0
+
+    def prefix(self, key: str, dimensions: Optional[Dict[str, str]] = None) -> bytes:
+        """
+        The metric key with the default and the given dimensions, cached per key and dimensions.
+        Throws: A ValueError when the metric key doesn't start with a letter.
+        """
+        cache_key = (key, tuple(dimensions.items()) if dimensions else ())
+        prefix = self._prefixes.get(cache_key)
+        if prefix is None:
+            prefix = self._prefixes[cache_key] = (
+                f"\n{normalize_metric_key(key)}{self._default_dimensions}"
+                f"{encode_dimensions(dimensions) if dimensions else ''}"
+            ).encode()
+        return prefix
+
+    def gauge(
+        self, prefix: bytes, value: float, dimensions: Optional[Dict[str, str]] = None, timestamp: Optional[int] = None
+    ) -> bool:
+        value = format_number(value)
+        if value is None:
+            self.skipped += 1
+            return False
+        return self._add(prefix, dimensions, f" gauge,{value}", timestamp)
+
+    def count(
+        self, prefix: bytes, delta: float, dimensions: Optional[Dict[str, str]] = None, timestamp: Optional[int] = None
+    ) -> bool:
+        delta = format_number(delta)
+        if delta is None:
+            self.skipped += 1
+            return False
+        return self._add(prefix, dimensions, f" count,delta={delta}", timestamp)
+
+    def summary(
+        self,
+        prefix: bytes,
+        minimum: float,
+        maximum: float,
+        total: float,
+        count: int,
+        dimensions: Optional[Dict[str, str]] = None,
+        timestamp: Optional[int] = None,
+    ) -> bool:
+        minimum, maximum, total = format_number(minimum), format_number(maximum), format_number(total)
+        if minimum is None or maximum is None or total is None:
+            self.skipped += 1
+            return False
+        value = f" gauge,min={minimum},max={maximum},sum={total},count={int(count)}"
+        return self._add(prefix, dimensions, value, timestamp)
+
+    def payloads(self) -> List[bytes]:
+        """
+        Returns the payloads built so far and starts over, the cached prefixes are kept.
+        """
+        if self._buffer:
+            self._payloads.append(bytes(self._buffer[1:]))
+            self._buffer.clear()
+        payloads, self._payloads = self._payloads, []
+        return payloads
+
+    def _add(self, prefix: bytes, dimensions: Optional[Dict[str, str]], value: str, timestamp: Optional[int]) -> bool:
+        line = value if timestamp is None else f"{value} {timestamp}"
+        if dimensions:
+            encoded = ""
+            keys = self._keys
+            for dimension_key, dimension_value in dimensions.items():
+                if type(dimension_value) is not str:
+                    if dimension_value is None:
+                        continue
+                    dimension_value = str(dimension_value)
+                if not dimension_value:
+                    continue
+                encoded_key = keys.get(dimension_key)
+                if encoded_key is None:
+                    encoded_key = keys[dimension_key] = f",{normalize_dimension_key(dimension_key)}="
+                # Checking is cheaper than caching the escaped values, most of them are unique within a cycle.
+                # Letters and digits alone, the most common case, never need escaping.
+                if len(dimension_value) > MAX_DIMENSION_VALUE_LENGTH or not (
+                    dimension_value.isalnum()
+                    or (dimension_value.isprintable() and _QUOTED_CHARACTERS.search(dimension_value) is None)
+                ):
+                    dimension_value = escape_dimension_value(dimension_value)
+                encoded = f"{encoded}{encoded_key}{dimension_value}"
+            line = f"{encoded}{line}"
+
+        buffer = self._buffer
+        start = len(buffer)
+        buffer += prefix
+        buffer += line.encode()
+
+        # The line is appended first and moved to the next payload in the rare case it doesn't fit anymore
+        if len(buffer) > self._buffer_limit:
+            if start:
+                self._payloads.append(bytes(buffer[1:start]))
+                del buffer[:start]
+            if len(buffer) > self._buffer_limit:
+                buffer.clear()
+                self.skipped += 1
+                return False
+        return True
@@ -1,7 +1,8 @@
 import logging
 import os
+import threading
 from pathlib import Path
-from typing import Optional
+from typing import Callable, Dict, List, Optional, Tuple
 from urllib.parse import urlparse
 
 log = logging.getLogger(__name__)
@@ -20,23 +21,55 @@ def get_config_dir() -> Path:
 
     raise Exception("Could not find the OneAgent config directory")
 
-def get_communication_endpoint() -> str:
-    config_dir = get_config_dir()
-    log.info(f"Using config dir: {config_dir}")
-    deployment_conf_path = (config_dir / "deployment.conf").absolute()
-    if not deployment_conf_path.exists():
-        raise Exception(f"File deployment.conf was not found at: {deployment_conf_path}")
+class DeploymentConfig:
+    """
+    The communication settings of the OneAgent, read from deployment.conf.
+    `servers` are in the order of the file, `active_server` is the one the OneAgent currently uses.
+    """
+
+    def __init__(self, path: Path, tenant: str, servers: List[str], active_server: str):
+        self.path = path
+        self.tenant = tenant
+        self.servers = servers
+        self.active_server = active_server
+
+    @property
+    def endpoint(self) -> str:
+        return self._tenant_url(self.active_server)
+
+    def endpoints(self) -> List[str]:
+        """
+        The tenant URL of every server in priority order, the active one first.
+        """
+        urls = [self.endpoint] + [self._tenant_url(s) for s in self.servers]
+        return list(dict.fromkeys(urls))
+
+    def _tenant_url(self, server: str) -> str:
+        # Split into parts and reassemble without path
+        # https://lwp00649.dynatrace.com:443/communication -> https://lwp00649.dynatrace.com:443
+        # https://sg-us.dynatracelabs.com/communication -> https://sg-us.dynatracelabs.com
+        parsed = urlparse(server)
+        return f"{parsed.scheme}://{parsed.netloc}/e/{self.tenant}"
+
+    def __eq__(self, other):
+        if not isinstance(other, DeploymentConfig):
+            return NotImplemented
+        return (self.tenant, self.servers, self.active_server) == (other.tenant, other.servers, other.active_server)
+
+    def __repr__(self):
+        return f"DeploymentConfig(tenant={self.tenant!r}, servers={self.servers!r}, active_server={self.active_server!r})"
 
+
+def _parse_deployment_conf(deployment_conf_path: Path) -> DeploymentConfig:
     servers: Optional[str] = None
     environment_id: Optional[str] = None
     try:
         with open(deployment_conf_path) as dc:
-            for line in dc.readlines():
-                if "Server={" in line:
-                    _, content = line.split("=")
-                    servers = content
-                elif "Tenant=" in line:
-                    _, content = line.split("=")
+            for line in dc:
+                key, _, content = line.partition("=")
+                if key.strip() == "Server" and content.lstrip().startswith("{"):
+                    servers = content.strip()
+                elif key.strip() == "Tenant":
                     environment_id = content.strip()
         if servers is None:
             raise Exception("Missing mandatory 'Server=' section of the file")
@@ -45,23 +78,109 @@ def get_communication_endpoint() -> str:
     except Exception as e:
         raise Exception(f"Could not read deployment.conf at {deployment_conf_path}: {e}")
 
+    server_list: List[str] = []
     main_server: Optional[str] = None
     server_sections = [p.strip().rstrip("}") for p in servers.split("{") if p]
     for part in server_sections:
-        server_list = [s.strip() for s in part.split(";") if s]
-        for candidate in server_list:
+        for candidate in (s.strip() for s in part.split(";")):
+            if not candidate:
+                continue
             if candidate.startswith("*"):
-                main_server = candidate.lstrip("*")
-
-                # Split into parts and reassemble without path
-                # https://lwp00649.dynatrace.com:443/communication -> https://lwp00649.dynatrace.com:443
-                # https://sg-us.dynatracelabs.com/communication -> https://sg-us.dynatracelabs.com
-                parsed = urlparse(main_server)
-                main_server = f"{parsed.scheme}://{parsed.netloc}/e/{environment_id}"
+                candidate = candidate.lstrip("*")
+                main_server = candidate
+            server_list.append(candidate)
 
     if not main_server:
         raise Exception("Could not identify communication endpoint in deployment.conf")
-    else:
-        log.info(f"Identified server communication endpoint to be: {main_server}")
 
-    return main_server
+    config = DeploymentConfig(deployment_conf_path, environment_id, server_list, main_server)
+    log.info(f"Identified server communication endpoint to be: {config.endpoint}")
+    return config
+
+
+_cache_lock = threading.Lock()
+_cache: Dict[Path, Tuple[Tuple[int, int], DeploymentConfig]] = {}
+
+
+def get_deployment_config(deployment_conf_path: Optional[Path] = None) -> DeploymentConfig:
+    """
+    Returns the parsed deployment.conf of the OneAgent.
+    The file is only parsed again when its modification time or size changed.
+    """
+    if deployment_conf_path is None:
+        config_dir = get_config_dir()
+        deployment_conf_path = (config_dir / "deployment.conf").absolute()
+
+    try:
+        stat = deployment_conf_path.stat()
+    except FileNotFoundError:
+        raise Exception(f"File deployment.conf was not found at: {deployment_conf_path}")
+    version = (stat.st_mtime_ns, stat.st_size)
+
+    with _cache_lock:
+        cached = _cache.get(deployment_conf_path)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    log.info(f"Reading {deployment_conf_path}")
+    config = _parse_deployment_conf(deployment_conf_path)
+    with _cache_lock:
+        _cache[deployment_conf_path] = (version, config)
+    return config
+
+
+def get_communication_endpoint() -> str:
+    return get_deployment_config().endpoint
+
+
+class DeploymentConfigWatcher:
+    """
+    Polls deployment.conf and calls `callback` with the new DeploymentConfig when the servers or the tenant
+    change, so long-running extensions follow the OneAgent when it moves to another endpoint.
+    `watcher = DeploymentConfigWatcher(lambda config: client.set_endpoints(config.endpoints()))`
+    `watcher.start()`
+    """
+
+    def __init__(
+        self,
+        callback: Callable[[DeploymentConfig], None],
+        interval: float = 60,
+        deployment_conf_path: Optional[Path] = None,
+    ):
+        self._callback = callback
+        self._interval = interval
+        self._path = deployment_conf_path
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.config: Optional[DeploymentConfig] = None
+
+    def start(self):
+        self.config = get_deployment_config(self._path)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="deployment.conf watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def check(self) -> bool:
+        """
+        Reads deployment.conf once, returns True when it changed since the last check.
+        """
+        config = get_deployment_config(self._path)
+        if config == self.config:
+            return False
+        log.info(f"Communication endpoint changed from {self.config} to {config}")
+        self.config = config
+        self._callback(config)
+        return True
+
+    def _run(self):
+        while not self._stop.wait(self._interval):
+            try:
+                self.check()
+            except Exception as e:
+                log.warning(f"Could not check deployment.conf for changes: {e}")
@@ -0,0 +1,157 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class _Entry:
+    __slots__ = ("value", "expires_at")
+
+    def __init__(self, value: Any, ttl: float):
+        self.value = value
+        self.expires_at = time.monotonic() + ttl
+
+
+class _Flight:
+    """
+    A load in progress, concurrent callers for the same key wait on it instead of loading again.
+    """
+
+    __slots__ = ("done", "value", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class ResultCache:
+    """
+    A thread-safe cache of results with a TTL per entry, bounded in size with LRU eviction.
+
+    Concurrent callers missing the same key share a single call of the loader.
+    With `stale_while_revalidate` an expired entry is still returned while it's refreshed in the background,
+    so callers never wait for a refresh once a key has been loaded. Entries that expired more than `max_stale`
+    seconds ago are not served anymore and are loaded again like a miss, by default `max_stale` is the TTL.
+    With `serve_stale_on_error` the last good value of a key is returned when loading it again fails,
+    as long as it expired less than `max_stale` seconds ago.
+    Pass `max_stale=math.inf` to serve stale values for as long as loading them again fails.
+    `cache = ResultCache(maxsize=64, ttl=300)`
+    `roles = cache.get(("server", "Get-WindowsFeature"), lambda: helper.run_command("Get-WindowsFeature"))`
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 128,
+        ttl: float = 60,
+        stale_while_revalidate: bool = False,
+        max_stale: Optional[float] = None,
+        serve_stale_on_error: bool = False,
+        logger: logging.Logger | None = None,
+    ):
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._stale_while_revalidate = stale_while_revalidate
+        self._max_stale = ttl if max_stale is None else max_stale
+        self._serve_stale_on_error = serve_stale_on_error
+        self.logger = logger or logging.getLogger(__name__)
+
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self._flights: Dict[Hashable, _Flight] = {}
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.errors = 0
+
+    def get(self, key: Hashable, loader: Callable[[], Any], ttl: Optional[float] = None) -> Any:
+        """
+        Returns the cached value for `key`, calling `loader` when there is none.
+
+        `ttl` - Overrides the TTL of the cache for this key when it's (re)loaded
+        """
+        ttl = self._ttl if ttl is None else ttl
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                now = time.monotonic()
+                if now < entry.expires_at:
+                    self.hits += 1
+                    return entry.value
+                if self._stale_while_revalidate and now - entry.expires_at < self._max_stale:
+                    self.stale_hits += 1
+                    if key not in self._flights:
+                        self.refreshes += 1
+                        flight = self._flights[key] = _Flight()
+                        threading.Thread(
+                            target=self._load,
+                            args=(key, flight, loader, ttl),
+                            name=f"ResultCache refresh {key}",
+                            daemon=True,
+                        ).start()
+                    return entry.value
+
+            self.misses += 1
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if leader:
+            self._load(key, flight, loader, ttl)
+        else:
+            flight.done.wait()
+
+        if flight.error is not None:
+            if self._serve_stale_on_error and entry is not None and (
+                time.monotonic() - entry.expires_at < self._max_stale
+            ):
+                self.logger.warning(f"Serving the last good value for {key}")
+                return entry.value
+            raise flight.error
+        return flight.value
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "refreshes": self.refreshes,
+                "errors": self.errors,
+                "size": len(self._entries),
+            }
+
+    def _load(self, key: Hashable, flight: _Flight, loader: Callable[[], Any], ttl: float):
+        try:
+            flight.value = loader()
+        except BaseException as e:
+            self.logger.warning(f"Could not load the cached value for {key}: {e}")
+            flight.error = e
+
+        with self._lock:
+            if flight.error is not None:
+                self.errors += 1
+            else:
+                self._entries[key] = _Entry(flight.value, ttl)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self._maxsize:
+                    self._entries.popitem(last=False)
+            del self._flights[key]
+        flight.done.set()
@@ -0,0 +1,161 @@
+import logging
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from .execution_time import Timings, timings
+from .metric_lines import MAX_PAYLOAD_BYTES, MetricLineBuilder
+
+_Series = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+class _Summary:
+    __slots__ = ("min", "max", "sum", "count")
+
+    def __init__(self):
+        self.min = 0.0
+        self.max = 0.0
+        self.sum = 0.0
+        self.count = 0
+
+    def add(self, value: float):
+        if not self.count or value < self.min:
+            self.min = value
+        if not self.count or value > self.max:
+            self.max = value
+        self.sum += value
+        self.count += 1
+
+
+class SelfMonitoring:
+    """
+    Collects metrics about the extension itself as counters, gauges and summaries and serializes them
+    to the Dynatrace metric line protocol, so the cost of the extension shows up next to what it collects.
+    Attached to the timings, every timed function, WMI query and PowerShell command becomes a summary of its
+    duration in milliseconds, split by collector and by the dimensions of the timer (namespace, command, account).
+    `monitoring = SelfMonitoring(default_dimensions={"extension": "active_directory"}).attach()`
+    Then every cycle:
+    `client.add_payloads(monitoring.payloads())`
+
+    Metric keys are prefixed with `prefix`. To bound the cardinality at most `max_series` series are kept
+    between two exports, new ones are dropped.
+    """
+
+    def __init__(
+        self,
+        prefix: str = "mvdt.self",
+        default_dimensions: Optional[Dict[str, str]] = None,
+        max_series: int = 1000,
+        logger: logging.Logger | None = None,
+    ):
+        self._prefix = prefix
+        self._default_dimensions = dict(default_dimensions or {})
+        self._max_series = max_series
+        self.logger = logger or logging.getLogger(__name__)
+
+        self._lock = threading.Lock()
+        self._counters: Dict[_Series, float] = {}
+        self._gauges: Dict[_Series, float] = {}
+        self._summaries: Dict[_Series, _Summary] = {}
+        self._timings: Optional[Timings] = None
+        self.dropped = 0
+
+    def attach(self, source: Timings = timings) -> "SelfMonitoring":
+        """
+        Records the durations of `source` from now on.
+        """
+        source.add_listener(self._on_timing)
+        self._timings = source
+        return self
+
+    def detach(self):
+        if self._timings is not None:
+            self._timings.remove_listener(self._on_timing)
+            self._timings = None
+
+    def counter(self, key: str, value: float = 1, dimensions: Optional[Dict[str, str]] = None):
+        """
+        Adds `value` to a counter, exported as the delta since the previous export.
+        """
+        with self._lock:
+            series = self._series(key, dimensions, self._counters)
+            if series is not None:
+                self._counters[series] = self._counters.get(series, 0) + value
+
+    def gauge(self, key: str, value: float, dimensions: Optional[Dict[str, str]] = None):
+        """
+        Sets a gauge, exported with its last value.
+        """
+        with self._lock:
+            series = self._series(key, dimensions, self._gauges)
+            if series is not None:
+                self._gauges[series] = value
+
+    def summary(self, key: str, value: float, dimensions: Optional[Dict[str, str]] = None):
+        """
+        Adds an observation to a summary, exported as a min/max/sum/count gauge.
+        """
+        with self._lock:
+            series = self._series(key, dimensions, self._summaries)
+            if series is not None:
+                summary = self._summaries.get(series)
+                if summary is None:
+                    summary = self._summaries[series] = _Summary()
+                summary.add(value)
+
+    def payloads(
+        self, timestamp: Optional[int] = None, reset: bool = True, max_bytes: int = MAX_PAYLOAD_BYTES
+    ) -> List[bytes]:
+        """
+        Serializes every series to the metric line protocol, in payloads of at most `max_bytes`
+        for the metrics ingest API.
+
+        `timestamp` - In milliseconds, defaults to the current time
+        `reset` - Starts over for the next export, counters and summaries then cover the time between two exports
+        """
+        timestamp = int(time.time() * 1000) if timestamp is None else timestamp
+        with self._lock:
+            counters, gauges, summaries = self._counters, self._gauges, self._summaries
+            if reset:
+                self._counters, self._gauges, self._summaries = {}, {}, {}
+                self.dropped = 0
+
+        builder = MetricLineBuilder(max_bytes)
+        for series, value in counters.items():
+            builder.count(self._prefix_of(builder, series), value, timestamp=timestamp)
+        for series, value in gauges.items():
+            builder.gauge(self._prefix_of(builder, series), value, timestamp=timestamp)
+        for series, s in summaries.items():
+            builder.summary(self._prefix_of(builder, series), s.min, s.max, s.sum, s.count, timestamp=timestamp)
+        return builder.payloads()
+
+    def lines(self, timestamp: Optional[int] = None, reset: bool = True) -> List[str]:
+        """
+        Serializes every series to a line of the metric line protocol, see `payloads`.
+        """
+        return [line for payload in self.payloads(timestamp, reset) for line in payload.decode().split("\n")]
+
+    def _series(self, key: str, dimensions: Optional[Dict[str, str]], existing: Dict) -> Optional[_Series]:
+        merged = self._default_dimensions
+        if dimensions:
+            merged = {**merged, **dimensions}
+        series = (key, tuple(sorted(merged.items())))
+        if series in existing:
+            return series
+
+        if len(self._counters) + len(self._gauges) + len(self._summaries) >= self._max_series:
+            if not self.dropped:
+                self.logger.warning(f"More than {self._max_series} self-monitoring series, dropping {key}")
+            self.dropped += 1
+            return None
+        return series
+
+    def _prefix_of(self, builder: MetricLineBuilder, series: _Series) -> bytes:
+        key, dimensions = series
+        return builder.prefix(f"{self._prefix}.{key}" if self._prefix else key, dict(dimensions))
+
+    def _on_timing(self, name: str, duration_ns: int, error: bool, dimensions: Optional[Dict[str, str]]):
+        dimensions = {"collector": name, **dimensions} if dimensions else {"collector": name}
+        self.summary("duration", duration_ns / 1e6, dimensions)
+        if error:
+            self.counter("errors", 1, dimensions)
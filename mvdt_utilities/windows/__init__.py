@@ -1,3 +1,71 @@
-from .powershell import PowershellHelper, PowershellException
-from .wmi_connection import WMIConnection
-from .ldap_attributes import LdapAttributes, get_ldap_attributes, get_ldap_attributes_no_cache
\ No newline at end of file
+from typing import TYPE_CHECKING
+
+from .._lazy_imports import lazy_attributes
+
+_ATTRIBUTES = {
+    "PowershellHelper": ".powershell.powershell",
+    "PowershellException": ".powershell.powershell",
+    "PowershellTimeoutException": ".powershell.powershell",
+    "AsyncPowershellHelper": ".powershell.async_powershell",
+    "PowershellPool": ".powershell.powershell_pool",
+    "FORMAT_LIST": ".powershell.output_format",
+    "FORMAT_JSON": ".powershell.output_format",
+    "FORMAT_CSV": ".powershell.output_format",
+    "WMIConnection": ".wmi_connection",
+    "WMIConnectionPool": ".wmi_connection",
+    "WMIQueryException": ".wmi_connection",
+    "WMIRefresher": ".wmi_refresher",
+    "WMIQueryExecutor": ".wmi_executor",
+    "WMIJobResult": ".wmi_executor",
+    "UsnChangeTracker": ".usn_tracker",
+    "UsnChange": ".usn_tracker",
+    "LdapAttributes": ".ldap_attributes",
+    "configure_ldap_attributes_cache": ".ldap_attributes",
+    "get_ldap_attributes": ".ldap_attributes",
+    "get_ldap_attributes_bulk": ".ldap_attributes",
+    "get_ldap_attributes_no_cache": ".ldap_attributes",
+    "get_selected_ldap_attributes": ".ldap_attributes",
+    "TraceRecorder": ".replay",
+    "Trace": ".replay",
+    "RecordingLauncher": ".replay",
+    "ReplayLauncher": ".replay",
+    "RecordingLocator": ".replay",
+    "ReplayLocator": ".replay",
+    "ReplayException": ".replay",
+}
+
+__all__ = list(_ATTRIBUTES)
+__getattr__, __dir__ = lazy_attributes(__name__, _ATTRIBUTES)
+
+if TYPE_CHECKING:
+    from .powershell import (
+        PowershellHelper,
+        AsyncPowershellHelper,
+        PowershellException,
+        PowershellTimeoutException,
+        PowershellPool,
+        FORMAT_LIST,
+        FORMAT_JSON,
+        FORMAT_CSV,
+    )
+    from .wmi_connection import WMIConnection, WMIConnectionPool, WMIQueryException
+    from .wmi_refresher import WMIRefresher
+    from .wmi_executor import WMIQueryExecutor, WMIJobResult
+    from .usn_tracker import UsnChangeTracker, UsnChange
+    from .ldap_attributes import (
+        LdapAttributes,
+        configure_ldap_attributes_cache,
+        get_ldap_attributes,
+        get_ldap_attributes_bulk,
+        get_ldap_attributes_no_cache,
+        get_selected_ldap_attributes,
+    )
+    from .replay import (
+        TraceRecorder,
+        Trace,
+        RecordingLauncher,
+        ReplayLauncher,
+        RecordingLocator,
+        ReplayLocator,
+        ReplayException,
+    )
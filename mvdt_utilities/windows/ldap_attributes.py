@@ -1,60 +1,219 @@
+import math
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Dict, Iterable, List, Optional
+
+import pythoncom
 import win32com.client
-from cachetools.func import ttl_cache
+
+from ..result_cache import ResultCache
+
+# Attributes are served from the cache for 10 minutes, then for up to an hour more while they are refreshed
+# in the background, so a degraded DC only slows down the refresh and never the caller.
+# If a refresh fails the last good attributes keep being served until they expired an hour ago.
+LDAP_ATTRIBUTES_TTL = 10 * 60
+LDAP_ATTRIBUTES_MAX_STALE = 60 * 60
+LDAP_ATTRIBUTES_MAXSIZE = 16
+
+# Python attribute -> rootDSE attribute
+_LDAP_NAMES = {
+    "current_time": "currentTime",
+    "subschema_subentry": "subschemaSubentry",
+    "ds_service_name": "dsServiceName",
+    "naming_contexts": "namingContexts",
+    "default_naming_context": "defaultNamingContext",
+    "schema_naming_context": "schemaNamingContext",
+    "configuration_naming_context": "configurationNamingContext",
+    "root_domain_naming_context": "rootDomainNamingContext",
+    "supported_control": "supportedControl",
+    "supported_ldap_version": "supportedLDAPVersion",
+    "supported_ldap_policies": "supportedLDAPPolicies",
+    "highest_committed_usn": "highestCommittedUSN",
+    "supported_sasl_mechanisms": "supportedSASLMechanisms",
+    "dns_host_name": "dnsHostName",
+    "ldap_service_name": "ldapServiceName",
+    "server_name": "serverName",
+    "supported_capabilities": "supportedCapabilities",
+    "is_synchronized": "isSynchronized",
+    "is_global_catalog_ready": "isGlobalCatalogReady",
+    "domain_functionality": "domainFunctionality",
+    "forest_functionality": "forestFunctionality",
+    "domain_controller_functionality": "domainControllerFunctionality",
+    "name": "name",
+    "parent": "parent",
+    # Flexible Single-Master Operation: The distinguished name of the DC where the schema can be modified.
+    "fsmo_owner": "fSMORoleOwner",
+}
+
+# Properties of the ADSI object itself, available without loading any attribute
+_ADSI_PROPERTIES = {"name", "parent"}
+
 
 class LdapAttributes:
-    def __init__(self, ldap_object):
-        self.current_time = getattr(ldap_object, "currentTime", None)
-        self.subschema_subentry = getattr(ldap_object, "subschemaSubentry", None)
-        self.ds_service_name = getattr(ldap_object, "dsServiceName", None)
-        self.naming_contexts = getattr(ldap_object, "namingContexts", None)
-        self.default_naming_context = getattr(ldap_object, "defaultNamingContext", None)
-        self.schema_naming_context = getattr(ldap_object, "schemaNamingContext", None)
-        self.configuration_naming_context = getattr(
-            ldap_object, "configurationNamingContext", None
-        )
-        self.root_domain_naming_context = getattr(
-            ldap_object, "rootDomainNamingContext", None
-        )
-        self.supported_control = getattr(ldap_object, "supportedControl", None)
-        self.supported_ldap_version = getattr(ldap_object, "supportedLDAPVersion", None)
-        self.supported_ldap_policies = getattr(
-            ldap_object, "supportedLDAPPolicies", None
-        )
-        self.highest_committed_usn = getattr(ldap_object, "highestCommittedUSN", None)
-        self.supported_sasl_mechanisms = getattr(
-            ldap_object, "supportedSASLMechanisms", None
-        )
-        self.dns_host_name = getattr(ldap_object, "dnsHostName", None)
-        self.ldap_service_name = getattr(ldap_object, "ldapServiceName", None)
-        self.server_name = getattr(ldap_object, "serverName", None)
-        self.supported_capabilities = getattr(
-            ldap_object, "supportedCapabilities", None
-        )
-        self.is_synchronized = getattr(ldap_object, "isSynchronized", None)
-        self.is_global_catalog_ready = getattr(
-            ldap_object, "isGlobalCatalogReady", None
-        )
-        self.domain_functionality = getattr(ldap_object, "domainFunctionality", None)
-        self.forest_functionality = getattr(ldap_object, "forestFunctionality", None)
-        self.domain_controller_functionality = getattr(
-            ldap_object, "domainControllerFunctionality", None
-        )
-        self.name = getattr(ldap_object, "name", None)
-        self.parent = getattr(ldap_object, "parent", None)
-
-        # Flexible Single-Master Operation: The distinguished name of the DC where the schema can be modified.
-        self.fsmo_owner = getattr(ldap_object, "fSMORoleOwner", None)
-
-
-# Cache this so that it only runs every 10 minutes
-@ttl_cache(maxsize=16, ttl=10 * 60)
+    """
+    The rootDSE attributes of a DC.
+    Without `attributes` every attribute is read right away. With `attributes`, the rootDSE attribute names
+    that were loaded with GetInfoEx, each of them is read on its first access. Any other attribute is loaded
+    from the DC with its own GetInfoEx on first access.
+    """
+
+    __slots__ = tuple(_LDAP_NAMES) + ("_ldap_object", "_loaded")
+
+    def __init__(self, ldap_object, attributes: Optional[Iterable[str]] = None):
+        if attributes is None:
+            for name, ldap_name in _LDAP_NAMES.items():
+                setattr(self, name, getattr(ldap_object, ldap_name, None))
+            self._ldap_object = None
+            self._loaded = frozenset()
+        else:
+            self._ldap_object = ldap_object
+            self._loaded = frozenset(a.lower() for a in attributes) | _ADSI_PROPERTIES
+
+    def __getattr__(self, name: str):
+        # Only called for attributes that were not read yet
+        ldap_name = _LDAP_NAMES.get(name)
+        if ldap_name is None:
+            raise AttributeError(f"'LdapAttributes' object has no attribute '{name}'")
+
+        if ldap_name.lower() not in self._loaded:
+            self._ldap_object.GetInfoEx([ldap_name], 0)
+            self._loaded = self._loaded | {ldap_name.lower()}
+        value = getattr(self._ldap_object, ldap_name, None)
+        setattr(self, name, value)
+        return value
+
+
+def _new_cache(ttl: float, max_stale: Optional[float]) -> ResultCache:
+    return ResultCache(
+        maxsize=LDAP_ATTRIBUTES_MAXSIZE,
+        ttl=ttl,
+        stale_while_revalidate=True,
+        max_stale=max_stale,
+        serve_stale_on_error=True,
+    )
+
+
+ldap_attributes_cache = _new_cache(LDAP_ATTRIBUTES_TTL, LDAP_ATTRIBUTES_MAX_STALE)
+
+
+def configure_ldap_attributes_cache(
+    ttl: float = LDAP_ATTRIBUTES_TTL, max_stale: Optional[float] = LDAP_ATTRIBUTES_MAX_STALE
+):
+    """
+    Replaces the cache of get_ldap_attributes, dropping the cached attributes.
+    `max_stale` - Seconds an expired entry keeps being served while it's refreshed, None for as long as the TTL
+    """
+    global ldap_attributes_cache
+    ldap_attributes_cache = _new_cache(ttl, max_stale)
+
+
+def _load_ldap_attributes(ldap_path: str) -> LdapAttributes:
+    # Refreshes run on a background thread of the cache, which has to initialize COM itself.
+    # A thread that already joined another apartment can use it as it is.
+    try:
+        pythoncom.CoInitialize()
+        initialized = True
+    except pythoncom.com_error:
+        initialized = False
+    try:
+        return get_ldap_attributes_no_cache(ldap_path)
+    finally:
+        if initialized:
+            pythoncom.CoUninitialize()
+
+
 def get_ldap_attributes(ldap_path: str) -> LdapAttributes:
-    ldap_object = win32com.client.GetObject(ldap_path)
-    ldap_object.GetInfo()
-    return LdapAttributes(ldap_object)
+    """
+    Returns the cached attributes of `ldap_path`, only the first call for a path waits for the DC.
+    Hit, miss and refresh counts are in `ldap_attributes_cache.stats()`.
+    """
+    return ldap_attributes_cache.get(ldap_path, lambda: _load_ldap_attributes(ldap_path))
+
+
+# get_ldap_attributes used to be a cachetools ttl_cache, its cache_clear and cache_info keep working
+_CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+
+def _cache_clear():
+    ldap_attributes_cache.clear()
+
+
+def _cache_info() -> _CacheInfo:
+    stats = ldap_attributes_cache.stats()
+    return _CacheInfo(stats["hits"] + stats["stale_hits"], stats["misses"], LDAP_ATTRIBUTES_MAXSIZE, stats["size"])
+
+
+get_ldap_attributes.cache_clear = _cache_clear
+get_ldap_attributes.cache_info = _cache_info
+
+
+def get_ldap_attributes_bulk(
+    ldap_paths: Iterable[str], max_workers: int = 8, timeout: float = 30
+) -> Dict[str, LdapAttributes | BaseException]:
+    """
+    Fetches the attributes of many DCs concurrently, sharing the cache of get_ldap_attributes.
+    Returns the attributes or the error of every path, an unreachable DC gets a TimeoutError after `timeout`
+    seconds instead of holding up the others.
+    A fetch that timed out keeps running in the background and still fills the cache when it finishes.
+    `attributes = get_ldap_attributes_bulk([f"LDAP://{dc}/rootDSE" for dc in dcs], timeout=10)`
+    """
+    ldap_paths = list(dict.fromkeys(ldap_paths))
+    results: Dict[str, LdapAttributes | BaseException] = {}
+    if not ldap_paths:
+        return results
+
+    max_workers = min(max_workers, len(ldap_paths))
+    started: Dict[str, float] = {}
+
+    def fetch(ldap_path: str) -> LdapAttributes:
+        started[ldap_path] = time.monotonic()
+        return get_ldap_attributes(ldap_path)
+
+    # Queued paths can only start when a worker is free, a fetch that hangs holds its worker until it fails
+    deadline = time.monotonic() + timeout * math.ceil(len(ldap_paths) / max_workers)
+
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ldap-attributes")
+    try:
+        futures: Dict[Future, str] = {executor.submit(fetch, path): path for path in ldap_paths}
+        pending = set(futures)
+        while pending:
+            now = time.monotonic()
+            expirations = [started[futures[f]] + timeout for f in pending if futures[f] in started]
+            next_expiration = min(expirations + [deadline])
+            done, pending = wait(pending, timeout=max(next_expiration - now, 0), return_when=FIRST_COMPLETED)
+
+            for future in done:
+                error = future.exception()
+                results[futures[future]] = error if error is not None else future.result()
+
+            now = time.monotonic()
+            for future in list(pending):
+                path = futures[future]
+                start = started.get(path)
+                if now >= deadline or (start is not None and now - start >= timeout):
+                    pending.discard(future)
+                    results[path] = TimeoutError(f"Could not get the attributes of {path} within {timeout}s")
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return {path: results[path] for path in ldap_paths}
 
 
 def get_ldap_attributes_no_cache(ldap_path: str) -> LdapAttributes:
     ldap_object = win32com.client.GetObject(ldap_path)
     ldap_object.GetInfo()
     return LdapAttributes(ldap_object)
+
+
+def get_selected_ldap_attributes(ldap_path: str, attributes: List[str]) -> LdapAttributes:
+    """
+    Loads only `attributes` of `ldap_path` with GetInfoEx instead of the whole rootDSE,
+    which includes large multi-valued attributes like supportedControl and supportedCapabilities.
+    Not cached, meant for attributes that are checked every cycle.
+    Other attributes are still available, each one costs a round trip to the DC on its first access.
+    `attributes = get_selected_ldap_attributes(path, ["highestCommittedUSN", "isSynchronized", "dnsHostName"])`
+    """
+    ldap_object = win32com.client.GetObject(ldap_path)
+    ldap_object.GetInfoEx(list(attributes), 0)
+    return LdapAttributes(ldap_object, attributes)
@@ -1 +1,29 @@
-from .powershell import PowershellHelper, PowershellException
\ No newline at end of file
+from typing import TYPE_CHECKING
+
+from ..._lazy_imports import lazy_attributes
+
+_ATTRIBUTES = {
+    "PowershellHelper": ".powershell",
+    "PowershellException": ".powershell",
+    "PowershellTimeoutException": ".powershell",
+    "PowershellPool": ".powershell_pool",
+    "PowershellSessionException": ".powershell_pool",
+    "ProcessLauncher": ".launcher",
+    "FORMAT_LIST": ".output_format",
+    "FORMAT_JSON": ".output_format",
+    "FORMAT_CSV": ".output_format",
+    "AsyncPowershellHelper": ".async_powershell",
+    "LogonTokenCache": ".windows_runas",
+    "logon_token_cache": ".windows_runas",
+}
+
+__all__ = list(_ATTRIBUTES)
+__getattr__, __dir__ = lazy_attributes(__name__, _ATTRIBUTES)
+
+if TYPE_CHECKING:
+    from .powershell import PowershellHelper, PowershellException, PowershellTimeoutException
+    from .powershell_pool import PowershellPool, PowershellSessionException
+    from .launcher import ProcessLauncher
+    from .output_format import FORMAT_LIST, FORMAT_JSON, FORMAT_CSV
+    from .async_powershell import AsyncPowershellHelper
+    from .windows_runas import LogonTokenCache, logon_token_cache
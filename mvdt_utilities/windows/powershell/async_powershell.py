@@ -0,0 +1,134 @@
+import asyncio
+import logging
+import weakref
+from subprocess import PIPE
+from typing import Any, Dict, List, Optional, Tuple
+
+from .launcher import split_account
+from .output_format import FORMAT_LIST, format_command, parse_output
+from .powershell import EXIT_SUCCESS, PowershellException, PowershellTimeoutException
+from .windows_runas import AsyncRunasPopen
+
+
+class AsyncPowershellHelper:
+    """
+    The asyncio counterpart of PowershellHelper.
+    Processes are awaited on the event loop instead of blocking a thread per command,
+    at most `max_concurrency` of them run at the same time.
+    `helper = AsyncPowershellHelper(account, logger)`
+    `services = await helper.run_command("Get-Service")`
+    """
+
+    # Account is ("Domain\Username", "Password")
+    # `timeout` is the default in seconds for every call, it can be overridden per call
+    def __init__(
+        self,
+        account: Tuple[str, str] | None = None,
+        logger: logging.Logger | None = None,
+        max_concurrency: int = 8,
+        timeout: float | None = None,
+        output_format: str = FORMAT_LIST,
+    ):
+        self._account = account
+        self.logger = logger or logging.getLogger(__name__)
+        self._max_concurrency = max_concurrency
+        # A semaphore can only be used on one event loop, callers may run every cycle with its own asyncio.run
+        self._semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self._timeout = timeout
+        self._output_format = output_format
+
+    async def run_command(
+        self, command: str, output_format: str | None = None, timeout: float | None = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Runs a powershell command and returns the result formatted as a list of dict's.
+
+        `command` - The powershell command to run
+        `output_format` - Overrides the output format of the helper for this command
+        `timeout` - Overrides the timeout of the helper for this command
+        """
+        output_format = output_format or self._output_format
+        returncode, stdout, stderr = await self._run(
+            ["powershell.exe", format_command(command, output_format)], command, timeout
+        )
+
+        self.check_for_errors(returncode, stderr, stdout)
+        if not stdout:
+            return [{}]
+
+        return parse_output(stdout, output_format)
+
+    async def run_script(
+        self, script_path: str, arguments: Optional[List[str]], timeout: float | None = None
+    ) -> str:
+        command = ["powershell.exe", "-File", script_path]
+        if arguments:
+            command.extend(arguments)
+
+        returncode, stdout, stderr = await self._run(command, script_path, timeout)
+
+        if stderr:
+            raise PowershellException(stderr)
+
+        if returncode != EXIT_SUCCESS:
+            raise PowershellException(stdout)
+
+        return stdout.strip()
+
+    async def run_raw_command_with_error_checks(self, command: str, timeout: float | None = None) -> str:
+        returncode, stdout, stderr = await self._run(
+            ["powershell.exe", format_command(command)], command, timeout
+        )
+
+        self.check_for_errors(returncode, stderr, stdout)
+        if not stdout:
+            raise PowershellException(f"Command's stdout was empty: {command}")
+        return stdout.strip()
+
+    async def did_command_exit_successfully(self, command: str, timeout: float | None = None) -> bool:
+        """
+        Returns True when the command runs successfully
+        """
+        returncode, _, _ = await self._run(["powershell.exe", format_command(command)], command, timeout)
+        return returncode == EXIT_SUCCESS
+
+    def check_for_errors(self, returncode: int, stderr, stdout):
+        if returncode != EXIT_SUCCESS:
+            message = f"Exit Code: {returncode}\nstderr: '{stderr}'\nstdout: '{stdout}'"
+            raise PowershellException(message)
+
+    async def _run(self, args: List[str], command: str, timeout: float | None) -> Tuple[int, str, str]:
+        timeout = timeout if timeout is not None else self._timeout
+        async with self._semaphore():
+            if self._account:
+                domain, username = split_account(self._account[0])
+
+                process = await AsyncRunasPopen.create(args, username, self._account[1], domain)
+                communicate = process.communicate()
+            else:
+                self.logger.info(f"Running local service command: {args[-1]}")
+                process = await asyncio.create_subprocess_exec(*args, stdout=PIPE, stderr=PIPE)
+                communicate = self._communicate_local(process)
+
+            try:
+                stdout, stderr = await asyncio.wait_for(communicate, timeout)
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+                raise PowershellTimeoutException(f"Command timed out after {timeout}s: {command}")
+
+            return process.returncode, stdout, stderr
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self._max_concurrency)
+        return semaphore
+
+    @staticmethod
+    async def _communicate_local(process: asyncio.subprocess.Process) -> Tuple[str, str]:
+        stdout, stderr = await process.communicate()
+        return stdout.decode(), stderr.decode()
@@ -0,0 +1,57 @@
+import subprocess
+from subprocess import CompletedProcess
+from typing import Any, List, Optional, Tuple
+
+from .pipes import drain_pipes
+
+
+def split_account(account: str) -> Tuple[str, str]:
+    """
+    Splits a `DOMAIN\\user` account name into its domain and user, the domain is "." for a local account.
+    `split_account("EXAMPLE\\monitoring") == ("EXAMPLE", "monitoring")`
+    """
+    domain, _, username = account.rpartition("\\")
+    return domain or ".", username
+
+
+class ProcessLauncher:
+    """
+    Starts the powershell.exe processes of PowershellHelper and PowershellPool, with the same arguments as
+    subprocess.run/Popen and windows_runas.run_as/popen_as.
+    The default starts real processes. A replacement can serve recorded outputs instead, e.g. to benchmark
+    the helpers on a machine without PowerShell.
+    """
+
+    # False for launchers that must see every command, a PowershellHelper with a pool sends commands to its
+    # sessions without going through the launcher
+    allows_pool = True
+
+    # `max_output` caps the characters (bytes for binary pipes) kept per pipe, see pipes.drain_pipes
+    def run(
+        self, command: List[str], timeout: Optional[float] = None, max_output: Optional[int] = None, **kwargs
+    ) -> CompletedProcess:
+        if max_output is None:
+            return subprocess.run(command, timeout=timeout, **kwargs)
+        # communicate would keep all of the output in memory
+        process = subprocess.Popen(command, **kwargs)
+        drain_pipes(process, timeout, max_output)
+        return CompletedProcess(process.args, process.wait(), process.stdout, process.stderr)
+
+    def popen(self, command: List[str], **kwargs) -> subprocess.Popen:
+        return subprocess.Popen(command, **kwargs)
+
+    def run_as(
+        self, command: List[str], username: str, password: str, domain: str, timeout: Optional[float] = None, **kwargs
+    ) -> Any:
+        # Imported on first use, windows_runas loads the Windows APIs
+        from .windows_runas import run_as
+
+        return run_as(command, username, password, domain, timeout=timeout, **kwargs)
+
+    def popen_as(self, command: List[str], username: str, password: str, domain: str, **kwargs) -> Any:
+        from .windows_runas import popen_as
+
+        return popen_as(command, username, password, domain, **kwargs)
+
+
+default_launcher = ProcessLauncher()
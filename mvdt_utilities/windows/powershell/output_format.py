@@ -0,0 +1,133 @@
+import csv
+import json
+from typing import Any, Dict, Iterable, Iterator, List
+
+# How the output of a command is serialized by powershell and parsed back into a list of dicts.
+# Format-List is the historical default, JSON and CSV are parsed in a single pass and don't lose
+# wrapped lines or values containing the Format-List delimiter.
+# Format-List and CSV values are always strings. JSON values keep their type instead: numbers, booleans, null,
+# nested objects and enums as their number, e.g. the `Status` of `Get-Service` is 4 rather than "Running".
+FORMAT_LIST = "list"
+FORMAT_JSON = "json"
+FORMAT_CSV = "csv"
+
+_FORMAT_SUFFIXES = {
+    FORMAT_LIST: " | Format-List",
+    FORMAT_JSON: " | ConvertTo-Json -Compress",
+    FORMAT_CSV: " | ConvertTo-Csv -NoTypeInformation",
+}
+
+# ConvertTo-Json collects the whole pipeline into one array, when streaming every object is
+# serialized on its own line instead so that it can be parsed as soon as it is written.
+_STREAMING_FORMAT_SUFFIXES = {
+    **_FORMAT_SUFFIXES,
+    FORMAT_JSON: " | ForEach-Object { ConvertTo-Json -InputObject $_ -Compress }",
+}
+
+FORMAT_LIST_DELIMITER = " : "
+
+
+def format_command(command: str, output_format: str = FORMAT_LIST, streaming: bool = False) -> str:
+    """
+    Appends the pipeline that serializes the output of `command` in `output_format`.
+    With `streaming` the output can be parsed incrementally with `iter_records`.
+    """
+    suffixes = _STREAMING_FORMAT_SUFFIXES if streaming else _FORMAT_SUFFIXES
+    try:
+        return f"{command}{suffixes[output_format]}"
+    except KeyError:
+        raise ValueError(f"Unknown powershell output format: {output_format}")
+
+
+def iter_format_list_records(lines: Iterable[str]) -> Iterator[Dict[str, str]]:
+    """
+    Parses the output of `Format-List` one record at a time.
+    Records are separated by empty lines. Values that are too long are wrapped by powershell onto
+    continuation lines indented to the value column, these are joined back onto the value they belong to.
+    Only the first delimiter separates the key from the value, an empty value can have its trailing space trimmed.
+    """
+    record: Dict[str, str] = {}
+    previous_key: str | None = None
+    value_column = 0
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if not line or line.isspace():
+            if record:
+                yield record
+                record = {}
+            previous_key = None
+            continue
+
+        if previous_key is not None and line[0] == " " and line[:value_column].isspace():
+            record[previous_key] += line[value_column:]
+            continue
+
+        index = line.find(FORMAT_LIST_DELIMITER)
+        if index != -1:
+            previous_key = line[:index].strip()
+            value_column = index + len(FORMAT_LIST_DELIMITER)
+            record[previous_key] = line[value_column:]
+        elif line.endswith(FORMAT_LIST_DELIMITER.rstrip()):
+            previous_key = line[: -len(FORMAT_LIST_DELIMITER.rstrip())].strip()
+            value_column = len(line) + 1
+            record[previous_key] = ""
+    if record:
+        yield record
+
+
+def parse_format_list(lines: Iterable[str]) -> List[Dict[str, str]]:
+    return list(iter_format_list_records(lines))
+
+
+def parse_json_output(output: str) -> List[Dict[str, Any]]:
+    """
+    Parses the output of `ConvertTo-Json`, which is a single object for one result and an array otherwise.
+    """
+    output = output.strip()
+    if not output:
+        return []
+
+    result = json.loads(output)
+    if isinstance(result, list):
+        return result
+    return [result]
+
+
+def iter_json_lines_records(lines: Iterable[str]) -> Iterator[Dict[str, Any]]:
+    """
+    Parses the streaming JSON output, one compressed object per line.
+    """
+    for line in lines:
+        if line.strip():
+            yield json.loads(line)
+
+
+def iter_csv_records(lines: Iterable[str]) -> Iterator[Dict[str, str]]:
+    """
+    Parses the output of `ConvertTo-Csv -NoTypeInformation` one record at a time.
+    `lines` must keep their line endings so that quoted values spanning several lines are preserved.
+    """
+    yield from csv.DictReader(lines)
+
+
+def parse_csv_output(output: str) -> List[Dict[str, str]]:
+    return list(iter_csv_records(output.splitlines(keepends=True)))
+
+
+def parse_output(output: str, output_format: str = FORMAT_LIST) -> List[Dict[str, Any]]:
+    if output_format == FORMAT_JSON:
+        return parse_json_output(output)
+    if output_format == FORMAT_CSV:
+        return parse_csv_output(output)
+    return parse_format_list(output.splitlines())
+
+
+def iter_records(lines: Iterable[str], output_format: str = FORMAT_LIST) -> Iterator[Dict[str, Any]]:
+    """
+    Parses the output of a command formatted with `format_command(..., streaming=True)` one record at a time.
+    """
+    if output_format == FORMAT_JSON:
+        return iter_json_lines_records(lines)
+    if output_format == FORMAT_CSV:
+        return iter_csv_records(lines)
+    return iter_format_list_records(lines)
@@ -0,0 +1,84 @@
+import io
+import logging
+import subprocess
+import threading
+import time
+from typing import IO, Any, Dict, List, Optional
+
+log = logging.getLogger(__name__)
+
+# Size of the reads done by the threads draining stdout and stderr
+READ_CHUNK_SIZE = 64 * 1024
+
+# How long to wait for the reader threads once a timed out process was killed
+KILL_GRACE_PERIOD = 5
+
+
+class _OutputSink:
+    # Keeps the first `max_output` characters (bytes for binary pipes) written to it and counts the rest
+    def __init__(self, text: bool, max_output: Optional[int]):
+        self._chunks: List[Any] = []
+        self._empty = "" if text else b""
+        self._room = max_output
+        self.dropped = 0
+
+    def write(self, chunk: Any):
+        if self._room is not None:
+            if len(chunk) > self._room:
+                self.dropped += len(chunk) - self._room
+                chunk = chunk[: self._room]
+            self._room -= len(chunk)
+        if chunk:
+            self._chunks.append(chunk)
+
+    def getvalue(self) -> Any:
+        return self._empty.join(self._chunks)
+
+
+def _read_pipe(pipe: IO, sink: _OutputSink):
+    try:
+        while True:
+            chunk = pipe.read(READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            sink.write(chunk)
+    except (OSError, ValueError) as e:
+        log.debug(f"Stopped reading child process pipe: {e}")
+    finally:
+        pipe.close()
+
+
+def drain_pipes(process: Any, timeout: Optional[float], max_output: Optional[int] = None):
+    """
+    Reads stdout and stderr at the same time, the same way Popen.communicate does on Windows,
+    so that a child filling one pipe can't block while we wait on the other.
+    `process.stdout` and `process.stderr` are replaced by what was read, a str or bytes like the pipe.
+
+    `timeout` - Seconds to wait for the output, past that the process is killed and subprocess.TimeoutExpired is raised
+    `max_output` - Characters (bytes for binary pipes) kept per pipe, the rest is read and dropped with a warning
+    """
+    sinks: Dict[str, _OutputSink] = {}
+    readers = []
+    for name in ("stdout", "stderr"):
+        pipe = getattr(process, name)
+        if pipe is None:
+            continue
+        sinks[name] = _OutputSink(isinstance(pipe, io.TextIOBase), max_output)
+        reader = threading.Thread(target=_read_pipe, args=(pipe, sinks[name]), daemon=True)
+        reader.start()
+        readers.append(reader)
+
+    deadline = None if timeout is None else time.monotonic() + timeout
+    for reader in readers:
+        reader.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+        if reader.is_alive():
+            log.warning(f"Process {process.pid} did not finish within {timeout}s, terminating it")
+            process.kill()
+            for r in readers:
+                r.join(KILL_GRACE_PERIOD)
+            raise subprocess.TimeoutExpired(process.args, timeout)
+
+    for name, sink in sinks.items():
+        if sink.dropped:
+            log.warning(f"Process {process.pid} wrote {sink.dropped} more than the {max_output} kept from its {name}")
+        setattr(process, name, sink.getvalue())
@@ -1,13 +1,67 @@
+import base64
+import copy
+import hashlib
 import logging
 import subprocess
+import tempfile
+import threading
 import time
+import uuid
 from subprocess import PIPE, CompletedProcess
-from typing import IO, Dict, List, Optional, Tuple
+from typing import IO, TYPE_CHECKING, Any, Dict, Iterator, List, Optional, Tuple
 
-from .windows_runas import RunasPopen, run_as
+from ...execution_time import timed
+from ...result_cache import ResultCache
+from .output_format import FORMAT_JSON, FORMAT_LIST, format_command, iter_records, parse_format_list, parse_output
+from .powershell_pool import PooledProcess, PowershellPool, encode_command
+from .launcher import ProcessLauncher, default_launcher, split_account
+
+if TYPE_CHECKING:
+    from .windows_runas import RunasPopen
 
 EXIT_SUCCESS = 0
 
+# CreateProcess rejects command lines longer than 32767 characters, leaves room for the rest of the command line
+MAX_ENCODED_BATCH_LENGTH = 32_000
+
+# Runs every command of a batch in its own try/catch.
+# The output of each command is preceded by a line "<delimiter> <index> OK" or "<delimiter> <index> ERROR",
+# in the latter case the error message comes first, followed by what the command output before failing.
+# Commands run in a child scope and the variables of the loop are private, so a command using e.g. its own $i
+# can't skip or repeat the others. A command failed when it threw or added to $Error.
+_BATCH_SCRIPT = r"""
+$private:__mvdtDelimiter = '__DELIMITER__'
+$private:__mvdtCommands = @(__COMMANDS__)
+for ($private:__mvdtIndex = 0; $__mvdtIndex -lt $__mvdtCommands.Count; $__mvdtIndex++) {
+    $private:__mvdtBlock = [scriptblock]::Create(
+        [System.Text.Encoding]::UTF8.GetString([System.Convert]::FromBase64String($__mvdtCommands[$__mvdtIndex]))
+    )
+    $Error.Clear()
+    $private:__mvdtErrors = $Error.Count
+    $private:__mvdtOutput = $null
+    try {
+        $private:__mvdtOutput = & $__mvdtBlock 2>$null | Out-String -Stream -Width 4096
+        $private:__mvdtOk = $Error.Count -eq $__mvdtErrors
+    } catch {
+        $private:__mvdtOk = $false
+    }
+    if ($__mvdtOk) {
+        Write-Output "$__mvdtDelimiter $__mvdtIndex OK"
+        $__mvdtOutput
+    } else {
+        Write-Output "$__mvdtDelimiter $__mvdtIndex ERROR"
+        ($Error | Out-String).Trim()
+        $__mvdtOutput
+    }
+}
+"""
+
+
+def _encoded_batch_length(encoded_commands: List[str]) -> int:
+    # The delimiter is a uuid4 hex of 32 characters
+    script = _BATCH_SCRIPT.replace("__DELIMITER__", "0" * 32).replace("__COMMANDS__", ", ".join(encoded_commands))
+    return len(encode_command(script))
+
 
 class PowershellException(Exception):
     def __init__(self, stderr):
@@ -15,29 +69,56 @@ class PowershellException(Exception):
         super().__init__(stderr)
 
 
+class PowershellTimeoutException(PowershellException):
+    pass
+
+
 class PowershellHelper:
     # Account is ("Domain\Username", "Password")
+    # When a pool is given, commands are sent to its long-lived powershell.exe sessions
+    # instead of starting a new process every time. Scripts always get their own process.
+    # `output_format` is the default serialization used by the formatted commands, see output_format.py
+    # `timeout` is in seconds, commands and scripts running longer are killed and raise a PowershellTimeoutException
+    # When a cache is given, the results of run_command and run_single_response_command are cached
+    # per (account, command, output format). It can be shared between helpers.
+    # `launcher` starts the powershell.exe processes, see launcher.py
+    # `max_output` caps the characters (bytes when not decoded) kept from stdout and stderr of every process,
+    # the rest is dropped with a warning, a character cut in two is decoded as a replacement character.
+    # It doesn't apply to the pooled sessions or to popen.
+    # Throws: A ValueError when the launcher can't be combined with a pool, e.g. a RecordingLauncher
     def __init__(
         self,
         account: Tuple[str, str] | None = None,
         logger: logging.Logger | None = None,
+        pool: PowershellPool | None = None,
+        output_format: str = FORMAT_LIST,
+        timeout: float | None = None,
+        cache: ResultCache | None = None,
+        launcher: ProcessLauncher | None = None,
+        max_output: int | None = None,
     ):
+        if pool is not None and launcher is not None and not launcher.allows_pool:
+            raise ValueError(
+                f"A {type(launcher).__name__} can't be combined with a pool, pooled commands don't go through it"
+            )
         self._account = account
         self.logger = logger or logging.getLogger(__name__)
+        self._pool = pool
+        self._output_format = output_format
+        self._timeout = timeout
+        self._cache = cache
+        self._launcher = launcher or default_launcher
+        self._max_output = max_output
 
     def run_script_pid(self, script_path: str, arguments: Optional[List[str]]) -> Tuple[str, int]:
-        username = self._account[0]
-        domain = "."
-
-        if "\\" in username:
-            domain, username = username.split("\\")
+        domain, username = split_account(self._account[0])
 
         command = ["powershell.exe", "-File", script_path]
         if arguments:
             for argument in arguments:
                 command.append(argument)
 
-        result = run_as(command, username, self._account[1], domain, stdout=PIPE, stderr=PIPE)
+        result = self._run_as_with_timeout(command, username, domain)
 
         if result.stderr:
             message = f"{result.stderr}"
@@ -51,18 +132,14 @@ class PowershellHelper:
         return (result.stdout.strip(), result.pid)
 
     def run_script(self, script_path: str, arguments: Optional[List[str]]) -> str:
-        username = self._account[0]
-        domain = "."
-
-        if "\\" in username:
-            domain, username = username.split("\\")
+        domain, username = split_account(self._account[0])
 
         command = ["powershell.exe", "-File", script_path]
         if arguments:
             for argument in arguments:
                 command.append(argument)
 
-        result = run_as(command, username, self._account[1], domain, stdout=PIPE, stderr=PIPE)
+        result = self._run_as_with_timeout(command, username, domain)
 
         if result.stderr:
             raise PowershellException(result.stderr)
@@ -72,23 +149,178 @@ class PowershellHelper:
 
         return result.stdout.strip()
 
-    def run_command(self, command: str) -> List[Dict[str, str]]:
+    def run_command(
+        self, command: str, output_format: str | None = None, cache_ttl: float | None = None
+    ) -> List[Dict[str, Any]]:
         """
         Runs a powershell command and returns the result formatted as a list of dict's.
+        The values are strings, except with FORMAT_JSON where they keep their JSON type, see output_format.py
 
         `command` - The powershell command to run
+        `output_format` - Overrides the output format of the helper for this command
+        `cache_ttl` - Overrides the TTL of the helper's cache for this command, 0 bypasses the cache
 
         Throws: A powershell exception if the result of running the command does not result in a list with one element.
         """
 
-        if self._account:
-            return self._runas_user_account_formatted(command)
+        return self._run_formatted_cached(command, output_format, cache_ttl)
+
+    def iter_command(self, command: str, output_format: str | None = None) -> Iterator[Dict[str, Any]]:
+        """
+        Runs a powershell command and yields the records of its output as they are read from the pipe,
+        so only one record is held in memory at a time.
+        The command always runs in its own process, stopping the iteration early kills that process.
+        The timeout of the helper covers the whole command including the time spent by the caller between records.
+
+        `command` - The powershell command to run
+        `output_format` - Overrides the output format of the helper for this command
+
+        Throws: A powershell exception once the output is exhausted if the command did not exit successfully.
+        A PowershellTimeoutException if it was killed after the timeout.
+        """
+        output_format = output_format or self._output_format
+        formatted_command = format_command(command, output_format, streaming=True)
+
+        # stderr goes to a file so that a chatty command can't fill the pipe and block while we read stdout
+        with tempfile.TemporaryFile() as stderr_file:
+            process = self._popen(formatted_command, stderr_file)
+
+            # Killing the process closes its stdout, which ends a read that is blocked on the pipe
+            timed_out = threading.Event()
+            timer = None
+            if self._timeout is not None:
+                timer = threading.Timer(self._timeout, lambda: (timed_out.set(), process.kill()))
+                timer.daemon = True
+                timer.start()
+
+            exhausted = False
+            try:
+                yield from iter_records(process.stdout, output_format)
+                exhausted = True
+            except Exception:
+                # The output was cut off by the kill, the timeout is what went wrong
+                if timed_out.is_set():
+                    raise PowershellTimeoutException(f"Command timed out after {self._timeout}s: {command}")
+                raise
+            finally:
+                if timer is not None:
+                    timer.cancel()
+                if not exhausted:
+                    self.logger.debug(f"Stopped reading early, killing powershell process {process.pid}")
+                    process.kill()
+                process.stdout.close()
+                returncode = process.wait()
+
+            stderr_file.seek(0)
+            stderr = stderr_file.read().decode(errors="replace")
+
+        if timed_out.is_set():
+            raise PowershellTimeoutException(f"Command timed out after {self._timeout}s: {command}")
+        self.check_for_errors(returncode, stderr, "")
+
+    def run_batch(
+        self, commands: List[str], output_format: str | None = None
+    ) -> List[List[Dict[str, Any]] | PowershellException]:
+        """
+        Runs all the commands in a single powershell process, each one isolated in its own try/catch.
+        Returns, in the order of `commands`, either the result of the command formatted like `run_command`
+        or the PowershellException it failed with.
+        Batches too long for a single command line are split over as many processes as needed,
+        a command too long to be run on its own fails with a PowershellException.
+        Like `run_command`, a command that writes an error fails even if it didn't throw,
+        the message of its exception holds the error followed by the output.
+
+        `commands` - The powershell commands to run
+        `output_format` - Overrides the output format of the helper for these commands
+
+        Throws: A powershell exception if the powershell process itself could not run the batch.
+        """
+        if not commands:
+            return []
+
+        output_format = output_format or self._output_format
+        encoded_commands = [
+            f"'{base64.b64encode(format_command(c, output_format).encode('utf-8')).decode('ascii')}'" for c in commands
+        ]
+
+        results: List[List[Dict[str, Any]] | PowershellException] = []
+        for start, end in self._split_batch(encoded_commands):
+            too_long = (
+                end - start == 1
+                and not self._pool
+                and _encoded_batch_length(encoded_commands[start:end]) > MAX_ENCODED_BATCH_LENGTH
+            )
+            if too_long:
+                results.append(PowershellException(f"Command is too long to run in a batch: {commands[start]}"))
+                continue
+            results.extend(self._run_batch(commands[start:end], encoded_commands[start:end], output_format))
+        return results
 
-        return self._runas_local_service_formatted(command)
+    def _split_batch(self, encoded_commands: List[str]) -> List[Tuple[int, int]]:
+        """
+        The start and end of the batches that fit on a command line, a command too long alone is a batch of its own.
+        Pooled sessions read the script from stdin, their batches aren't split.
+        """
+        if self._pool:
+            return [(0, len(encoded_commands))]
+
+        batches: List[Tuple[int, int]] = []
+        start = 0
+        for end in range(2, len(encoded_commands) + 1):
+            if _encoded_batch_length(encoded_commands[start:end]) > MAX_ENCODED_BATCH_LENGTH:
+                batches.append((start, end - 1))
+                start = end - 1
+        batches.append((start, len(encoded_commands)))
+        return batches
+
+    def _run_batch(
+        self, commands: List[str], encoded_commands: List[str], output_format: str
+    ) -> List[List[Dict[str, Any]] | PowershellException]:
+        delimiter = uuid.uuid4().hex
+        script = _BATCH_SCRIPT.replace("__DELIMITER__", delimiter).replace("__COMMANDS__", ", ".join(encoded_commands))
+
+        start = time.perf_counter()
+        returncode, stdout, stderr = self._run_script_text(script)
+        end = time.perf_counter()
+        self.logger.debug(f"Batch of {len(commands)} commands took {end - start}s")
+
+        sections: Dict[int, Tuple[str, List[str]]] = {}
+        current: List[str] | None = None
+        marker = f"{delimiter} "
+        for line in stdout.splitlines():
+            if line.startswith(marker):
+                _, index, status = line.split(" ")
+                current = []
+                sections[int(index)] = (status, current)
+            elif current is not None:
+                current.append(line)
+
+        results: List[List[Dict[str, Any]] | PowershellException] = []
+        for index, command in enumerate(commands):
+            if index not in sections:
+                results.append(PowershellException(
+                    f"Command did not run: {command}\nExit Code: {returncode}\nstderr: '{stderr}'"
+                ))
+                continue
+
+            status, lines = sections[index]
+            output = "\n".join(lines)
+            if status != "OK":
+                results.append(PowershellException(f"Command failed: {command}\n{output}"))
+            elif not output.strip():
+                results.append([{}])
+            else:
+                try:
+                    results.append(parse_output(output, output_format))
+                except ValueError as e:
+                    results.append(PowershellException(f"Could not parse the output of {command}: {e}"))
+        return results
 
     def run_raw_command_pid(self, command) -> int:
         """
         Runs the specified command and returns the PID of the Powershell process.
+        With a pool this is the PID of the pooled session the command ran in, which is shared with other commands
+        and keeps running after the command, not a process of its own.
         """
         result = None
         if self._account:
@@ -121,22 +353,22 @@ class PowershellHelper:
             self.check_for_errors(result.returncode, result.stderr, result.stdout)
             if not result.stdout:
                 raise PowershellException(f"Command's stdout was empty: {command}")
-            return result.stdout.decode().strip()
+            return result.stdout.decode(errors="replace").strip()
 
-    def run_single_response_command(self, command: str) -> Dict[str, str]:
+    def run_single_response_command(
+        self, command: str, output_format: str | None = None, cache_ttl: float | None = None
+    ) -> Dict[str, Any]:
         """
         Runs a powershell command and assumes there is only one possible output.
 
         `command` - The powershell command to run
+        `output_format` - Overrides the output format of the helper for this command
+        `cache_ttl` - Overrides the TTL of the helper's cache for this command, 0 bypasses the cache
 
         Throws: A powershell exception if the result of running the command does not result in a list with one element.
         """
 
-        result = []
-        if self._account:
-            result = self._runas_user_account_formatted(command)
-        else:
-            result = self._runas_local_service_formatted(command)
+        result = self._run_formatted_cached(command, output_format, cache_ttl)
 
         length = len(result)
         if length != 1:
@@ -161,39 +393,66 @@ class PowershellHelper:
         """
         Timeout is in seconds
         """
-        return subprocess.run(
-            ["powershell.exe", command], stdout=PIPE, stderr=PIPE, timeout=timeout
+        return self._launcher.run(
+            ["powershell.exe", command], stdout=PIPE, stderr=PIPE, timeout=timeout, max_output=self._max_output
         )
 
-    def _runas_user_account_formatted(self, command: str) -> List[Dict[str, str]]:
-        start = time.perf_counter()
-        response = self._runas_user_account(command)
+    def _run_formatted_cached(
+        self, command: str, output_format: str | None, cache_ttl: float | None
+    ) -> List[Dict[str, Any]]:
+        output_format = output_format or self._output_format
+        if self._cache is None or cache_ttl == 0:
+            return self._run_formatted(command, output_format)
+
+        account = self._account[0] if self._account else None
+        result = self._cache.get(
+            (account, command, output_format),
+            lambda: self._run_formatted(command, output_format),
+            cache_ttl,
+        )
+        # Callers are free to modify what they get back, the cached records must stay untouched.
+        # Only JSON values can be nested, the records of the other formats only hold strings.
+        if output_format == FORMAT_JSON:
+            return copy.deepcopy(result)
+        return [dict(record) for record in result]
 
-        self.check_for_errors(response.wait(), response.stderr, response.stdout)
-        if not response.stdout:
-            return [{}]
-            # raise PowershellException(f"Command's stdout was empty: {command}")
-        
-        end = time.perf_counter()
-        self.logger.debug(f"_runas_user_account took {end - start}s")
+    def _run_formatted(self, command: str, output_format: str | None) -> List[Dict[str, Any]]:
+        if self._account:
+            return self._runas_user_account_formatted(command, output_format)
 
-        return self._format_command_output(response.stdout.splitlines())
+        return self._runas_local_service_formatted(command, output_format)
 
-    def _runas_local_service_formatted(self, command: str) -> List[Dict[str, str]]:
-        start = time.perf_counter()
-        response = self._runas_local_service(command)
+    def _runas_user_account_formatted(self, command: str, output_format: str | None = None) -> List[Dict[str, Any]]:
+        output_format = output_format or self._output_format
+        with timed(
+            "PowershellHelper._runas_user_account_formatted", lambda: self._timing_dimensions(command), self.logger
+        ):
+            response = self._runas_user_account(command, output_format=output_format)
 
-        self.check_for_errors(response.returncode, response.stderr, response.stdout)
-        if not response.stdout:
-            return [{}]
-            # raise PowershellException(f"Command's stdout was empty: {command}")
+            self.check_for_errors(response.wait(), response.stderr, response.stdout)
+            if not response.stdout:
+                return [{}]
+                # raise PowershellException(f"Command's stdout was empty: {command}")
 
-        end = time.perf_counter()
-        self.logger.debug(f"_runas_local_service took {end - start}ms")
+            return parse_output(response.stdout, output_format)
 
-        return self._format_command_output(response.stdout.decode().splitlines())
+    def _runas_local_service_formatted(self, command: str, output_format: str | None = None) -> List[Dict[str, Any]]:
+        output_format = output_format or self._output_format
+        with timed(
+            "PowershellHelper._runas_local_service_formatted", lambda: self._timing_dimensions(command), self.logger
+        ):
+            response = self._runas_local_service(command, output_format=output_format)
 
-    def _runas_user_account(self, command: str, format_list: bool = True) -> RunasPopen:
+            self.check_for_errors(response.returncode, response.stderr, response.stdout)
+            if not response.stdout:
+                return [{}]
+                # raise PowershellException(f"Command's stdout was empty: {command}")
+
+            return parse_output(response.stdout.decode(errors="replace"), output_format)
+
+    def _runas_user_account(
+        self, command: str, format_list: bool = True, output_format: str = FORMAT_LIST
+    ) -> "RunasPopen | PooledProcess":
         """
         Runs the command with the account specified in the constructor.
 
@@ -204,24 +463,36 @@ class PowershellHelper:
 
         formatted_command = command
         if format_list:
-            formatted_command = f"{formatted_command} | Format-List"
-
-        username = self._account[0]
-        domain = "."
-
-        if "\\" in username:
-            domain, username = username.split("\\")
-
-        return run_as(
-            ["powershell.exe", formatted_command],
-            username,
-            self._account[1],
-            domain,
-            stdout=PIPE,
-            stderr=PIPE,
-        )
+            formatted_command = format_command(command, output_format)
+
+        if self._pool:
+            try:
+                return self._pool.execute(self._account, formatted_command, self._timeout)
+            except subprocess.TimeoutExpired:
+                raise PowershellTimeoutException(f"Command timed out after {self._timeout}s: {command}")
+
+        domain, username = split_account(self._account[0])
+
+        return self._run_as_with_timeout(["powershell.exe", formatted_command], username, domain)
+
+    def _run_as_with_timeout(self, command: List[str], username: str, domain: str) -> "RunasPopen":
+        try:
+            return self._launcher.run_as(
+                command,
+                username,
+                self._account[1],
+                domain,
+                timeout=self._timeout,
+                max_output=self._max_output,
+                stdout=PIPE,
+                stderr=PIPE,
+            )
+        except subprocess.TimeoutExpired:
+            raise PowershellTimeoutException(f"Command timed out after {self._timeout}s: {command}")
 
-    def _runas_local_service(self, command: str, format_list: bool = True) -> CompletedProcess:
+    def _runas_local_service(
+        self, command: str, format_list: bool = True, output_format: str = FORMAT_LIST
+    ) -> CompletedProcess:
         """
         Runs the command without an account.
         Command should not require additional permissions.
@@ -232,12 +503,82 @@ class PowershellHelper:
         """
         formatted_command = command
         if format_list:
-            formatted_command = f"{formatted_command} | Format-List"
+            formatted_command = format_command(command, output_format)
 
         self.logger.info(f"Running local service command: {formatted_command}")
 
-        return subprocess.run(
-            ["powershell.exe", formatted_command], stdout=PIPE, stderr=PIPE
+        try:
+            if self._pool:
+                result = self._pool.execute(None, formatted_command, self._timeout)
+                return CompletedProcess(
+                    result.args, result.returncode, result.stdout.encode(), result.stderr.encode()
+                )
+
+            return self._launcher.run(
+                ["powershell.exe", formatted_command],
+                stdout=PIPE,
+                stderr=PIPE,
+                timeout=self._timeout,
+                max_output=self._max_output,
+            )
+        except subprocess.TimeoutExpired:
+            raise PowershellTimeoutException(f"Command timed out after {self._timeout}s: {command}")
+
+    def _run_script_text(self, script: str) -> Tuple[int, str, str]:
+        """
+        Runs a multi-line script, passed to powershell.exe encoded so that it doesn't need any quoting.
+        Returns the exit code, stdout and stderr.
+        """
+        with timed("PowershellHelper._run_script_text", lambda: self._timing_dimensions(script), self.logger):
+            if self._pool:
+                try:
+                    result = self._pool.execute(self._account, script, self._timeout)
+                except subprocess.TimeoutExpired:
+                    raise PowershellTimeoutException(f"Script timed out after {self._timeout}s")
+                return (result.returncode, result.stdout, result.stderr)
+
+            command = ["powershell.exe", "-NoProfile", "-NonInteractive", "-EncodedCommand", encode_command(script)]
+            if self._account:
+                domain, username = split_account(self._account[0])
+
+                result = self._run_as_with_timeout(command, username, domain)
+                return (result.wait(), result.stdout, result.stderr)
+
+            try:
+                result = self._launcher.run(
+                    command, stdout=PIPE, stderr=PIPE, timeout=self._timeout, max_output=self._max_output
+                )
+            except subprocess.TimeoutExpired:
+                raise PowershellTimeoutException(f"Script timed out after {self._timeout}s")
+            return (result.returncode, result.stdout.decode(errors="replace"), result.stderr.decode(errors="replace"))
+
+    def _timing_dimensions(self, command: str) -> Dict[str, str]:
+        # Commands are hashed, they can be long and contain values that shouldn't end up in metrics
+        return {
+            "command_hash": hashlib.blake2s(command.encode(), digest_size=4).hexdigest(),
+            "account": self._account[0] if self._account else "local",
+        }
+
+    def _popen(self, command: str, stderr: IO) -> subprocess.Popen:
+        """
+        Starts the command with the account specified in the constructor, or without one,
+        and returns the running process with its stdout pipe open.
+        """
+        if self._account:
+            domain, username = split_account(self._account[0])
+
+            return self._launcher.popen_as(
+                ["powershell.exe", command],
+                username,
+                self._account[1],
+                domain,
+                stdout=PIPE,
+                stderr=stderr,
+            )
+
+        self.logger.info(f"Running local service command: {command}")
+        return self._launcher.popen(
+            ["powershell.exe", command], stdout=PIPE, stderr=stderr, encoding="utf-8"
         )
 
     def _format_command_output(self, lines: List[str]) -> List[Dict[str, str]]:
@@ -248,24 +589,7 @@ class PowershellHelper:
         Run with the output of `Get-WmiObject -Class Win32_PerfFormattedData_PerfOS_Processor | Select Name`
         for an example
         """
-        delimeter = " : "
-
-        result: List[Dict[str, str]] = []
-        tmp: Dict[str, str] = {}
-        previous_key: str | None = None
-        for line in lines:
-            if line and delimeter in line:
-                split = line.split(delimeter)
-                previous_key = split[0].strip()
-                tmp[split[0].strip()] = split[1] if len(split) > 1 else ""
-            elif line and tmp and previous_key:
-                tmp[previous_key] = tmp[previous_key] + line.strip()
-                previous_key = None
-                continue
-            elif tmp:
-                result.append(tmp)
-                tmp = {}
-        return result
+        return parse_format_list(lines)
     
     def check_for_errors(self, returncode: int, stderr, stdout):
         if returncode != EXIT_SUCCESS:
@@ -0,0 +1,353 @@
+import base64
+import logging
+import subprocess
+import threading
+import time
+import uuid
+from subprocess import PIPE, CompletedProcess
+from typing import Dict, List, Optional, Tuple
+
+from .launcher import ProcessLauncher, default_launcher, split_account
+
+# Script executed by every long-lived powershell.exe host.
+# Each request is one line of base64 (UTF-8) encoded command text read from stdin.
+# Each reply is the command output followed by a line "<sentinel> <exit code> <base64 stderr>".
+# Commands run in a runspace of their own, so `exit` in a command ends the command with its exit code
+# instead of the host. They run in a local scope, so the variables they set don't carry over to the next
+# command, and the location is restored after every command.
+_HOST_SCRIPT = r"""
+[Console]::OutputEncoding = [System.Text.Encoding]::UTF8
+$sentinel = '__SENTINEL__'
+$runspace = [runspacefactory]::CreateRunspace()
+$runspace.Open()
+$location = $runspace.SessionStateProxy.Path.CurrentLocation.Path
+while ($true) {
+    $line = [Console]::In.ReadLine()
+    if ($line -eq $null) { break }
+    $command = [System.Text.Encoding]::UTF8.GetString([System.Convert]::FromBase64String($line))
+    $runspace.SessionStateProxy.SetVariable('LASTEXITCODE', 0)
+    $ps = [powershell]::Create()
+    $ps.Runspace = $runspace
+    [void]$ps.AddScript($command, $true).AddCommand('Out-String').AddParameter('Stream').AddParameter('Width', 4096)
+    $exitCode = 0
+    $stderr = ''
+    try {
+        foreach ($output in $ps.Invoke()) { [Console]::Out.WriteLine($output) }
+        if ($ps.HadErrors) { $exitCode = 1 }
+        $lastExitCode = $runspace.SessionStateProxy.GetVariable('LASTEXITCODE')
+        if ($lastExitCode) { $exitCode = $lastExitCode }
+    } catch {
+        $exitCode = 1
+        $stderr = $_.Exception.InnerException.Message
+    }
+    $stderr = (($ps.Streams.Error | Out-String).Trim() + "`n" + $stderr).Trim()
+    $ps.Dispose()
+    $runspace.SessionStateProxy.Path.SetLocation($location) | Out-Null
+    $encoded = [System.Convert]::ToBase64String([System.Text.Encoding]::UTF8.GetBytes($stderr))
+    [Console]::Out.WriteLine("$sentinel $exitCode $encoded")
+    [Console]::Out.Flush()
+}
+$runspace.Dispose()
+"""
+
+HEALTH_CHECK_COMMAND = "$null"
+# Seconds a health check may take before the session is considered hung and killed
+HEALTH_CHECK_TIMEOUT = 10
+
+
+def encode_command(script: str) -> str:
+    """
+    Encodes a script for powershell.exe's -EncodedCommand parameter.
+    """
+    return base64.b64encode(script.encode("utf-16-le")).decode("ascii")
+
+
+class PowershellSessionException(Exception):
+    pass
+
+
+class PowershellSessionUnavailableException(PowershellSessionException):
+    # The command couldn't be sent to the session, so it didn't run and can be sent to another one
+    pass
+
+
+class PooledProcess(CompletedProcess):
+    """
+    The result of a command run in a pooled session.
+    Shaped like the `RunasPopen` returned by `run_as` once its output has been read.
+    """
+
+    def __init__(self, args, returncode: int, stdout: str, stderr: str, pid: int):
+        super().__init__(args, returncode, stdout, stderr)
+        self.pid = pid
+
+    def wait(self, timeout: Optional[float] = None) -> int:
+        return self.returncode
+
+
+class PowershellSession:
+    """
+    A single long-lived powershell.exe process that runs commands sent over stdin.
+    """
+
+    def __init__(
+        self, account: Tuple[str, str] | None, logger: logging.Logger, launcher: ProcessLauncher = default_launcher
+    ):
+        self._account = account
+        self._launcher = launcher
+        self._sentinel = uuid.uuid4().hex
+        self.logger = logger
+
+        self._process = self._spawn()
+        self._timed_out = False
+        self.created = time.monotonic()
+        self.last_used = self.created
+        self.commands_run = 0
+
+    @property
+    def pid(self) -> int:
+        return self._process.pid
+
+    def _spawn(self) -> subprocess.Popen:
+        script = _HOST_SCRIPT.replace("__SENTINEL__", self._sentinel)
+        command = [
+            "powershell.exe",
+            "-NoLogo",
+            "-NoProfile",
+            "-NonInteractive",
+            "-EncodedCommand",
+            encode_command(script),
+        ]
+
+        if self._account:
+            domain, username = split_account(self._account[0])
+
+            process = self._launcher.popen_as(
+                command,
+                username,
+                self._account[1],
+                domain,
+                stdin=PIPE,
+                stdout=PIPE,
+                stderr=subprocess.DEVNULL,
+                encoding="utf-8",
+            )
+        else:
+            process = self._launcher.popen(
+                command,
+                stdin=PIPE,
+                stdout=PIPE,
+                stderr=subprocess.DEVNULL,
+                encoding="utf-8",
+            )
+
+        self.logger.debug(f"Started pooled powershell session with pid {process.pid}")
+        return process
+
+    def is_alive(self) -> bool:
+        return self._process.poll() is None
+
+    def _kill_after_timeout(self):
+        self._timed_out = True
+        self._process.kill()
+
+    def execute(self, command: str, timeout: Optional[float] = None) -> PooledProcess:
+        """
+        Runs `command` in the session and waits for its output.
+        After `timeout` seconds the session is killed and subprocess.TimeoutExpired is raised.
+
+        Throws: A PowershellSessionUnavailableException if the command couldn't be sent to the host process.
+        A PowershellSessionException if the host process died before replying.
+        """
+        self.last_used = time.monotonic()
+        self.commands_run += 1
+
+        request = base64.b64encode(command.encode("utf-8")).decode("ascii")
+        try:
+            self._process.stdin.write(f"{request}\n")
+            self._process.stdin.flush()
+        except (OSError, ValueError) as e:
+            raise PowershellSessionUnavailableException(
+                f"Could not send command to powershell session {self.pid}: {e}"
+            )
+
+        timer = None
+        if timeout is not None:
+            timer = threading.Timer(timeout, self._kill_after_timeout)
+            timer.daemon = True
+            timer.start()
+
+        marker = f"{self._sentinel} "
+        lines: List[str] = []
+        try:
+            while True:
+                line = self._process.stdout.readline()
+                if not line:
+                    if self._timed_out:
+                        raise subprocess.TimeoutExpired(command, timeout)
+                    raise PowershellSessionException(f"Powershell session {self.pid} exited while running: {command}")
+                if line.startswith(marker):
+                    break
+                lines.append(line)
+        finally:
+            if timer is not None:
+                timer.cancel()
+
+        _, returncode, stderr = line.rstrip("\n").split(" ", 2)
+        return PooledProcess(
+            command,
+            int(returncode),
+            "".join(lines),
+            base64.b64decode(stderr).decode("utf-8"),
+            self.pid,
+        )
+
+    def close(self):
+        try:
+            self._process.stdin.close()
+        except (OSError, ValueError):
+            pass
+        try:
+            self._process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self._process.kill()
+        self.logger.debug(f"Closed pooled powershell session with pid {self.pid}")
+
+
+class PowershellPool:
+    """
+    Keeps a few long-lived powershell.exe processes per account so that commands don't pay
+    for a process start and logon every time.
+
+    Sessions are recycled after `max_commands` commands or `max_age` seconds, health checked
+    when they have been idle for more than `health_check_interval` seconds and respawned when they crash.
+    A command is only sent again on a fresh session when it couldn't be sent at all, a session that dies while
+    running a command raises a PowershellSessionException so the command never runs twice.
+    `launcher` starts the sessions, see launcher.py
+    `pool = PowershellPool()`
+    `PowershellHelper(account, logger, pool=pool).run_command("Get-Service")`
+    """
+
+    def __init__(
+        self,
+        size: int = 2,
+        max_commands: int = 500,
+        max_age: float = 30 * 60,
+        health_check_interval: float = 60,
+        logger: logging.Logger | None = None,
+        launcher: ProcessLauncher | None = None,
+    ):
+        self._size = size
+        self._max_commands = max_commands
+        self._max_age = max_age
+        self._health_check_interval = health_check_interval
+        self.logger = logger or logging.getLogger(__name__)
+        self._launcher = launcher or default_launcher
+
+        # Shared by all accounts, so a released session wakes every waiter and each checks its own account
+        self._lock = threading.Condition()
+        self._idle: Dict[Tuple[str, str] | None, List[PowershellSession]] = {}
+        self._active: Dict[Tuple[str, str] | None, int] = {}
+        self._closed = False
+
+    def execute(
+        self, account: Tuple[str, str] | None, command: str, timeout: Optional[float] = None
+    ) -> PooledProcess:
+        session = self._acquire(account)
+        try:
+            result = session.execute(command, timeout)
+        except PowershellSessionUnavailableException as e:
+            self.logger.warning(f"{e}, respawning the session")
+            self._discard(account, session)
+
+            # The session died before the command reached it, try once more on a fresh one
+            session = self._acquire(account)
+            try:
+                result = session.execute(command, timeout)
+            except Exception:
+                self._discard(account, session)
+                raise
+        except Exception:
+            self._discard(account, session)
+            raise
+
+        self._release(account, session)
+        return result
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            sessions = [s for idle in self._idle.values() for s in idle]
+            self._idle.clear()
+            self._lock.notify_all()
+
+        for session in sessions:
+            session.close()
+
+    def _is_expired(self, session: PowershellSession) -> bool:
+        return (
+            session.commands_run >= self._max_commands
+            or time.monotonic() - session.created >= self._max_age
+        )
+
+    def _is_healthy(self, session: PowershellSession) -> bool:
+        if not session.is_alive():
+            return False
+        if time.monotonic() - session.last_used < self._health_check_interval:
+            return True
+        try:
+            return session.execute(HEALTH_CHECK_COMMAND, HEALTH_CHECK_TIMEOUT).returncode == 0
+        except (PowershellSessionException, subprocess.TimeoutExpired):
+            return False
+
+    def _acquire(self, account: Tuple[str, str] | None) -> PowershellSession:
+        while True:
+            with self._lock:
+                while True:
+                    if self._closed:
+                        raise PowershellSessionException("The powershell pool is closed")
+
+                    idle = self._idle.setdefault(account, [])
+                    if idle:
+                        session = idle.pop()
+                        break
+                    if self._active.get(account, 0) < self._size:
+                        session = None
+                        break
+                    self._lock.wait()
+
+                self._active[account] = self._active.get(account, 0) + 1
+
+            if session is None:
+                try:
+                    return PowershellSession(account, self.logger, self._launcher)
+                except Exception:
+                    self._discard(account, None)
+                    raise
+
+            if not self._is_expired(session) and self._is_healthy(session):
+                return session
+
+            self.logger.debug(f"Recycling pooled powershell session with pid {session.pid}")
+            self._discard(account, session)
+
+    def _release(self, account: Tuple[str, str] | None, session: PowershellSession):
+        with self._lock:
+            self._active[account] -= 1
+            if self._closed:
+                session_to_close = session
+            else:
+                session_to_close = None
+                self._idle.setdefault(account, []).append(session)
+            self._lock.notify_all()
+
+        if session_to_close is not None:
+            session_to_close.close()
+
+    def _discard(self, account: Tuple[str, str] | None, session: PowershellSession | None):
+        with self._lock:
+            self._active[account] -= 1
+            self._lock.notify_all()
+
+        if session is not None:
+            session.close()
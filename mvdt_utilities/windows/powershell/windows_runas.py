@@ -1,10 +1,22 @@
+import asyncio
 import ctypes
+import functools
+import hashlib
+import hmac
+import locale
 import logging
+import msvcrt
 import os
 import subprocess
 import sys
+import threading
+import time
+from asyncio import windows_utils
+from collections import OrderedDict
 from ctypes import wintypes
-from typing import Dict, Optional
+from typing import Dict, Optional, Tuple
+
+from .pipes import drain_pipes
 
 log = logging.getLogger(__name__)
 
@@ -19,6 +31,10 @@ INVALID_DWORD_VALUE = wintypes.DWORD(-1).value
 LOGON32_LOGON_INTERACTIVE = 2
 LOGON32_PROVIDER_WINNT50 = 3
 
+MAXIMUM_ALLOWED = 0x02000000
+SECURITY_IMPERSONATION = 2  # SECURITY_IMPERSONATION_LEVEL
+TOKEN_PRIMARY = 1  # TOKEN_TYPE
+
 NORMAL_PRIORITY_CLASS = 0x00000020
 
 DEBUG_PROCESS = 0x00000001
@@ -315,6 +331,18 @@ WIN(
     wintypes.PHANDLE,  # _In_opt_     phToken
 )
 
+# https://learn.microsoft.com/en-us/windows/win32/api/securitybaseapi/nf-securitybaseapi-duplicatetokenex
+WIN(
+    advapi32.DuplicateTokenEx,
+    wintypes.BOOL,
+    wintypes.HANDLE,  # _In_           hExistingToken
+    wintypes.DWORD,  # _In_           dwDesiredAccess
+    LPSECURITY_ATTRIBUTES,  # _In_opt_       lpTokenAttributes
+    wintypes.DWORD,  # _In_           ImpersonationLevel
+    wintypes.DWORD,  # _In_           TokenType
+    wintypes.PHANDLE,  # _Out_          phNewToken
+)
+
 CREATION_TYPE_NORMAL = 0
 CREATION_TYPE_LOGON = 1
 CREATION_TYPE_TOKEN = 2
@@ -478,19 +506,21 @@ def create_process(commandline = None, creationinfo = None, startupinfo = None)
     elif ci.dwCreationType == CREATION_TYPE_USER:
 
         # First, Token is obtained, using user's name and password.
-        success = advapi32.LogonUserW(
-            ci.lpUsername,
-            ci.lpDomain,
-            ci.lpPassword,
-            LOGON32_LOGON_INTERACTIVE,
-            LOGON32_PROVIDER_WINNT50,
-            ci.hToken
-        )
+        # Skipped when the caller already has a token for the user, e.g. from the LogonTokenCache.
+        if not ci.hToken:
+            success = advapi32.LogonUserW(
+                ci.lpUsername,
+                ci.lpDomain,
+                ci.lpPassword,
+                LOGON32_LOGON_INTERACTIVE,
+                LOGON32_PROVIDER_WINNT50,
+                ci.hToken
+            )
 
-        if not success:
-            if ci.hToken is not None:
-                ci.hToken.Close()
-            raise ctypes.WinError()
+            if not success:
+                if ci.hToken is not None:
+                    ci.hToken.Close()
+                raise ctypes.WinError()
 
         # Now, the Token is used to create a new process.
         advapi32.CreateProcessAsUserW(
@@ -661,7 +691,107 @@ class RunasPopen(subprocess.Popen):
         super(RunasPopen, self).__del__()
 
 
-def run_as(
+class _CachedToken(object):
+    __slots__ = ("token", "password_digest", "created")
+
+    def __init__(self, token: HANDLE, password_digest: bytes):
+        self.token = token
+        self.password_digest = password_digest
+        self.created = time.monotonic()
+
+
+class LogonTokenCache(object):
+    """
+    Keeps the primary tokens obtained with LogonUserW, keyed by (domain, username), so that processes
+    started while running as SYSTEM don't need an interactive logon against the DC every time.
+    Every caller gets its own duplicate of the cached token and is responsible for closing it.
+
+    Entries expire after `ttl` seconds, the least recently used one is evicted past `maxsize`
+    and an entry is replaced when the password it was created with changes.
+    """
+
+    def __init__(self, maxsize: int = 16, ttl: float = 10 * 60):
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[str, str], _CachedToken]" = OrderedDict()
+        # Only a keyed digest of the password is kept, to notice when it changes
+        self._salt = os.urandom(16)
+
+    def acquire(self, username: str, password: str, domain: str) -> HANDLE:
+        """
+        Returns a duplicated primary token for the account, logging on when there is no valid cached token.
+        """
+        key = (domain.upper(), username.upper())
+        password_digest = hmac.new(self._salt, password.encode("utf-8"), hashlib.sha256).digest()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if (
+                    time.monotonic() - entry.created < self._ttl
+                    and hmac.compare_digest(entry.password_digest, password_digest)
+                ):
+                    self._entries.move_to_end(key)
+                    return self._duplicate(entry.token)
+                del self._entries[key]
+                entry.token.Close()
+
+        # Logging on can take a while against a slow DC, don't hold the lock for it
+        token = HANDLE()
+        advapi32.LogonUserW(
+            username,
+            domain,
+            password,
+            LOGON32_LOGON_INTERACTIVE,
+            LOGON32_PROVIDER_WINNT50,
+            token,
+        )
+        duplicate = self._duplicate(token)
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                previous.token.Close()
+            self._entries[key] = _CachedToken(token, password_digest)
+            while len(self._entries) > self._maxsize:
+                _, evicted = self._entries.popitem(last=False)
+                evicted.token.Close()
+
+        return duplicate
+
+    def invalidate(self, username: str, domain: str):
+        with self._lock:
+            entry = self._entries.pop((domain.upper(), username.upper()), None)
+        if entry is not None:
+            entry.token.Close()
+
+    def clear(self):
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        for entry in entries:
+            entry.token.Close()
+
+    @staticmethod
+    def _duplicate(token: HANDLE) -> HANDLE:
+        duplicate = HANDLE()
+        advapi32.DuplicateTokenEx(
+            token,
+            MAXIMUM_ALLOWED,
+            None,
+            SECURITY_IMPERSONATION,
+            TOKEN_PRIMARY,
+            duplicate,
+        )
+        return duplicate
+
+
+# Shared by every run_as/popen_as call unless another cache, or None, is passed
+logon_token_cache = LogonTokenCache()
+
+
+def popen_as(
         command: str,
         username: str,
         password: str,
@@ -669,8 +799,15 @@ def run_as(
         env: Optional[Dict[str, str]] = None,
         cwd: Optional[str] = None,
         shell: Optional[bool] = None,
+        token_cache: Optional[LogonTokenCache] = logon_token_cache,
         **kwargs
 ) -> RunasPopen:
+    """
+    Starts `command` as the specified user and returns the running process.
+    Unlike `run_as` the pipes are left open, so the caller is responsible for reading and closing them.
+
+    `token_cache` - Where logon tokens are reused from when running as SYSTEM, None logs on for every process
+    """
     # Hacky way for this to stop bugging me during development
     run_as_system = False
     current_user = os.getlogin().upper()
@@ -679,52 +816,201 @@ def run_as(
 
     # Run as SYSTEM or LOCAL_SERVICE by default
     creation_type = CREATION_TYPE_USER if run_as_system else CREATION_TYPE_LOGON
+    use_token_cache = run_as_system and token_cache is not None
+
+    universal_newlines = kwargs.pop("universal_newlines", True)
+    stdin = kwargs.pop("stdin", subprocess.DEVNULL)
+    stdout = kwargs.pop("stdout", subprocess.PIPE)
+    stderr = kwargs.pop("stderr", subprocess.PIPE)
+
+    for attempt in range(2 if use_token_cache else 1):
+        # Need a token to do and save the logon as that user, if we are SYSTEM
+        # https://docs.microsoft.com/en-us/windows/win32/api/winbase/nf-winbase-logonuserw
+        token = None
+        if use_token_cache:
+            token = token_cache.acquire(username, password, domain)
+        elif run_as_system:
+            token = HANDLE()
 
-    # Need a token to do and save the logon as that user, if we are SYSTEM
-    # https://docs.microsoft.com/en-us/windows/win32/api/winbase/nf-winbase-logonuserw
-    token = HANDLE() if run_as_system else None
-
-    try:
-        creation_info = CREATIONINFO(
-            creation_type,
-            lpUsername=username,
-            lpPassword=password,
-            lpDomain=domain,
-            dwCreationFlags=DETACHED_PROCESS,
-            hToken=token
-        )
+        try:
+            creation_info = CREATIONINFO(
+                creation_type,
+                lpUsername=username,
+                lpPassword=password,
+                lpDomain=domain,
+                dwCreationFlags=DETACHED_PROCESS,
+                hToken=token
+            )
 
-        process = RunasPopen(
-            command,
-            suspended=True,
-            creationinfo=creation_info,
-            universal_newlines=True,
-            stdin=subprocess.DEVNULL,
-            stdout=kwargs.pop("stdout", subprocess.PIPE),
-            stderr=kwargs.pop("stderr", subprocess.PIPE),
-            env=env,
-            close_fds=False,
-            cwd=cwd,
-            shell=shell,
-            **kwargs
-        )
+            process = RunasPopen(
+                command,
+                suspended=True,
+                creationinfo=creation_info,
+                universal_newlines=universal_newlines,
+                stdin=stdin,
+                stdout=stdout,
+                stderr=stderr,
+                env=env,
+                close_fds=False,
+                cwd=cwd,
+                shell=shell,
+                **kwargs
+            )
+
+            # Execute underlying function
+            process.start()
+            return process
 
-        # Execute underlying function
-        process.start()
+        except OSError as e:
+            if not use_token_cache or attempt:
+                raise
+            # The cached logon may have been revoked, log on again before giving up
+            log.warning(f"Could not start process with the cached token for {domain}\\{username}: {e}")
+            token_cache.invalidate(username, domain)
 
-        if process.stdout is not None:
-            stdout = process.stdout.read()
-            process.stdout.close()
-            process.stdout = stdout
+        finally:
+            # Always close the logon token when we are done with it
+            if token is not None:
+                token.Close()
 
-        if process.stderr is not None:
-            stderr = process.stderr.read()
-            process.stderr.close()
-            process.stderr = stderr
 
-    finally:
-        # Always close the logon token when we are done with it
-        if token is not None:
-            token.Close()
+def run_as(
+        command: str,
+        username: str,
+        password: str,
+        domain: str,
+        env: Optional[Dict[str, str]] = None,
+        cwd: Optional[str] = None,
+        shell: Optional[bool] = None,
+        timeout: Optional[float] = None,
+        max_output: Optional[int] = None,
+        **kwargs
+) -> RunasPopen:
+    """
+    Runs `command` as the specified user and reads all of its output.
+    `process.stdout` and `process.stderr` are replaced by what was read from the pipes.
+
+    `timeout` - Seconds to wait for the output, past that the process is killed and subprocess.TimeoutExpired is raised
+    `max_output` - Characters (bytes for binary pipes) kept per pipe, see pipes.drain_pipes
+    """
+    process = popen_as(command, username, password, domain, env=env, cwd=cwd, shell=shell, **kwargs)
+    drain_pipes(process, timeout, max_output)
+    return process
+
+
+class AsyncRunasPopen:
+    """
+    A process started as another user whose pipes and exit are awaited on the asyncio event loop.
+    The pipes are overlapped, the same way asyncio sets them up for its own subprocesses, and read by the loop.
+    Logging on and starting the process, and waiting for its exit, run on the default executor
+    so they don't block the loop.
+    `process = await AsyncRunasPopen.create(["powershell.exe", "Get-Service"], username, password, domain)`
+    `stdout, stderr = await process.communicate()`
+    """
 
-    return process
\ No newline at end of file
+    def __init__(
+        self,
+        process: RunasPopen,
+        stdout: asyncio.StreamReader,
+        stderr: asyncio.StreamReader,
+        transports: Tuple[asyncio.ReadTransport, ...],
+    ):
+        self._process = process
+        self._transports = transports
+        self.stdout = stdout
+        self.stderr = stderr
+
+    @property
+    def pid(self) -> int:
+        return self._process.pid
+
+    @property
+    def returncode(self) -> Optional[int]:
+        return self._process.returncode
+
+    @classmethod
+    async def create(
+        cls,
+        command,
+        username: str,
+        password: str,
+        domain: str,
+        env: Optional[Dict[str, str]] = None,
+        cwd: Optional[str] = None,
+    ) -> "AsyncRunasPopen":
+        loop = asyncio.get_running_loop()
+
+        stdout_read, stdout_write = windows_utils.pipe(overlapped=(True, False))
+        stderr_read, stderr_write = windows_utils.pipe(overlapped=(True, False))
+        stdout_pipe = windows_utils.PipeHandle(stdout_read)
+        stderr_pipe = windows_utils.PipeHandle(stderr_read)
+        try:
+            stdout_fd = msvcrt.open_osfhandle(stdout_write, 0)
+            stderr_fd = msvcrt.open_osfhandle(stderr_write, 0)
+            try:
+                # LogonUserW and CreateProcessAsUserW block
+                process = await loop.run_in_executor(
+                    None,
+                    functools.partial(
+                        popen_as,
+                        command,
+                        username,
+                        password,
+                        domain,
+                        env=env,
+                        cwd=cwd,
+                        universal_newlines=False,
+                        stdout=stdout_fd,
+                        stderr=stderr_fd,
+                    ),
+                )
+            finally:
+                # The child has its own copies of the write ends now
+                os.close(stdout_fd)
+                os.close(stderr_fd)
+
+            stdout = asyncio.StreamReader()
+            stderr = asyncio.StreamReader()
+            stdout_transport, _ = await loop.connect_read_pipe(
+                lambda: asyncio.StreamReaderProtocol(stdout), stdout_pipe
+            )
+            stderr_transport, _ = await loop.connect_read_pipe(
+                lambda: asyncio.StreamReaderProtocol(stderr), stderr_pipe
+            )
+        except BaseException:
+            stdout_pipe.close()
+            stderr_pipe.close()
+            raise
+
+        return cls(process, stdout, stderr, (stdout_transport, stderr_transport))
+
+    async def wait(self) -> int:
+        if self._process.returncode is None:
+            await asyncio.get_running_loop().run_in_executor(None, self._process.wait)
+        return self._process.returncode
+
+    async def communicate(self) -> Tuple[str, str]:
+        """
+        Reads stdout and stderr until the process closes them and waits for it to exit.
+        The output is decoded the same way `run_as` does it.
+        """
+        try:
+            stdout, stderr = await asyncio.gather(self.stdout.read(), self.stderr.read())
+            await self.wait()
+        finally:
+            self.close()
+        return self._decode(stdout), self._decode(stderr)
+
+    def kill(self):
+        if self._process.returncode is None:
+            self._process.kill()
+        self.close()
+
+    def close(self):
+        for transport in self._transports:
+            transport.close()
+
+    @staticmethod
+    def _decode(data: bytes) -> str:
+        text = data.decode(locale.getpreferredencoding(False), errors="replace")
+        return text.replace("\r\n", "\n").replace("\r", "\n")
@@ -0,0 +1,420 @@
+import gzip
+import json
+import subprocess
+import threading
+import time
+from subprocess import CompletedProcess
+from typing import IO, Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from .powershell.launcher import ProcessLauncher, default_launcher
+
+# Entries of a trace, one JSON object per line:
+# {"type": "process", "account": "DOMAIN\\user" | null, "args": [...], "returncode": 0, "stdout": "...",
+#  "stderr": "...", "duration": 0.25}
+# {"type": "wmi", "namespace": "root\\cimv2", "query": "...", "rows": [{...}], "duration": 0.01}
+# A process that timed out has "timeout" instead of its output, a query that failed has "error" instead of rows.
+TYPE_PROCESS = "process"
+TYPE_WMI = "wmi"
+
+
+class ReplayException(Exception):
+    pass
+
+
+def _open(path: str, mode: str) -> IO:
+    # Traces ending with .gz are gzipped, PowerShell output compresses well
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def _account(username: str, domain: str) -> str:
+    return f"{domain}\\{username}"
+
+
+class TraceRecorder:
+    """
+    Writes the commands and queries run through a RecordingLauncher or RecordingLocator to a trace file,
+    with their output, exit code and duration.
+    `with TraceRecorder("cycle.jsonl.gz") as trace:`
+    `    PowershellHelper(account, logger, launcher=RecordingLauncher(trace)).run_command("Get-Service")`
+    `    with WMIConnection(account, logger, locator=RecordingLocator(trace)) as c:`
+    `        c.query("Select * from Win32_ComputerSystem")`
+
+    `append` - Adds to an existing trace instead of replacing it. Only use it to record several runs of the same
+    commands, replaying returns the entries of a command in the order they were recorded.
+    """
+
+    def __init__(self, path: str, append: bool = False):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = _open(path, "a" if append else "w")
+        self.entries = 0
+
+    def write(self, entry: Dict[str, Any]):
+        # Values that aren't JSON, e.g. the datetimes of WMI, are recorded as strings
+        line = json.dumps(entry, separators=(",", ":"), default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+            self.entries += 1
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def __enter__(self) -> "TraceRecorder":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class Trace:
+    """
+    The entries of a recorded trace, looked up by account and command line or by namespace and query.
+    A command or query recorded several times is replayed in the recorded order, starting over after the last one.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries: Dict[Tuple, List[Dict[str, Any]]] = {}
+        self._next: Dict[Tuple, int] = {}
+
+        with _open(path, "r") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._entries.setdefault(self._key(entry), []).append(entry)
+
+    @staticmethod
+    def _key(entry: Dict[str, Any]) -> Tuple:
+        if entry["type"] == TYPE_WMI:
+            return (TYPE_WMI, entry["namespace"].lower(), entry["query"])
+        return (TYPE_PROCESS, entry["account"], tuple(entry["args"]))
+
+    def process(self, args: List[str], account: Optional[str]) -> Dict[str, Any]:
+        return self._get((TYPE_PROCESS, account, tuple(args)), f"command {args}")
+
+    def query(self, namespace: str, query: str) -> Dict[str, Any]:
+        return self._get((TYPE_WMI, namespace.lower(), query), f"query '{query}' in {namespace}")
+
+    def _get(self, key: Tuple, description: str) -> Dict[str, Any]:
+        entries = self._entries.get(key)
+        if not entries:
+            raise ReplayException(f"No recorded {description} in {self.path}")
+        with self._lock:
+            index = self._next.get(key, 0)
+            self._next[key] = (index + 1) % len(entries)
+        return entries[index]
+
+    def __len__(self) -> int:
+        return sum(len(entries) for entries in self._entries.values())
+
+
+def _delay(duration: float, speed: Optional[float]) -> float:
+    return duration / speed if speed else 0
+
+
+class _RecordingStdout:
+    # Passes the lines of the stdout pipe through, keeping them for the trace
+    def __init__(self, pipe: IO, lines: List[str]):
+        self._pipe = pipe
+        self._lines = lines
+
+    def __iter__(self) -> Iterator[str]:
+        for line in self._pipe:
+            self._lines.append(line)
+            yield line
+
+    def close(self):
+        self._pipe.close()
+
+
+class _RecordingProcess:
+    # A started process whose output is recorded once it has been waited for
+    def __init__(self, process: subprocess.Popen, entry: Dict[str, Any], trace: TraceRecorder):
+        self._process = process
+        self._entry = entry
+        self._trace = trace
+        self._lines: List[str] = []
+        self._start = time.perf_counter()
+        self._recorded = False
+        self.stdout = _RecordingStdout(process.stdout, self._lines)
+
+    @property
+    def pid(self) -> int:
+        return self._process.pid
+
+    @property
+    def returncode(self) -> Optional[int]:
+        return self._process.returncode
+
+    def kill(self):
+        self._process.kill()
+
+    def poll(self) -> Optional[int]:
+        return self._process.poll()
+
+    def wait(self, timeout: Optional[float] = None) -> int:
+        returncode = self._process.wait(timeout)
+        if not self._recorded:
+            self._recorded = True
+            self._trace.write({
+                **self._entry,
+                "returncode": returncode,
+                "stdout": "".join(self._lines),
+                "stderr": "",
+                "duration": time.perf_counter() - self._start,
+            })
+        return returncode
+
+
+class RecordingLauncher(ProcessLauncher):
+    """
+    Starts the processes with `launcher` and records what they output to `trace`.
+    Pooled sessions aren't recorded, a PowershellHelper with a pool doesn't accept it.
+    """
+
+    allows_pool = False
+
+    def __init__(self, trace: TraceRecorder, launcher: ProcessLauncher = default_launcher):
+        self._trace = trace
+        self._launcher = launcher
+
+    def run(self, command: List[str], timeout: Optional[float] = None, **kwargs) -> CompletedProcess:
+        entry = {"type": TYPE_PROCESS, "account": None, "args": command}
+        start = time.perf_counter()
+        try:
+            result = self._launcher.run(command, timeout=timeout, **kwargs)
+        except subprocess.TimeoutExpired:
+            self._trace.write({**entry, "timeout": True, "duration": time.perf_counter() - start})
+            raise
+        self._trace.write({
+            **entry,
+            "returncode": result.returncode,
+            "stdout": self._text(result.stdout),
+            "stderr": self._text(result.stderr),
+            "duration": time.perf_counter() - start,
+        })
+        return result
+
+    def run_as(
+        self, command: List[str], username: str, password: str, domain: str, timeout: Optional[float] = None, **kwargs
+    ) -> Any:
+        entry = {"type": TYPE_PROCESS, "account": _account(username, domain), "args": command}
+        start = time.perf_counter()
+        try:
+            result = self._launcher.run_as(command, username, password, domain, timeout=timeout, **kwargs)
+        except subprocess.TimeoutExpired:
+            self._trace.write({**entry, "timeout": True, "duration": time.perf_counter() - start})
+            raise
+        self._trace.write({
+            **entry,
+            "returncode": result.wait(),
+            "stdout": self._text(result.stdout),
+            "stderr": self._text(result.stderr),
+            "duration": time.perf_counter() - start,
+        })
+        return result
+
+    def popen(self, command: List[str], **kwargs) -> Any:
+        entry = {"type": TYPE_PROCESS, "account": None, "args": command}
+        return _RecordingProcess(self._launcher.popen(command, **kwargs), entry, self._trace)
+
+    def popen_as(self, command: List[str], username: str, password: str, domain: str, **kwargs) -> Any:
+        entry = {"type": TYPE_PROCESS, "account": _account(username, domain), "args": command}
+        return _RecordingProcess(
+            self._launcher.popen_as(command, username, password, domain, **kwargs), entry, self._trace
+        )
+
+    @staticmethod
+    def _text(output: str | bytes | None) -> str:
+        if isinstance(output, bytes):
+            return output.decode(errors="replace")
+        return output or ""
+
+
+class _ReplayedProcess:
+    # Shaped like a RunasPopen once run, or like a running Popen with a `stdout` pipe
+    def __init__(self, entry: Dict[str, Any], delay: float, stdout: Any = None):
+        self.args = entry["args"]
+        self.pid = 0
+        self.returncode = entry["returncode"]
+        self.stdout = entry["stdout"] if stdout is None else stdout
+        self.stderr = entry["stderr"]
+        self._done = time.monotonic() + delay
+
+    def kill(self):
+        self._done = 0
+
+    def poll(self) -> Optional[int]:
+        return self.returncode if time.monotonic() >= self._done else None
+
+    def wait(self, timeout: Optional[float] = None) -> int:
+        remaining = self._done - time.monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+        return self.returncode
+
+
+class _ReplayedStdout:
+    def __init__(self, lines: List[str]):
+        self._lines = iter(lines)
+
+    def __iter__(self) -> Iterator[str]:
+        return self._lines
+
+    def close(self):
+        self._lines = iter(())
+
+
+class ReplayLauncher(ProcessLauncher):
+    """
+    Serves the outputs recorded in `trace` instead of starting processes, so collectors can run
+    on a machine without PowerShell.
+    `speed` - Replays the recorded durations, 1 at the original speed, 10 ten times faster.
+    By default outputs are served immediately.
+
+    Throws: A ReplayException for a command that wasn't recorded.
+    """
+
+    allows_pool = False
+
+    def __init__(self, trace: Trace, speed: Optional[float] = None):
+        self._trace = trace
+        self._speed = speed
+
+    def run(self, command: List[str], timeout: Optional[float] = None, **kwargs) -> CompletedProcess:
+        entry = self._replay(command, None, timeout)
+        return CompletedProcess(
+            command, entry["returncode"], entry["stdout"].encode(), entry["stderr"].encode()
+        )
+
+    def run_as(
+        self, command: List[str], username: str, password: str, domain: str, timeout: Optional[float] = None, **kwargs
+    ) -> Any:
+        entry = self._replay(command, _account(username, domain), timeout)
+        return _ReplayedProcess(entry, 0)
+
+    def popen(self, command: List[str], **kwargs) -> Any:
+        return self._popen(command, None)
+
+    def popen_as(self, command: List[str], username: str, password: str, domain: str, **kwargs) -> Any:
+        return self._popen(command, _account(username, domain))
+
+    def _popen(self, command: List[str], account: Optional[str]) -> _ReplayedProcess:
+        entry = self._trace.process(command, account)
+        if "timeout" in entry:
+            raise ReplayException(f"Command {command} timed out when it was recorded")
+        stdout = _ReplayedStdout(entry["stdout"].splitlines(keepends=True))
+        return _ReplayedProcess(entry, _delay(entry["duration"], self._speed), stdout)
+
+    def _replay(self, command: List[str], account: Optional[str], timeout: Optional[float]) -> Dict[str, Any]:
+        entry = self._trace.process(command, account)
+        delay = _delay(entry["duration"], self._speed)
+        if "timeout" in entry or (timeout is not None and delay > timeout):
+            time.sleep(min(delay, timeout) if timeout is not None else delay)
+            raise subprocess.TimeoutExpired(command, timeout)
+        if delay:
+            time.sleep(delay)
+        return entry
+
+
+class _Property:
+    __slots__ = ("Name", "Value")
+
+    def __init__(self, name: str, value: Any):
+        self.Name = name
+        self.Value = value
+
+
+class _ReplayedInstance:
+    # A WMI instance with its properties as attributes and in Properties_, like a CDispatch of SWbemObject
+    def __init__(self, properties: Dict[str, Any]):
+        self.__dict__.update(properties)
+        self.Properties_ = [_Property(name, value) for name, value in properties.items()]
+
+
+def _instances(rows: List[Dict[str, Any]]) -> List[_ReplayedInstance]:
+    return [_ReplayedInstance(row) for row in rows]
+
+
+class _RecordingServices:
+    def __init__(self, services: Any, namespace: str, trace: TraceRecorder):
+        self._services = services
+        self._namespace = namespace
+        self._trace = trace
+
+    def ExecQuery(self, query: str, *args) -> List[_ReplayedInstance]:
+        entry = {"type": TYPE_WMI, "namespace": self._namespace, "query": query}
+        start = time.perf_counter()
+        try:
+            # Read completely, the instances are recorded and served like replayed ones
+            result = self._services.ExecQuery(query, *args)
+            rows = [{p.Name: p.Value for p in instance.Properties_} for instance in result]
+        except Exception as e:
+            self._trace.write({**entry, "error": str(e), "duration": time.perf_counter() - start})
+            raise
+        self._trace.write({**entry, "rows": rows, "duration": time.perf_counter() - start})
+        return _instances(rows)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._services, name)
+
+
+class RecordingLocator:
+    """
+    A `locator` for WMIConnection that connects with `locator`, by default through COM, and records
+    the instances of every query to `trace`. Queries are read completely before they are returned.
+    """
+
+    def __init__(self, trace: TraceRecorder, locator: Optional[Callable[[], Any]] = None):
+        self._trace = trace
+        self._locator = locator
+        self._connected: Any = None
+
+    def __call__(self) -> "RecordingLocator":
+        if self._locator is None:
+            from .wmi_connection import _dispatch_locator
+
+            self._locator = _dispatch_locator
+        self._connected = self._locator()
+        return self
+
+    def ConnectServer(self, server: str, namespace: str, *args) -> _RecordingServices:
+        return _RecordingServices(self._connected.ConnectServer(server, namespace, *args), namespace, self._trace)
+
+
+class _ReplayServices:
+    def __init__(self, trace: Trace, namespace: str, speed: Optional[float]):
+        self._trace = trace
+        self._namespace = namespace
+        self._speed = speed
+
+    def ExecQuery(self, query: str, *args) -> List[_ReplayedInstance]:
+        entry = self._trace.query(self._namespace, query)
+        delay = _delay(entry["duration"], self._speed)
+        if delay:
+            time.sleep(delay)
+        if "error" in entry:
+            raise ReplayException(entry["error"])
+        return _instances(entry["rows"])
+
+
+class ReplayLocator:
+    """
+    A `locator` for WMIConnection serving the instances recorded in `trace`, see ReplayLauncher for `speed`.
+    Recorded failures are raised again as a ReplayException.
+    `WMIConnection(account, logger, locator=ReplayLocator(Trace("cycle.jsonl.gz"), speed=10))`
+    """
+
+    def __init__(self, trace: Trace, speed: Optional[float] = None):
+        self._trace = trace
+        self._speed = speed
+
+    def __call__(self) -> "ReplayLocator":
+        return self
+
+    def ConnectServer(self, server: str, namespace: str, *args) -> _ReplayServices:
+        return _ReplayServices(self._trace, namespace, self._speed)
@@ -0,0 +1,81 @@
+import logging
+import threading
+from typing import Dict, Optional
+
+
+class UsnChange:
+    """
+    What changed on a DC since the last committed cycle.
+    `full` is set when there is nothing to compare to, the first time a DC is seen or when its USN went back,
+    e.g. after the DC was restored from a backup. The whole directory has to be enumerated then.
+    """
+
+    __slots__ = ("dc", "low", "high", "full")
+
+    def __init__(self, dc: str, low: Optional[int], high: int, full: bool):
+        self.dc = dc
+        self.low = low
+        self.high = high
+        self.full = full
+
+    @property
+    def changed(self) -> bool:
+        return self.full or self.low <= self.high
+
+    def ldap_filter(self, object_filter: str = "") -> str:
+        """
+        An LDAP filter matching the objects that changed in the range, combined with `object_filter`.
+        `change.ldap_filter("(objectClass=user)")` -> `(&(objectClass=user)(uSNChanged>=1201)(uSNChanged<=1250))`
+        """
+        if self.full:
+            return object_filter or "(objectClass=*)"
+        return f"(&{object_filter}(uSNChanged>={self.low})(uSNChanged<={self.high}))"
+
+    def __repr__(self):
+        return f"UsnChange({self.dc!r}, low={self.low}, high={self.high}, full={self.full})"
+
+
+class UsnChangeTracker:
+    """
+    Remembers the highestCommittedUSN of every DC to tell whether anything changed in the directory
+    since the previous cycle, so enumerations can be skipped when it didn't move.
+    USNs are local to each DC, so a range is only valid for queries against the DC it was read from.
+    Commit a change once it has been processed, a cycle that fails is then retried with the same range.
+    `change = tracker.check(dc, get_selected_ldap_attributes(path, ["highestCommittedUSN"]).highest_committed_usn)`
+    `if change.changed:`
+    `    enumerate(change.ldap_filter("(objectClass=computer)"))`
+    `    tracker.commit(change)`
+    """
+
+    def __init__(self, logger: logging.Logger | None = None):
+        self.logger = logger or logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._committed: Dict[str, int] = {}
+
+    def check(self, dc: str, usn: int | str) -> UsnChange:
+        """
+        Compares `usn`, the current highestCommittedUSN of `dc`, to the last committed one.
+        """
+        # Integer8 attributes of the rootDSE are returned as strings
+        usn = int(usn)
+        with self._lock:
+            last = self._committed.get(dc)
+
+        if last is None:
+            return UsnChange(dc, None, usn, True)
+        if usn < last:
+            self.logger.warning(f"highestCommittedUSN of {dc} went back from {last} to {usn}, enumerating everything")
+            return UsnChange(dc, None, usn, True)
+        return UsnChange(dc, last + 1, usn, False)
+
+    def commit(self, change: UsnChange):
+        with self._lock:
+            self._committed[change.dc] = change.high
+
+    def last_usn(self, dc: str) -> Optional[int]:
+        with self._lock:
+            return self._committed.get(dc)
+
+    def forget(self, dc: str):
+        with self._lock:
+            self._committed.pop(dc, None)
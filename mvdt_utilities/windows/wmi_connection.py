@@ -1,10 +1,72 @@
+from __future__ import annotations
+
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+from functools import lru_cache
 from logging import Logger
-from typing import List, Optional, Tuple
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 
-import win32com.client
-import win32security
 import time
 
+try:
+    import pythoncom
+    import win32com.client
+    import win32security
+except ImportError:
+    # Outside of Windows only connections with a replacement `locator` work, e.g. in the benchmarks
+    pythoncom = win32com = win32security = None
+
+from ..execution_time import timed
+from .wmi_refresher import WMIRefresher
+
+# https://learn.microsoft.com/en-us/windows/win32/wmisdk/swbemservices-execquery
+WBEM_FLAG_RETURN_IMMEDIATELY = 0x10
+WBEM_FLAG_FORWARD_ONLY = 0x20
+
+# COM/RPC failures after which a connection has to be established again
+_CONNECTION_ERROR_CODES = {
+    0x800706BA,  # RPC_S_SERVER_UNAVAILABLE
+    0x800706BE,  # RPC_S_CALL_FAILED
+    0x800706BF,  # RPC_S_CALL_FAILED_DNE
+    0x80010007,  # RPC_E_SERVER_DIED
+    0x80010012,  # RPC_E_SERVER_DIED_DNE
+    0x80010108,  # RPC_E_DISCONNECTED
+    0x800401FD,  # CO_E_OBJNOTCONNECTED
+    0x80041015,  # WBEM_E_TRANSPORT_FAILURE
+    0x80041033,  # WBEM_E_SHUTTING_DOWN
+}
+
+
+def is_connection_error(error: Exception) -> bool:
+    """
+    Returns True when `error` is a com_error caused by the connection to WMI being lost.
+    The code is either the HRESULT itself or, for DISP_E_EXCEPTION, the scode of the exception info.
+    """
+    codes = [getattr(error, "hresult", None)]
+    excepinfo = getattr(error, "excepinfo", None)
+    if excepinfo and len(excepinfo) > 5:
+        codes.append(excepinfo[5])
+    return any(code is not None and code & 0xFFFFFFFF in _CONNECTION_ERROR_CODES for code in codes)
+
+
+@lru_cache(maxsize=64)
+def _row_type(properties: Tuple[str, ...]):
+    # rename=True keeps system properties such as __PATH usable, they become positional fields
+    return namedtuple("WMIRow", properties, rename=True)
+
+
+def _dispatch_locator():
+    return win32com.client.Dispatch("WbemScripting.SWbemLocator")
+
+
+class WMIQueryException(Exception):
+    def __init__(self, query: str, message: str):
+        self.query = query
+        self.message = message
+        super().__init__(message)
+
+
 class WMIConnection:
     """
     A wrapper class around some Win32 components that allows local connections to WMI.
@@ -14,15 +76,31 @@ class WMIConnection:
     This is better than the wmi library since it only allows username/password connections remotely.
     `with WMIConnection(self.account, self.logger) as c:`
         `c.query("Select * from Win32_ComputerSystem")`
+
+    `locator` - Creates the SWbemLocator used to connect, by default through COM.
+    A replacement can serve recorded results instead, e.g. to benchmark the queries on a machine without WMI.
+    Without pywin32 only connections with a replacement locator work, they skip the impersonation.
     """
 
     def __init__(
-        self, account: Tuple[str, str], logger: Logger, namespace: str = "root\\cimv2"
+        self,
+        account: Tuple[str, str],
+        logger: Logger,
+        namespace: str = "root\\cimv2",
+        reconnect: bool = False,
+        locator: Callable[[], Any] | None = None,
     ):
         self._domain, self._username = str(account[0]).split("\\")
         self._password = str(account[1])
         self._namespace = namespace
         self._conn: any = None
+        self._token: any = None
+
+        # When set, a query failing because the connection was lost reconnects and is retried once
+        self._reconnect = reconnect
+        self.reconnects = 0
+        self._locator = locator or _dispatch_locator
+        self._custom_locator = locator is not None
 
         self.logger = logger
 
@@ -30,48 +108,208 @@ class WMIConnection:
         """
         The function thats implicitly called when used in a 'with' statement.
         """
-        token = win32security.LogonUser(
-            self._username,
-            self._domain,
-            self._password,
-            win32security.LOGON32_LOGON_INTERACTIVE,
-            win32security.LOGON32_PROVIDER_DEFAULT,
-        )
-        win32security.ImpersonateLoggedOnUser(token)
+        self._impersonate()
+        self._connect()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._revert()
+        self._conn = None
+
+    def _impersonate(self):
+        if win32security is None:
+            if self._custom_locator:
+                return
+            raise RuntimeError("pywin32 is required to impersonate the account of a WMIConnection")
+        if self._token is None:
+            self._token = win32security.LogonUser(
+                self._username,
+                self._domain,
+                self._password,
+                win32security.LOGON32_LOGON_INTERACTIVE,
+                win32security.LOGON32_PROVIDER_DEFAULT,
+            )
+        win32security.ImpersonateLoggedOnUser(self._token)
+
+    def _revert(self):
+        if win32security is not None:
+            win32security.RevertToSelf()
+
+    def _connect(self):
         try:
-            c = win32com.client.Dispatch("WbemScripting.SWbemLocator")
+            c = self._locator()
             self._conn = c.ConnectServer(".", self._namespace)
         except Exception as e:
+            self._conn = None
             self.logger.error(f"Error dispatching SWbemLocator: {e}")
-        return self
 
-    def __exit__(self, exc_type, exc_value, traceback):
-        win32security.RevertToSelf()
-        self._conn = None
+    def _exec_query(self, query: str) -> win32com.client.CDispatch:
+        result = self._conn.ExecQuery(query)
+        # Looks strange from the outside but its required to correctly catch most errors.
+
+        # The COM object returned from ExecQuery still references other COM objects internally. 
+        # When its possible that the resulting COM object is a collection of other COM objects, 
+        # it calls back out to the WMI provider using __next__ Python function.
+        
+        # The child COM objects aren't actually resolved until they're queried - meaning the 
+        # query can error but its not known until the COM object is iterated on or indexed.
+        # Trying to access the length results in all the child COM objects being traversed
+        # which will throw and subsequently handle any errors.
+        _ = len(result)
+        return result
 
     def query(self, query: str) -> Optional[win32com.client.CDispatch]:
         try:
             if self._conn is not None:
-                start = time.perf_counter()
-                result = self._conn.ExecQuery(query)
-                # Looks strange from the outside but its required to correctly catch most errors.
-
-                # The COM object returned from ExecQuery still references other COM objects internally. 
-                # When its possible that the resulting COM object is a collection of other COM objects, 
-                # it calls back out to the WMI provider using __next__ Python function.
-                
-                # The child COM objects aren't actually resolved until they're queried - meaning the 
-                # query can error but its not known until the COM object is iterated on or indexed.
-                # Trying to access the length results in all the child COM objects being traversed
-                # which will throw and subsequently handle any errors.
-                _ = len(result)
-                end = time.perf_counter()
-                self.logger.debug(f"Executed query '{query}' in {end - start}s")
+                with timed("WMIConnection.query", self._timing_dimensions) as timer:
+                    try:
+                        result = self._exec_query(query)
+                    except Exception as e:
+                        if not (self._reconnect and is_connection_error(e)):
+                            raise
+                        self.logger.warning(
+                            f"Lost the connection to WMI namespace {self._namespace}, reconnecting: {e}"
+                        )
+                        self.reconnects += 1
+                        self._connect()
+                        if self._conn is None:
+                            return None
+                        result = self._exec_query(query)
+                self.logger.debug(f"Executed query '{query}' in {timer.elapsed}s")
                 return result
         except Exception as e:
             self.logger.error(f"Error executing query '{query}': {e}")
         return None
     
+    def _timing_dimensions(self) -> Dict[str, str]:
+        return {"namespace": self._namespace, "account": f"{self._domain}\\{self._username}"}
+
+    def _exec_forward_only(self, query: str) -> win32com.client.CDispatch:
+        if self._conn is None:
+            raise WMIQueryException(query, f"Not connected to WMI namespace {self._namespace}")
+
+        flags = WBEM_FLAG_RETURN_IMMEDIATELY | WBEM_FLAG_FORWARD_ONLY
+        try:
+            try:
+                return self._conn.ExecQuery(query, "WQL", flags)
+            except Exception as e:
+                if not (self._reconnect and is_connection_error(e)):
+                    raise
+                self.logger.warning(f"Lost the connection to WMI namespace {self._namespace}, reconnecting: {e}")
+                self.reconnects += 1
+                self._connect()
+                if self._conn is None:
+                    raise
+                return self._conn.ExecQuery(query, "WQL", flags)
+        except Exception as e:
+            raise WMIQueryException(query, f"Error executing query '{query}': {e}") from e
+
+    def iter_query(self, query: str) -> Iterator[win32com.client.CDispatch]:
+        """
+        Runs the query semisynchronously and forward-only, yielding the rows as WMI returns them.
+        Unlike `query` nothing is enumerated up front and WMI releases every row once it was returned,
+        so memory stays flat on large classes. The rows can only be iterated once.
+
+        Throws: A WMIQueryException when the query fails, including failures in the middle of the enumeration.
+        """
+        start = time.perf_counter()
+        result = self._exec_forward_only(query)
+        try:
+            rows = iter(result)
+        except Exception as e:
+            raise WMIQueryException(query, f"Error executing query '{query}': {e}") from e
+
+        count = 0
+        while True:
+            try:
+                row = next(rows)
+            except StopIteration:
+                break
+            except Exception as e:
+                raise WMIQueryException(query, f"Error enumerating query '{query}' after {count} rows: {e}") from e
+            count += 1
+            yield row
+
+        end = time.perf_counter()
+        self.logger.debug(f"Enumerated {count} rows of query '{query}' in {end - start}s")
+
+    def query_rows(
+        self, query: str, properties: List[str], columnar: bool = False, batch_size: int = 256
+    ) -> List[Tuple] | Dict[str, List[Any]]:
+        """
+        Runs the query forward-only and copies only `properties` out of every instance,
+        releasing the COM objects as soon as they have been read.
+        Instances are fetched from the enumerator `batch_size` at a time and their properties are read through
+        the raw IDispatch interface, without building a CDispatch wrapper for each of them.
+        The DISPIDs of `properties` are looked up once on the first instance and reused for the others,
+        so query a single class rather than a base class whose subclasses may number their properties differently.
+        Select only the needed properties in `query` as well so that WMI doesn't gather the others.
+
+        Returns a list of namedtuples with `properties` as fields,
+        or with `columnar` a dict of property name to the list of its values.
+
+        Throws: A WMIQueryException when the query fails, including failures in the middle of the enumeration.
+        """
+        start = time.perf_counter()
+        row_type = _row_type(tuple(properties))
+        rows: List[Tuple] = []
+
+        result = self._exec_forward_only(query)
+        enum = None
+        try:
+            if not hasattr(result, "_oleobj_"):
+                # Not a COM object, the result of a replacement locator
+                for instance in result:
+                    rows.append(row_type._make(getattr(instance, p) for p in properties))
+            else:
+                # The same call win32com makes to iterate a collection, minus wrapping every item
+                enum = result._oleobj_.InvokeTypes(
+                    pythoncom.DISPID_NEWENUM,
+                    0,
+                    pythoncom.DISPATCH_METHOD | pythoncom.DISPATCH_PROPERTYGET,
+                    (13, 10),
+                    (),
+                ).QueryInterface(pythoncom.IID_IEnumVARIANT)
+                dispids: List[int] | None = None
+                while True:
+                    batch = enum.Next(batch_size)
+                    if not batch:
+                        break
+                    for instance in batch:
+                        if dispids is None:
+                            dispids = [instance.GetIDsOfNames(p) for p in properties]
+                        try:
+                            rows.append(row_type._make(
+                                instance.Invoke(d, 0, pythoncom.DISPATCH_PROPERTYGET, True) for d in dispids
+                            ))
+                        except pythoncom.com_error:
+                            # An instance that doesn't know a DISPID, e.g. of a subclass when querying a base class
+                            rows.append(row_type._make(
+                                instance.Invoke(instance.GetIDsOfNames(p), 0, pythoncom.DISPATCH_PROPERTYGET, True)
+                                for p in properties
+                            ))
+                    batch = instance = None
+        except Exception as e:
+            raise WMIQueryException(query, f"Error enumerating query '{query}' after {len(rows)} rows: {e}") from e
+        finally:
+            result = enum = None
+
+        end = time.perf_counter()
+        self.logger.debug(f"Materialized {len(rows)} rows of query '{query}' in {end - start}s")
+
+        if columnar:
+            columns = list(zip(*rows)) if rows else [()] * len(properties)
+            return {p: list(column) for p, column in zip(properties, columns)}
+        return rows
+
+    def refresher(self) -> WMIRefresher:
+        """
+        Creates a WMIRefresher to sample performance counter classes of this connection's namespace.
+        """
+        if self._conn is None:
+            raise WMIQueryException("", f"Not connected to WMI namespace {self._namespace}")
+        return WMIRefresher(self._conn)
+
     def query_or_empty_list(self, query: str) -> win32com.client.CDispatch | List[object]:
         return self.query(query) or []
 
@@ -79,4 +317,67 @@ class WMIConnection:
         return self._domain == "dynatrace" and self._username == "demo" and self._password == "demo"
 
     def to_underlying(self) -> any:
-        return self._conn
\ No newline at end of file
+        return self._conn
+
+
+class WMIConnectionPool:
+    """
+    Keeps one WMIConnection per (account, namespace) across collection cycles instead of logging on
+    and connecting to WMI in every 'with' block.
+    Impersonation only lasts for the 'with' block, connections lost to RPC/COM failures are re-established.
+    Connections live in the COM apartment of the thread that created them, so use the pool from
+    the same thread or from threads initialized for the multithreaded apartment.
+    `pool = WMIConnectionPool(self.logger)`
+    `with pool.connection(self.account, "root\\cimv2") as c:`
+        `c.query("Select * from Win32_ComputerSystem")`
+    """
+
+    def __init__(self, logger: Logger, locator: Callable[[], Any] | None = None):
+        self.logger = logger
+        self._locator = locator
+        self._lock = threading.Lock()
+        self._connections: Dict[Tuple[str, str], WMIConnection] = {}
+        self._connect_locks: Dict[Tuple[str, str], threading.Lock] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @contextmanager
+    def connection(self, account: Tuple[str, str], namespace: str = "root\\cimv2") -> Iterator[WMIConnection]:
+        key = (str(account[0]).lower(), namespace.lower())
+        with self._lock:
+            conn = self._connections.get(key)
+            if conn is None or conn._password != str(account[1]):
+                conn = self._connections[key] = WMIConnection(
+                    account, self.logger, namespace, reconnect=True, locator=self._locator
+                )
+                self._connect_locks[key] = threading.Lock()
+            connect_lock = self._connect_locks[key]
+
+        conn._impersonate()
+        try:
+            with connect_lock:
+                connected = conn._conn is not None
+                if not connected:
+                    conn._connect()
+            with self._lock:
+                if connected:
+                    self.hits += 1
+                else:
+                    self.misses += 1
+            yield conn
+        finally:
+            conn._revert()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "reconnects": sum(c.reconnects for c in self._connections.values()),
+                "connections": len(self._connections),
+            }
+
+    def close(self):
+        with self._lock:
+            self._connections.clear()
+            self._connect_locks.clear()
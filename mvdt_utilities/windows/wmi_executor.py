@@ -0,0 +1,119 @@
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from logging import Logger
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+try:
+    import pythoncom
+except ImportError:
+    # Windows only, see wmi_connection
+    pythoncom = None
+
+from .wmi_connection import WMIConnectionPool
+
+# A job is (namespace, query) or (namespace, query, properties)
+WMIJob = Tuple[str, str] | Tuple[str, str, List[str]]
+
+
+class WMIJobResult:
+    """
+    The outcome of one job, either its rows or the error it failed with.
+    Rows are namedtuples when the job listed its properties, dicts of every property otherwise.
+    """
+
+    def __init__(self, namespace: str, query: str):
+        self.namespace = namespace
+        self.query = query
+        self.rows: List[Any] = []
+        self.error: Optional[BaseException] = None
+        self.duration: Optional[float] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def __repr__(self):
+        state = f"{len(self.rows)} rows" if self.ok else f"error={self.error!r}"
+        return f"WMIJobResult({self.namespace!r}, {self.query!r}, {state})"
+
+
+def _initialize_com():
+    # Every worker joins the multithreaded apartment so pooled connections can be shared between them
+    if pythoncom is not None:
+        pythoncom.CoInitializeEx(pythoncom.COINIT_MULTITHREADED)
+
+
+class WMIQueryExecutor:
+    """
+    Runs WMI queries against several namespaces in parallel, so a cycle takes about as long as its slowest query
+    instead of the sum of all of them.
+    Every worker thread initializes COM and impersonates the account itself, connections are reused across cycles.
+    `executor = WMIQueryExecutor(self.account, self.logger)`
+    `results = executor.run([("root\\cimv2", "Select Name From Win32_Service"),
+                             ("root\\MicrosoftDNS", "Select * From MicrosoftDNS_Statistic")], deadline=30)`
+
+    `pool` - Shares the connections of a WMIConnectionPool, e.g. with other executors. Its connections must live in
+    the multithreaded apartment. By default the executor has a pool of its own, which `close` closes.
+    """
+
+    def __init__(
+        self, account: Tuple[str, str], logger: Logger, max_workers: int = 4, pool: WMIConnectionPool | None = None
+    ):
+        self._account = account
+        self.logger = logger
+        self._owns_pool = pool is None
+        self._pool = pool if pool is not None else WMIConnectionPool(logger)
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="wmi-query", initializer=_initialize_com
+        )
+
+    def run(self, jobs: Sequence[WMIJob], deadline: Optional[float] = None) -> List[WMIJobResult]:
+        """
+        Runs all the jobs and returns their results in the same order.
+
+        `deadline` - Seconds to wait for all the jobs, the ones that did not finish in time get a TimeoutError.
+        Queries that are already running can't be interrupted, they finish in the background.
+        """
+        results = [WMIJobResult(job[0], job[1]) for job in jobs]
+        futures: Dict[Future, WMIJobResult] = {
+            self._executor.submit(self._run_job, job): result for job, result in zip(jobs, results)
+        }
+
+        done, not_done = wait(futures, timeout=deadline)
+        for future in done:
+            result = futures[future]
+            result.rows, result.error, result.duration = future.result()
+        for future in not_done:
+            future.cancel()
+            result = futures[future]
+            result.error = TimeoutError(f"Query '{result.query}' did not finish within the deadline of {deadline}s")
+            self.logger.warning(f"WMI query '{result.query}' on {result.namespace} missed the deadline of {deadline}s")
+
+        return results
+
+    def _run_job(self, job: WMIJob) -> Tuple[List[Any], Optional[BaseException], float]:
+        namespace, query = job[0], job[1]
+        properties = job[2] if len(job) > 2 else None
+
+        start = time.perf_counter()
+        rows: List[Any] = []
+        error: Optional[BaseException] = None
+        try:
+            with self._pool.connection(self._account, namespace) as c:
+                if properties:
+                    rows = c.query_rows(query, properties)
+                else:
+                    # Plain dicts, COM objects must not leave the worker thread
+                    rows = [{p.Name: p.Value for p in row.Properties_} for row in c.iter_query(query)]
+        except Exception as e:
+            self.logger.error(f"Error executing query '{query}' on {namespace}: {e}")
+            error = e
+        return rows, error, time.perf_counter() - start
+
+    def stats(self) -> Dict[str, int]:
+        return self._pool.stats()
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        if self._owns_pool:
+            self._pool.close()
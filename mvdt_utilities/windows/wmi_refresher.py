@@ -0,0 +1,248 @@
+from typing import Any, Dict, List, Optional
+
+try:
+    import win32com.client
+except ImportError:
+    # Windows only, see wmi_connection
+    win32com = None
+
+# Counter types of the Win32_PerfRawData classes, from the CounterType qualifier of each property.
+# https://learn.microsoft.com/en-us/windows/win32/wmisdk/wmi-performance-counter-types
+PERF_COUNTER_RAWCOUNT_HEX = 0
+PERF_COUNTER_LARGE_RAWCOUNT_HEX = 256
+PERF_COUNTER_RAWCOUNT = 65536
+PERF_COUNTER_LARGE_RAWCOUNT = 65792
+PERF_COUNTER_DELTA = 4195328
+PERF_COUNTER_LARGE_DELTA = 4195584
+PERF_COUNTER_QUEUELEN_TYPE = 4523008
+PERF_COUNTER_LARGE_QUEUELEN_TYPE = 4523264
+PERF_COUNTER_100NS_QUEUELEN_TYPE = 5571840
+PERF_COUNTER_OBJ_TIME_QUEUELEN_TYPE = 6620416
+PERF_COUNTER_COUNTER = 272696320
+PERF_COUNTER_BULK_COUNT = 272696576
+PERF_RAW_FRACTION = 537003008
+PERF_LARGE_RAW_FRACTION = 537003264
+PERF_COUNTER_TIMER = 541132032
+PERF_100NSEC_TIMER = 542180608
+PERF_PRECISION_100NS_TIMER = 542573824
+PERF_OBJ_TIME_TIMER = 543229184
+PERF_SAMPLE_FRACTION = 549585920
+PERF_COUNTER_TIMER_INV = 557909248
+PERF_100NSEC_TIMER_INV = 558957824
+PERF_AVERAGE_TIMER = 805438464
+PERF_ELAPSED_TIME = 807666944
+PERF_AVERAGE_BULK = 1073874176
+
+_RAW_TYPES = {
+    PERF_COUNTER_RAWCOUNT_HEX,
+    PERF_COUNTER_LARGE_RAWCOUNT_HEX,
+    PERF_COUNTER_RAWCOUNT,
+    PERF_COUNTER_LARGE_RAWCOUNT,
+}
+_BASE_TYPES = {
+    PERF_RAW_FRACTION,
+    PERF_LARGE_RAW_FRACTION,
+    PERF_PRECISION_100NS_TIMER,
+    PERF_SAMPLE_FRACTION,
+    PERF_AVERAGE_TIMER,
+    PERF_AVERAGE_BULK,
+}
+SUPPORTED_COUNTER_TYPES = _RAW_TYPES | _BASE_TYPES | {
+    PERF_ELAPSED_TIME,
+    PERF_COUNTER_DELTA,
+    PERF_COUNTER_LARGE_DELTA,
+    PERF_COUNTER_COUNTER,
+    PERF_COUNTER_BULK_COUNT,
+    PERF_COUNTER_TIMER,
+    PERF_COUNTER_TIMER_INV,
+    PERF_100NSEC_TIMER,
+    PERF_100NSEC_TIMER_INV,
+    PERF_OBJ_TIME_TIMER,
+    PERF_COUNTER_QUEUELEN_TYPE,
+    PERF_COUNTER_LARGE_QUEUELEN_TYPE,
+    PERF_COUNTER_100NS_QUEUELEN_TYPE,
+    PERF_COUNTER_OBJ_TIME_QUEUELEN_TYPE,
+}
+
+# Properties every raw performance class has besides its counters
+_TIMESTAMP_PROPERTIES = (
+    "Timestamp_PerfTime",
+    "Frequency_PerfTime",
+    "Timestamp_Sys100NS",
+    "Timestamp_Object",
+    "Frequency_Object",
+)
+
+
+def _delta(current: Dict[str, int], previous: Dict[str, int], name: str) -> int:
+    return current[name] - previous[name]
+
+
+def compute_counter(
+    counter_type: int, name: str, current: Dict[str, int], previous: Optional[Dict[str, int]]
+) -> Optional[float]:
+    """
+    Computes the value a Win32_PerfFormattedData class would report for counter `name`,
+    from two samples of the raw class. `current` and `previous` hold the raw values of the counter,
+    its `<name>_Base` when it has one and the timestamp properties.
+
+    Returns None when the counter needs two samples and there is no previous one yet, or when no time passed.
+    """
+    x = current[name]
+    if counter_type in _RAW_TYPES:
+        return float(x)
+    if counter_type in (PERF_RAW_FRACTION, PERF_LARGE_RAW_FRACTION):
+        base = current[f"{name}_Base"]
+        return 100.0 * x / base if base else None
+    if counter_type == PERF_ELAPSED_TIME:
+        return (current["Timestamp_Object"] - x) / current["Frequency_Object"]
+
+    if previous is None:
+        return None
+
+    dx = _delta(current, previous, name)
+    perf_time = _delta(current, previous, "Timestamp_PerfTime")
+    sys_time = _delta(current, previous, "Timestamp_Sys100NS")
+
+    if counter_type in (PERF_COUNTER_DELTA, PERF_COUNTER_LARGE_DELTA):
+        return float(dx)
+    if counter_type in (PERF_COUNTER_COUNTER, PERF_COUNTER_BULK_COUNT):
+        return dx / (perf_time / current["Frequency_PerfTime"]) if perf_time else None
+    if counter_type == PERF_COUNTER_TIMER:
+        return 100.0 * dx / perf_time if perf_time else None
+    if counter_type == PERF_COUNTER_TIMER_INV:
+        return 100.0 * (1 - dx / perf_time) if perf_time else None
+    if counter_type == PERF_100NSEC_TIMER:
+        return 100.0 * dx / sys_time if sys_time else None
+    if counter_type == PERF_100NSEC_TIMER_INV:
+        return 100.0 * (1 - dx / sys_time) if sys_time else None
+    if counter_type in (PERF_COUNTER_QUEUELEN_TYPE, PERF_COUNTER_LARGE_QUEUELEN_TYPE):
+        return dx / perf_time if perf_time else None
+    if counter_type == PERF_COUNTER_100NS_QUEUELEN_TYPE:
+        return dx / sys_time if sys_time else None
+    if counter_type in (PERF_OBJ_TIME_TIMER, PERF_COUNTER_OBJ_TIME_QUEUELEN_TYPE):
+        object_time = _delta(current, previous, "Timestamp_Object")
+        if not object_time:
+            return None
+        return (100.0 if counter_type == PERF_OBJ_TIME_TIMER else 1.0) * dx / object_time
+
+    if counter_type in _BASE_TYPES:
+        base = _delta(current, previous, f"{name}_Base")
+        if not base:
+            return None
+        if counter_type in (PERF_PRECISION_100NS_TIMER, PERF_SAMPLE_FRACTION):
+            return 100.0 * dx / base
+        if counter_type == PERF_AVERAGE_TIMER:
+            return (dx / current["Frequency_PerfTime"]) / base
+        return dx / base
+
+    raise ValueError(f"Unsupported counter type {counter_type} for {name}")
+
+
+class RefreshedCounters:
+    """
+    The instances of one raw performance class registered on a WMIRefresher.
+    Holds the last two samples of every instance to compute the counter values from.
+    """
+
+    def __init__(self, item: Any, counter_types: Dict[str, int], key: str, single_instance: bool):
+        self._item = item
+        self._counter_types = counter_types
+        self._key = key
+        self._single_instance = single_instance
+
+        self._properties = list(_TIMESTAMP_PROPERTIES)
+        for name, counter_type in counter_types.items():
+            self._properties.append(name)
+            if counter_type in _BASE_TYPES or counter_type in (PERF_RAW_FRACTION, PERF_LARGE_RAW_FRACTION):
+                self._properties.append(f"{name}_Base")
+
+        self._previous: Dict[str, Dict[str, int]] = {}
+        self._current: Dict[str, Dict[str, int]] = {}
+
+    def _sample(self):
+        objects = [self._item.Object] if self._single_instance else self._item.ObjectSet
+        samples: Dict[str, Dict[str, int]] = {}
+        for obj in objects:
+            key = "" if self._single_instance else str(getattr(obj, self._key))
+            # uint64 properties are returned as strings by the scripting API
+            samples[key] = {p: int(getattr(obj, p) or 0) for p in self._properties}
+        self._previous = self._current
+        self._current = samples
+
+    def raw(self) -> Dict[str, Dict[str, int]]:
+        """
+        The raw values of the last refresh, keyed by instance.
+        """
+        return self._current
+
+    def values(self) -> Dict[str, Dict[str, Optional[float]]]:
+        """
+        The counter values computed from the last two refreshes, keyed by instance.
+        Counters that need two samples are None after the first refresh and for new instances.
+        """
+        return {
+            key: {
+                name: compute_counter(counter_type, name, current, self._previous.get(key))
+                for name, counter_type in self._counter_types.items()
+            }
+            for key, current in self._current.items()
+        }
+
+
+class WMIRefresher:
+    """
+    A wrapper around SWbemRefresher, the low overhead way to sample performance counters.
+    Classes are registered once and every `refresh` updates their instances in place instead of running the
+    WQL query again. Counter values are computed from the raw classes, so the formatted classes aren't needed.
+    Must be used while the WMIConnection it was created from is open.
+    `refresher = c.refresher()`
+    `processors = refresher.add_enum("Win32_PerfRawData_PerfOS_Processor", ["PercentProcessorTime"])`
+    Then every cycle:
+    `refresher.refresh()`
+    `processors.values()` -> `{"_Total": {"PercentProcessorTime": 12.5}, "0": {...}}`
+    """
+
+    def __init__(self, services: Any):
+        self._services = services
+        self._refresher = win32com.client.Dispatch("WbemScripting.SWbemRefresher")
+        self._registered: List[RefreshedCounters] = []
+
+    def _counter_types(self, class_name: str, properties: List[str]) -> Dict[str, int]:
+        """
+        Throws: A ValueError when a counter has a type that compute_counter doesn't support,
+        so it fails when registered rather than on every refresh.
+        """
+        definition = self._services.Get(class_name)
+        counter_types = {
+            p: int(definition.Properties_.Item(p).Qualifiers_.Item("CounterType").Value)
+            for p in properties
+        }
+        unsupported = {p: t for p, t in counter_types.items() if t not in SUPPORTED_COUNTER_TYPES}
+        if unsupported:
+            raise ValueError(f"Unsupported counter types of {class_name}: {unsupported}")
+        return counter_types
+
+    def add_enum(self, class_name: str, properties: List[str], key: str = "Name") -> RefreshedCounters:
+        """
+        Registers every instance of `class_name`, instances are told apart by their `key` property.
+        """
+        item = self._refresher.AddEnum(self._services, class_name)
+        counters = RefreshedCounters(item, self._counter_types(class_name, properties), key, False)
+        self._registered.append(counters)
+        return counters
+
+    def add_instance(self, path: str, properties: List[str]) -> RefreshedCounters:
+        """
+        Registers a single instance, e.g. `Win32_PerfRawData_PerfOS_Memory=@`. Its values are keyed by "".
+        """
+        item = self._refresher.Add(self._services, path)
+        class_name = path.split("=")[0].split(".")[0]
+        counters = RefreshedCounters(item, self._counter_types(class_name, properties), "", True)
+        self._registered.append(counters)
+        return counters
+
+    def refresh(self):
+        self._refresher.Refresh()
+        for counters in self._registered:
+            counters._sample()
@@ -0,0 +1,106 @@
+import asyncio
+import logging
+
+import pytest
+
+from mvdt_utilities.execution_time import Histogram, debug_execution_time, timed, timings
+
+
+@pytest.fixture
+def enabled():
+    timings.enabled = True
+    timings.reset()
+    yield timings
+    timings.enabled = True
+    timings.reset()
+
+
+def test_histogram_percentiles():
+    histogram = Histogram()
+    for duration in range(1, 1001):
+        histogram.record(duration * 1000, error=duration % 100 == 0)
+
+    assert histogram.count == 1000
+    assert histogram.errors == 10
+    assert (histogram.min_ns, histogram.max_ns) == (1000, 1_000_000)
+    for p in (50, 95, 99):
+        # Within the precision of the buckets
+        assert histogram.percentile(p) == pytest.approx(p * 10_000, rel=0.05)
+    assert histogram.percentile(100) == 1_000_000
+
+
+def test_histogram_single_and_empty():
+    histogram = Histogram()
+    assert histogram.percentile(50) == 0
+    histogram.record(12345)
+    assert histogram.percentile(50) == histogram.percentile(99) == 12345
+
+
+def test_function_is_timed(enabled, caplog):
+    logger = logging.getLogger("test_execution_time")
+
+    @debug_execution_time(name="test.function", logger=logger)
+    def add(a, b):
+        return a + b
+
+    with caplog.at_level(logging.DEBUG, logger="test_execution_time"):
+        assert add(1, 2) == 3
+    assert timings.snapshot()["test.function"]["count"] == 1
+    assert "Completed metric collection for function 'add'" in caplog.text
+
+
+def test_errors_are_counted(enabled):
+    @debug_execution_time
+    def fail():
+        raise ValueError()
+
+    with pytest.raises(ValueError):
+        fail()
+    snapshot = timings.snapshot()[fail.__qualname__]
+    assert (snapshot["count"], snapshot["errors"]) == (1, 1)
+
+
+def test_coroutine_is_timed(enabled):
+    @debug_execution_time(name="test.coroutine")
+    async def wait():
+        await asyncio.sleep(0.01)
+        return "done"
+
+    assert asyncio.run(wait()) == "done"
+    snapshot = timings.snapshot()["test.coroutine"]
+    assert snapshot["count"] == 1
+    assert snapshot["min"] >= 0.01
+
+
+def test_method_logs_to_instance_logger(enabled, caplog):
+    class Collector:
+        logger = logging.getLogger("test_execution_time.collector")
+
+        @debug_execution_time
+        def collect(self):
+            return 1
+
+    with caplog.at_level(logging.DEBUG, logger="test_execution_time.collector"):
+        Collector().collect()
+    assert "Completed metric collection for function 'collect'" in caplog.text
+
+
+def test_disabled_timings_still_log(enabled, caplog):
+    logger = logging.getLogger("test_execution_time")
+    timings.enabled = False
+
+    @debug_execution_time(name="test.disabled", logger=logger)
+    def work():
+        return 1
+
+    dimensions = []
+    with caplog.at_level(logging.DEBUG, logger="test_execution_time"):
+        work()
+        with timed("test.block", lambda: dimensions.append(1), logger) as timer:
+            pass
+
+    assert "test.disabled" not in timings.snapshot() and "test.block" not in timings.snapshot()
+    assert "Completed metric collection for function 'work'" in caplog.text
+    assert "test.block took" in caplog.text
+    assert timer.elapsed > 0
+    assert not dimensions
@@ -0,0 +1,57 @@
+"""
+Imports every module of the package, with the pywin32 modules replaced so it also runs on other platforms.
+Catches broken relative imports that the lazy __init__ files would only reveal on first use.
+"""
+import importlib
+import importlib.util
+import pkgutil
+import sys
+import types
+from unittest import mock
+
+import pytest
+
+import mvdt_utilities
+
+PYWIN32_MODULES = ["pythoncom", "pywintypes", "win32com", "win32com.client", "win32security"]
+
+# Load the Windows APIs with ctypes.WinDLL and msvcrt at import time, they can't be replaced
+WINDOWS_ONLY_MODULES = {
+    "mvdt_utilities.windows.powershell.windows_runas",
+    "mvdt_utilities.windows.powershell.async_powershell",
+}
+
+
+def _modules():
+    for module in pkgutil.walk_packages(mvdt_utilities.__path__, prefix="mvdt_utilities."):
+        yield module.name
+
+
+@pytest.fixture
+def pywin32():
+    stubs = {name: mock.MagicMock(spec=types.ModuleType(name)) for name in PYWIN32_MODULES}
+    stubs["win32com"].client = stubs["win32com.client"]
+    for name in PYWIN32_MODULES:
+        # Not a mock of an exception class, except clauses need a real one
+        stubs[name].com_error = type("com_error", (Exception,), {})
+    # On Windows the real modules are used
+    missing = {name: stub for name, stub in stubs.items() if name not in sys.modules}
+    with mock.patch.dict(sys.modules, missing):
+        yield
+
+
+@pytest.mark.parametrize("name", sorted(_modules()))
+def test_import(name, pywin32):
+    if name in WINDOWS_ONLY_MODULES and sys.platform != "win32":
+        pytest.skip("Needs the Windows APIs")
+    importlib.import_module(name)
+
+
+@pytest.mark.parametrize("package", ["mvdt_utilities", "mvdt_utilities.windows", "mvdt_utilities.windows.powershell"])
+def test_lazy_attributes(package, pywin32):
+    module = importlib.import_module(package)
+    for name in module.__all__:
+        source = importlib.util.resolve_name(module._ATTRIBUTES[name], package)
+        if source in WINDOWS_ONLY_MODULES and sys.platform != "win32":
+            continue
+        assert getattr(module, name) is not None
@@ -0,0 +1,122 @@
+import gzip
+import http.server
+import threading
+
+import pytest
+
+from mvdt_utilities.ingest_client import INGEST_PATH, MetricsIngestClient
+
+
+class _IdleClosingHandler(http.server.BaseHTTPRequestHandler):
+    # Answers keep-alive, then closes the connection like a server dropping it once it was idle
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.payloads.append((self.path, gzip.decompress(body)))
+        self.send_response(202)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+        self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _IdleClosingHandler)
+    server.payloads = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_reconnects_when_kept_alive_connection_was_closed(server):
+    client = MetricsIngestClient(base_urls=[f"http://127.0.0.1:{server.server_port}"], flush_interval=60)
+    try:
+        for i in range(3):
+            client.add(f"metric.count,run={i} 1")
+            assert client.flush(timeout=10)
+    finally:
+        client.close(timeout=10)
+
+    assert [body for _, body in server.payloads] == [f"metric.count,run={i} 1".encode() for i in range(3)]
+    assert all(path == INGEST_PATH for path, _ in server.payloads)
+    assert client.stats()["sent_payloads"] == 3
+    assert client.stats()["failed_payloads"] == 0
+    assert client.stats()["retries"] == 0
+
+
+class _BlockingHandler(http.server.BaseHTTPRequestHandler):
+    # Holds every request until the test releases it, so the client is stuck sending its first payload
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.received.set()
+        self.server.release.wait(10)
+        self.send_response(202)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def blocking_server():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _BlockingHandler)
+    server.daemon_threads = True
+    server.received = threading.Event()
+    server.release = threading.Event()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.release.set()
+    server.shutdown()
+    server.server_close()
+
+
+def _stuck_client(server, **kwargs) -> MetricsIngestClient:
+    client = MetricsIngestClient(
+        base_urls=[f"http://127.0.0.1:{server.server_port}"], flush_interval=0.01, max_retries=0, **kwargs
+    )
+    client.add("metric.first 1")
+    assert server.received.wait(5)
+    return client
+
+
+def test_queue_is_bounded_by_lines(blocking_server):
+    client = _stuck_client(blocking_server, queue_size=4)
+    try:
+        assert client.add_payloads([b"metric.a 1\nmetric.b 1\nmetric.c 1"]) == 0
+        assert client.add_payloads([b"metric.a 2\nmetric.b 2\nmetric.c 2"]) == 1
+        assert client.add("metric.d 1")
+        assert client.stats()["dropped_lines"] == 3
+        assert client.stats()["queued_lines"] == 4
+    finally:
+        blocking_server.release.set()
+        client.close(timeout=5)
+
+
+def test_lines_added_after_close_are_dropped(server):
+    client = MetricsIngestClient(base_urls=[f"http://127.0.0.1:{server.server_port}"])
+    client.close(timeout=5)
+
+    assert not client.add("metric.late 1")
+    assert client.add_payloads([b"metric.a 1\nmetric.b 1"]) == 1
+    assert client.stats()["dropped_lines"] == 3
+
+
+def test_close_timeout_closes_connections(blocking_server):
+    client = _stuck_client(blocking_server)
+    client.close(timeout=0.1)
+
+    # The request waiting for the server fails once its connection is closed
+    client._thread.join(5)
+    assert not client._thread.is_alive()
+    assert not client._connections
+    assert client.stats()["failed_payloads"] == 1
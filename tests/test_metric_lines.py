@@ -0,0 +1,94 @@
+import pytest
+
+from mvdt_utilities.metric_lines import (
+    MAX_DIMENSION_VALUE_LENGTH,
+    MetricLineBuilder,
+    escape_dimension_value,
+    normalize_dimension_key,
+)
+
+
+def _lines(builder: MetricLineBuilder):
+    return [line for payload in builder.payloads() for line in payload.decode().split("\n")]
+
+
+@pytest.mark.parametrize(
+    "value, escaped",
+    [
+        ("Spooler", "Spooler"),
+        ("dc01.example.com", "dc01.example.com"),
+        ("Print Spooler", '"Print Spooler"'),
+        ("a,b=c", '"a,b=c"'),
+        ('say "hi"', '"say \\"hi\\""'),
+        ("C:\\Program Files", '"C:\\\\Program Files"'),
+        ("two\nlines", '"two lines"'),
+    ],
+)
+def test_escape_dimension_value(value, escaped):
+    assert escape_dimension_value(value) == escaped
+
+
+def test_long_dimension_value_is_truncated():
+    assert escape_dimension_value("a" * 300) == "a" * MAX_DIMENSION_VALUE_LENGTH
+
+
+def test_normalize_dimension_key():
+    assert normalize_dimension_key("Service Name") == "service_name"
+    assert normalize_dimension_key("1st") == "_1st"
+
+
+def test_lines():
+    builder = MetricLineBuilder(default_dimensions={"host": "dc01"})
+    prefix = builder.prefix("win.service.state", {"domain": "example.com"})
+    builder.gauge(prefix, 1, {"service": "Print Spooler", "empty": ""})
+    builder.count(prefix, 3, timestamp=1700000000000)
+    builder.summary(prefix, 0.5, 2.0, 3.5, 3)
+
+    assert _lines(builder) == [
+        'win.service.state,host=dc01,domain=example.com,service="Print Spooler" gauge,1',
+        "win.service.state,host=dc01,domain=example.com count,delta=3 1700000000000",
+        "win.service.state,host=dc01,domain=example.com gauge,min=0.5,max=2,sum=3.5,count=3",
+    ]
+
+
+def test_values_that_are_not_finite_are_skipped():
+    builder = MetricLineBuilder()
+    prefix = builder.prefix("metric")
+    assert not builder.gauge(prefix, float("nan"))
+    assert not builder.count(prefix, float("inf"))
+    assert builder.gauge(prefix, True)
+
+    assert _lines(builder) == ["metric gauge,1"]
+    assert builder.skipped == 2
+
+
+def test_invalid_metric_key():
+    builder = MetricLineBuilder()
+    assert builder.prefix("win.Service State") == b"\nwin.Service_State"
+    with pytest.raises(ValueError):
+        builder.prefix("1metric")
+
+
+def test_payloads_are_split_at_max_size():
+    builder = MetricLineBuilder(max_payload_bytes=100)
+    prefix = builder.prefix("metric")
+    for i in range(20):
+        builder.gauge(prefix, i, {"i": str(i)})
+
+    payloads = builder.payloads()
+    assert len(payloads) > 1
+    assert all(len(payload) <= 100 for payload in payloads)
+    lines = [line for payload in payloads for line in payload.decode().split("\n")]
+    assert lines == [f"metric,i={i} gauge,{i}" for i in range(20)]
+    assert builder.payloads() == []
+
+
+def test_line_longer_than_payload_is_skipped():
+    builder = MetricLineBuilder(max_payload_bytes=50)
+    prefix = builder.prefix("metric")
+    builder.gauge(prefix, 1)
+    assert not builder.gauge(prefix, 2, {"long": "x" * 100})
+    builder.gauge(prefix, 3)
+
+    assert _lines(builder) == ["metric gauge,1", "metric gauge,3"]
+    assert builder.skipped == 1
@@ -0,0 +1,78 @@
+import os
+
+import pytest
+
+from mvdt_utilities import oneagent_info
+from mvdt_utilities.oneagent_info import DeploymentConfigWatcher, get_deployment_config
+
+DEPLOYMENT_CONF = (
+    "Server={https://sg1.example.com:9999/communication;*https://sg2.example.com:9999/communication}"
+    "{https://abc12345.live.dynatrace.com/communication}\n"
+    "Tenant=abc12345\n"
+    "TenantToken=secret\n"
+)
+
+
+@pytest.fixture
+def conf(tmp_path):
+    path = tmp_path / "deployment.conf"
+    path.write_text(DEPLOYMENT_CONF)
+    yield path
+    oneagent_info._cache.pop(path, None)
+
+
+def _touch(path, text: str, mtime_ns: int):
+    path.write_text(text)
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_parse(conf):
+    config = get_deployment_config(conf)
+
+    assert config.tenant == "abc12345"
+    assert config.active_server == "https://sg2.example.com:9999/communication"
+    assert config.endpoint == "https://sg2.example.com:9999/e/abc12345"
+    assert config.endpoints() == [
+        "https://sg2.example.com:9999/e/abc12345",
+        "https://sg1.example.com:9999/e/abc12345",
+        "https://abc12345.live.dynatrace.com/e/abc12345",
+    ]
+
+
+@pytest.mark.parametrize("text", ["Tenant=abc12345\n", "Server={*https://sg1.example.com/communication}\n"])
+def test_missing_section(tmp_path, text):
+    path = tmp_path / "deployment.conf"
+    path.write_text(text)
+    with pytest.raises(Exception, match="Missing mandatory"):
+        get_deployment_config(path)
+
+
+def test_missing_file(tmp_path):
+    with pytest.raises(Exception, match="was not found"):
+        get_deployment_config(tmp_path / "deployment.conf")
+
+
+def test_parsed_once_per_modification(conf, monkeypatch):
+    parsed = []
+    parse = oneagent_info._parse_deployment_conf
+    monkeypatch.setattr(oneagent_info, "_parse_deployment_conf", lambda path: parsed.append(path) or parse(path))
+    _touch(conf, DEPLOYMENT_CONF, 1_000_000_000)
+
+    first = get_deployment_config(conf)
+    assert get_deployment_config(conf) is first
+    assert len(parsed) == 1
+
+    _touch(conf, DEPLOYMENT_CONF.replace("Tenant=abc12345", "Tenant=def67890"), 2_000_000_000)
+    assert get_deployment_config(conf).tenant == "def67890"
+    assert len(parsed) == 2
+
+
+def test_watcher_calls_back_on_change(conf):
+    changes = []
+    watcher = DeploymentConfigWatcher(changes.append, deployment_conf_path=conf)
+    watcher.config = get_deployment_config(conf)
+
+    assert not watcher.check()
+    _touch(conf, DEPLOYMENT_CONF.replace("*https://sg2", "https://sg2").replace("{https://sg1", "{*https://sg1"), 3)
+    assert watcher.check()
+    assert [config.active_server for config in changes] == ["https://sg1.example.com:9999/communication"]
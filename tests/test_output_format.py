@@ -0,0 +1,65 @@
+from mvdt_utilities.windows.powershell.output_format import (
+    FORMAT_CSV,
+    FORMAT_JSON,
+    FORMAT_LIST,
+    iter_format_list_records,
+    iter_records,
+    parse_output,
+)
+
+
+def test_format_list_joins_wrapped_lines():
+    output = (
+        "\r\n"
+        "Name        : Spooler\r\n"
+        "Description : Loads files to memory for later printing, this description is too lo\r\n"
+        "              ng for one line\r\n"
+        "Status      : Running\r\n"
+    )
+    assert parse_output(output, FORMAT_LIST) == [{
+        "Name": "Spooler",
+        "Description": "Loads files to memory for later printing, this description is too long for one line",
+        "Status": "Running",
+    }]
+
+
+def test_format_list_keeps_delimiter_in_value():
+    output = "Name    : Timer\r\nCommand : Start-Job : every 5 minutes : now\r\n"
+    assert parse_output(output, FORMAT_LIST) == [{"Name": "Timer", "Command": "Start-Job : every 5 minutes : now"}]
+
+
+def test_format_list_empty_values():
+    output = "Name        : Spooler\r\nDescription : \r\nPath        :\r\nStatus      : Running\r\n"
+    assert parse_output(output, FORMAT_LIST) == [
+        {"Name": "Spooler", "Description": "", "Path": "", "Status": "Running"}
+    ]
+
+
+def test_format_list_last_record_without_trailing_blank_line():
+    lines = ["", "Name : a", "", "", "Name : b", "", "Name : c"]
+    assert list(iter_format_list_records(lines)) == [{"Name": "a"}, {"Name": "b"}, {"Name": "c"}]
+
+
+def test_json_single_object_is_one_record():
+    assert parse_output('{"Name":"Spooler","Status":4}', FORMAT_JSON) == [{"Name": "Spooler", "Status": 4}]
+    assert parse_output('[{"Name":"a"},{"Name":"b"}]', FORMAT_JSON) == [{"Name": "a"}, {"Name": "b"}]
+    assert parse_output("\r\n", FORMAT_JSON) == []
+
+
+def test_json_lines_stream():
+    lines = ['{"Name":"a","Running":true}\r\n', "\r\n", '{"Name":"b","Running":false}\r\n']
+    assert list(iter_records(lines, FORMAT_JSON)) == [{"Name": "a", "Running": True}, {"Name": "b", "Running": False}]
+
+
+def test_csv_field_spanning_lines():
+    output = (
+        '"Name","Description"\r\n'
+        '"Spooler","First line\r\nsecond line, with a comma and ""quotes"""\r\n'
+        '"W32Time",""\r\n'
+    )
+    expected = [
+        {"Name": "Spooler", "Description": 'First line\r\nsecond line, with a comma and "quotes"'},
+        {"Name": "W32Time", "Description": ""},
+    ]
+    assert parse_output(output, FORMAT_CSV) == expected
+    assert list(iter_records(output.splitlines(keepends=True), FORMAT_CSV)) == expected
@@ -0,0 +1,40 @@
+import subprocess
+import sys
+from subprocess import PIPE
+
+import pytest
+
+from mvdt_utilities.windows.powershell.launcher import ProcessLauncher
+
+# Writes 100000 characters to stdout and 10 to stderr
+SCRIPT = "import sys; sys.stdout.write('a' * 100000); sys.stderr.write('b' * 10)"
+
+
+def test_output_is_capped_per_pipe(caplog):
+    result = ProcessLauncher().run([sys.executable, "-c", SCRIPT], stdout=PIPE, stderr=PIPE, max_output=1000)
+
+    assert result.returncode == 0
+    assert result.stdout == b"a" * 1000
+    assert result.stderr == b"b" * 10
+    assert "wrote 99000 more than the 1000 kept from its stdout" in caplog.text
+
+
+def test_text_output_is_capped_in_characters():
+    result = ProcessLauncher().run(
+        [sys.executable, "-c", SCRIPT], stdout=PIPE, stderr=PIPE, encoding="utf-8", max_output=5
+    )
+
+    assert (result.stdout, result.stderr) == ("aaaaa", "bbbbb")
+
+
+def test_uncapped_output():
+    result = ProcessLauncher().run([sys.executable, "-c", SCRIPT], stdout=PIPE, stderr=PIPE)
+
+    assert len(result.stdout) == 100000
+
+
+def test_capped_run_times_out():
+    with pytest.raises(subprocess.TimeoutExpired):
+        ProcessLauncher().run(
+            [sys.executable, "-c", "import time; time.sleep(10)"], stdout=PIPE, stderr=PIPE, timeout=0.5, max_output=10
+        )
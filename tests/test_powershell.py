@@ -0,0 +1,63 @@
+import base64
+import re
+from subprocess import CompletedProcess
+from typing import List
+
+from mvdt_utilities.windows.powershell.launcher import ProcessLauncher, split_account
+from mvdt_utilities.windows.powershell.powershell import PowershellException, PowershellHelper
+
+# CreateProcess rejects longer command lines
+MAX_COMMAND_LINE = 32767
+
+
+class _BatchLauncher(ProcessLauncher):
+    # Answers every command of a batch script as if it succeeded without output
+    def __init__(self):
+        self.command_lines: List[int] = []
+
+    def run(self, command: List[str], timeout=None, **kwargs) -> CompletedProcess:
+        self.command_lines.append(len(" ".join(command)))
+        script = base64.b64decode(command[-1]).decode("utf-16-le")
+        delimiter = re.search(r"__mvdtDelimiter = '(\w+)'", script).group(1)
+        commands = re.search(r"__mvdtCommands = @\((.*)\)", script).group(1).count("'") // 2
+        stdout = "".join(f"{delimiter} {index} OK\r\n" for index in range(commands))
+        return CompletedProcess(command, 0, stdout.encode(), b"")
+
+
+def test_batch_is_split_to_fit_command_line():
+    launcher = _BatchLauncher()
+    results = PowershellHelper(launcher=launcher).run_batch([f"Get-Item {i} " + "x" * 400 for i in range(40)])
+
+    assert results == [[{}]] * 40
+    assert len(launcher.command_lines) > 1
+    assert all(length <= MAX_COMMAND_LINE for length in launcher.command_lines)
+
+
+def test_batch_command_too_long_alone_fails_without_running():
+    launcher = _BatchLauncher()
+    results = PowershellHelper(launcher=launcher).run_batch(["Get-Item a", "x" * 30_000, "Get-Item b"])
+
+    assert results[0] == [{}] and results[2] == [{}]
+    assert isinstance(results[1], PowershellException)
+    assert all(length <= MAX_COMMAND_LINE for length in launcher.command_lines)
+
+
+class _CapturingLauncher(ProcessLauncher):
+    # Keeps the keyword arguments of every run
+    def __init__(self):
+        self.kwargs = []
+
+    def run(self, command: List[str], timeout=None, **kwargs) -> CompletedProcess:
+        self.kwargs.append(kwargs)
+        return CompletedProcess(command, 0, b"Name : Spooler\r\n", b"")
+
+
+def test_max_output_is_passed_to_launcher():
+    launcher = _CapturingLauncher()
+    assert PowershellHelper(launcher=launcher, max_output=1000).run_command("Get-Service") == [{"Name": "Spooler"}]
+    assert launcher.kwargs[0]["max_output"] == 1000
+
+
+def test_split_account():
+    assert split_account("EXAMPLE\\monitoring") == ("EXAMPLE", "monitoring")
+    assert split_account("monitoring") == (".", "monitoring")
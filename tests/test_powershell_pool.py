@@ -0,0 +1,85 @@
+import threading
+import time
+
+import pytest
+
+from mvdt_utilities.windows.powershell import powershell_pool
+from mvdt_utilities.windows.powershell.powershell_pool import (
+    PooledProcess,
+    PowershellPool,
+    PowershellSessionException,
+    PowershellSessionUnavailableException,
+)
+
+ACCOUNT_A = ("EXAMPLE\\a", "secret")
+ACCOUNT_B = ("EXAMPLE\\b", "secret")
+
+
+class _StubSession:
+    # Runs commands by calling them, a command can raise to act like a session that failed
+    def __init__(self, account, logger, launcher):
+        self.pid = id(self)
+        self.created = self.last_used = time.monotonic()
+        self.commands_run = 0
+
+    def is_alive(self) -> bool:
+        return True
+
+    def execute(self, command, timeout=None) -> PooledProcess:
+        self.commands_run += 1
+        return PooledProcess(command, command(), "", "", self.pid)
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(powershell_pool, "PowershellSession", _StubSession)
+    pool = PowershellPool(size=1)
+    yield pool
+    pool.close()
+
+
+def test_release_wakes_waiter_of_other_account(pool):
+    # Both accounts hold their only session, the waiter for A must get the session A releases
+    session_a = pool._acquire(ACCOUNT_A)
+    session_b = pool._acquire(ACCOUNT_B)
+    waiter_b = threading.Thread(target=lambda: pool._release(ACCOUNT_B, pool._acquire(ACCOUNT_B)), daemon=True)
+    waiter_b.start()
+    acquired = threading.Event()
+    waiter_a = threading.Thread(target=lambda: (pool._acquire(ACCOUNT_A), acquired.set()), daemon=True)
+    waiter_a.start()
+    time.sleep(0.1)
+
+    pool._release(ACCOUNT_A, session_a)
+    try:
+        assert acquired.wait(2)
+    finally:
+        pool._release(ACCOUNT_B, session_b)
+        waiter_b.join(2)
+
+
+def test_command_is_not_run_again_when_session_died_running_it(pool):
+    runs = []
+
+    def command():
+        runs.append(1)
+        raise PowershellSessionException("Powershell session exited while running")
+
+    with pytest.raises(PowershellSessionException):
+        pool.execute(ACCOUNT_A, command)
+    assert len(runs) == 1
+
+
+def test_command_is_sent_to_fresh_session_when_it_could_not_be_sent(pool):
+    attempts = []
+
+    def command():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise PowershellSessionUnavailableException("Could not send command")
+        return 5
+
+    assert pool.execute(ACCOUNT_A, command).returncode == 5
+    assert len(attempts) == 2
@@ -0,0 +1,101 @@
+import logging
+import subprocess
+import sys
+from subprocess import CompletedProcess
+from types import SimpleNamespace
+
+import pytest
+
+from mvdt_utilities.windows.powershell.launcher import ProcessLauncher
+from mvdt_utilities.windows.powershell.powershell import PowershellHelper
+from mvdt_utilities.windows.powershell.powershell_pool import PowershellPool
+from mvdt_utilities.windows.replay import (
+    RecordingLauncher,
+    RecordingLocator,
+    ReplayException,
+    ReplayLauncher,
+    ReplayLocator,
+    Trace,
+    TraceRecorder,
+)
+from mvdt_utilities.windows.wmi_connection import WMIConnection
+
+LOGGER = logging.getLogger("test_replay")
+ACCOUNT = ("EXAMPLE\\monitoring", "secret")
+OUTPUT = "\r\nName   : Spooler\r\nStatus : Running\r\n\r\nName   : W32Time\r\nStatus : Stopped\r\n"
+RECORDS = [{"Name": "Spooler", "Status": "Running"}, {"Name": "W32Time", "Status": "Stopped"}]
+
+
+class _FakeLauncher(ProcessLauncher):
+    # Outputs OUTPUT for every command, popen starts a Python process printing it
+    def run(self, command, timeout=None, **kwargs):
+        return CompletedProcess(command, 0, OUTPUT.encode(), b"")
+
+    def run_as(self, command, username, password, domain, timeout=None, **kwargs):
+        return SimpleNamespace(pid=1, returncode=0, stdout=OUTPUT, stderr="", wait=lambda timeout=None: 0)
+
+    def popen(self, command, **kwargs):
+        kwargs["encoding"] = "utf-8"
+        return subprocess.Popen([sys.executable, "-c", f"print({OUTPUT!r}, end='')"], **kwargs)
+
+
+class _FakeLocator:
+    # A SWbemLocator whose queries return two instances
+    def __call__(self):
+        return self
+
+    def ConnectServer(self, server, namespace):
+        return self
+
+    def ExecQuery(self, query, *args):
+        return [
+            SimpleNamespace(Properties_=[SimpleNamespace(Name="Name", Value=name), SimpleNamespace(Name="Id", Value=i)])
+            for i, name in enumerate(["Spooler", "W32Time"])
+        ]
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "cycle.jsonl.gz")
+    with TraceRecorder(path) as trace:
+        local = PowershellHelper(logger=LOGGER, launcher=RecordingLauncher(trace, _FakeLauncher()))
+        account = PowershellHelper(ACCOUNT, LOGGER, launcher=RecordingLauncher(trace, _FakeLauncher()))
+        assert local.run_command("Get-Service") == RECORDS
+        assert account.run_command("Get-Service") == RECORDS
+        assert list(local.iter_command("Get-Service")) == RECORDS
+
+        connection = WMIConnection(ACCOUNT, LOGGER, locator=RecordingLocator(trace, _FakeLocator()))
+        connection._connect()
+        recorded_rows = [(row.Name, row.Id) for row in connection.query("Select Name, Id from Win32_Service")]
+    assert trace.entries == 4
+
+    replayed = Trace(path)
+    assert len(replayed) == 4
+    launcher = ReplayLauncher(replayed)
+    assert PowershellHelper(logger=LOGGER, launcher=launcher).run_command("Get-Service") == RECORDS
+    assert PowershellHelper(ACCOUNT, LOGGER, launcher=launcher).run_command("Get-Service") == RECORDS
+    assert list(PowershellHelper(logger=LOGGER, launcher=launcher).iter_command("Get-Service")) == RECORDS
+    with pytest.raises(ReplayException):
+        PowershellHelper(logger=LOGGER, launcher=launcher).run_command("Get-Process")
+
+    connection = WMIConnection(ACCOUNT, LOGGER, locator=ReplayLocator(replayed))
+    connection._connect()
+    rows = [(row.Name, row.Id) for row in connection.query("Select Name, Id from Win32_Service")]
+    assert rows == recorded_rows == [("Spooler", 0), ("W32Time", 1)]
+
+
+def test_recorder_starts_over_unless_appending(tmp_path):
+    path = str(tmp_path / "cycle.jsonl")
+    for _ in range(2):
+        with TraceRecorder(path) as trace:
+            trace.write({"type": "wmi", "namespace": "root\\cimv2", "query": "q", "rows": [], "duration": 0})
+    assert len(Trace(path)) == 1
+
+    with TraceRecorder(path, append=True) as trace:
+        trace.write({"type": "wmi", "namespace": "root\\cimv2", "query": "q", "rows": [], "duration": 0})
+    assert len(Trace(path)) == 2
+
+
+def test_recording_launcher_rejects_pool(tmp_path):
+    with TraceRecorder(str(tmp_path / "cycle.jsonl")) as trace:
+        with pytest.raises(ValueError):
+            PowershellHelper(pool=PowershellPool(), launcher=RecordingLauncher(trace))
@@ -0,0 +1,130 @@
+import threading
+import time
+from subprocess import CompletedProcess
+
+import pytest
+
+from mvdt_utilities import result_cache
+from mvdt_utilities.result_cache import ResultCache
+from mvdt_utilities.windows.powershell.launcher import ProcessLauncher
+from mvdt_utilities.windows.powershell.output_format import FORMAT_JSON
+from mvdt_utilities.windows.powershell.powershell import PowershellHelper
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(result_cache.time, "monotonic", clock)
+    return clock
+
+
+def _wait_for_refresh(cache: ResultCache):
+    deadline = time.time() + 5
+    while cache._flights and time.time() < deadline:
+        time.sleep(0.01)
+
+
+def test_single_flight():
+    cache = ResultCache()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def loader():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "value"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get("key", loader))) for _ in range(5)]
+    threads[0].start()
+    started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert results == ["value"] * 5
+    assert len(calls) == 1
+
+
+def test_ttl(clock):
+    cache = ResultCache(ttl=10)
+    assert cache.get("key", lambda: 1) == 1
+    clock.now += 9
+    assert cache.get("key", lambda: 2) == 1
+    assert cache.get("other", lambda: 3, ttl=1) == 3
+    clock.now += 2
+    assert cache.get("key", lambda: 2) == 2
+    assert cache.get("other", lambda: 4) == 4
+    assert cache.stats()["hits"] == 1
+
+
+def test_lru_eviction():
+    cache = ResultCache(maxsize=2)
+    cache.get("a", lambda: 1)
+    cache.get("b", lambda: 2)
+    cache.get("a", lambda: 0)
+    cache.get("c", lambda: 3)
+
+    assert len(cache) == 2
+    assert cache.get("a", lambda: 0) == 1
+    assert cache.get("b", lambda: 0) == 0
+
+
+def test_stale_while_revalidate(clock):
+    cache = ResultCache(ttl=10, stale_while_revalidate=True, max_stale=100)
+    cache.get("key", lambda: 1)
+    clock.now += 20
+
+    assert cache.get("key", lambda: 2) == 1
+    _wait_for_refresh(cache)
+    assert cache.get("key", lambda: 3) == 2
+    assert cache.stats()["stale_hits"] == 1
+    assert cache.stats()["refreshes"] == 1
+
+
+def test_stale_is_not_served_past_max_stale(clock):
+    cache = ResultCache(ttl=10, stale_while_revalidate=True)
+    cache.get("key", lambda: 1)
+    clock.now += 25
+
+    # By default values are served stale for as long as the TTL
+    assert cache.get("key", lambda: 2) == 2
+
+
+def test_serve_stale_on_error_is_capped(clock):
+    def fail():
+        raise RuntimeError("unreachable")
+
+    cache = ResultCache(ttl=10, max_stale=30, serve_stale_on_error=True)
+    cache.get("key", lambda: 1)
+    clock.now += 20
+    assert cache.get("key", fail) == 1
+    clock.now += 30
+    with pytest.raises(RuntimeError):
+        cache.get("key", fail)
+
+
+class _JsonLauncher(ProcessLauncher):
+    def run(self, command, timeout=None, **kwargs):
+        return CompletedProcess(command, 0, b'[{"Name":"a","Tags":["x"],"Owner":{"Name":"b"}}]', b"")
+
+
+def test_cached_json_results_are_not_shared():
+    helper = PowershellHelper(cache=ResultCache(), launcher=_JsonLauncher())
+    first = helper.run_command("Get-Thing", FORMAT_JSON)
+    first[0]["Tags"].append("y")
+    first[0]["Owner"]["Name"] = "c"
+
+    assert helper.run_command("Get-Thing", FORMAT_JSON) == [{"Name": "a", "Tags": ["x"], "Owner": {"Name": "b"}}]
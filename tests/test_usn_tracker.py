@@ -0,0 +1,58 @@
+from mvdt_utilities.windows.usn_tracker import UsnChangeTracker
+
+
+def test_first_check_enumerates_everything():
+    change = UsnChangeTracker().check("dc1", "1200")
+
+    assert change.full and change.changed
+    assert change.high == 1200
+    assert change.ldap_filter("(objectClass=user)") == "(objectClass=user)"
+    assert change.ldap_filter() == "(objectClass=*)"
+
+
+def test_range_since_last_commit():
+    tracker = UsnChangeTracker()
+    tracker.commit(tracker.check("dc1", 1200))
+
+    unchanged = tracker.check("dc1", 1200)
+    assert not unchanged.full and not unchanged.changed
+
+    change = tracker.check("dc1", 1250)
+    assert change.changed and not change.full
+    assert (change.low, change.high) == (1201, 1250)
+    assert change.ldap_filter("(objectClass=user)") == "(&(objectClass=user)(uSNChanged>=1201)(uSNChanged<=1250))"
+
+
+def test_uncommitted_cycle_is_retried_with_same_range():
+    tracker = UsnChangeTracker()
+    tracker.commit(tracker.check("dc1", 1200))
+    tracker.check("dc1", 1250)
+
+    change = tracker.check("dc1", 1300)
+    assert (change.low, change.high) == (1201, 1300)
+    tracker.commit(change)
+    assert tracker.last_usn("dc1") == 1300
+
+
+def test_usn_going_back_enumerates_everything():
+    # A DC restored from a backup, or a counter that wrapped, starts over from a lower USN
+    tracker = UsnChangeTracker()
+    tracker.commit(tracker.check("dc1", 5000))
+
+    change = tracker.check("dc1", 100)
+    assert change.full and change.changed
+    tracker.commit(change)
+
+    assert (tracker.check("dc1", 150).low, tracker.check("dc1", 150).high) == (101, 150)
+
+
+def test_dcs_are_tracked_separately():
+    tracker = UsnChangeTracker()
+    tracker.commit(tracker.check("dc1", 1200))
+
+    assert tracker.check("dc2", 10).full
+    assert not tracker.check("dc1", 1300).full
+
+    tracker.forget("dc1")
+    assert tracker.last_usn("dc1") is None
+    assert tracker.check("dc1", 1300).full
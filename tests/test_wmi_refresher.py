@@ -0,0 +1,87 @@
+import pytest
+
+from mvdt_utilities.windows import wmi_refresher as w
+from mvdt_utilities.windows.wmi_refresher import SUPPORTED_COUNTER_TYPES, compute_counter
+
+# Two samples 2 seconds apart by the performance counter, 50 microseconds by the system time
+PREVIOUS = {
+    "Counter": 100,
+    "Counter_Base": 10,
+    "Timestamp_PerfTime": 1000,
+    "Frequency_PerfTime": 100,
+    "Timestamp_Sys100NS": 10000,
+    "Timestamp_Object": 500,
+    "Frequency_Object": 10,
+}
+CURRENT = {
+    **PREVIOUS,
+    "Counter": 150,
+    "Counter_Base": 20,
+    "Timestamp_PerfTime": 1200,
+    "Timestamp_Sys100NS": 10500,
+    "Timestamp_Object": 600,
+}
+
+EXPECTED = {
+    w.PERF_COUNTER_RAWCOUNT_HEX: 150,
+    w.PERF_COUNTER_LARGE_RAWCOUNT_HEX: 150,
+    w.PERF_COUNTER_RAWCOUNT: 150,
+    w.PERF_COUNTER_LARGE_RAWCOUNT: 150,
+    w.PERF_RAW_FRACTION: 750,
+    w.PERF_LARGE_RAW_FRACTION: 750,
+    w.PERF_ELAPSED_TIME: 45,
+    w.PERF_COUNTER_DELTA: 50,
+    w.PERF_COUNTER_LARGE_DELTA: 50,
+    w.PERF_COUNTER_COUNTER: 25,
+    w.PERF_COUNTER_BULK_COUNT: 25,
+    w.PERF_COUNTER_TIMER: 25,
+    w.PERF_COUNTER_TIMER_INV: 75,
+    w.PERF_100NSEC_TIMER: 10,
+    w.PERF_100NSEC_TIMER_INV: 90,
+    w.PERF_OBJ_TIME_TIMER: 50,
+    w.PERF_COUNTER_QUEUELEN_TYPE: 0.25,
+    w.PERF_COUNTER_LARGE_QUEUELEN_TYPE: 0.25,
+    w.PERF_COUNTER_100NS_QUEUELEN_TYPE: 0.1,
+    w.PERF_COUNTER_OBJ_TIME_QUEUELEN_TYPE: 0.5,
+    w.PERF_PRECISION_100NS_TIMER: 500,
+    w.PERF_SAMPLE_FRACTION: 500,
+    w.PERF_AVERAGE_TIMER: 0.05,
+    w.PERF_AVERAGE_BULK: 5,
+}
+
+# Computed from a single sample
+SINGLE_SAMPLE_TYPES = {
+    w.PERF_COUNTER_RAWCOUNT_HEX,
+    w.PERF_COUNTER_LARGE_RAWCOUNT_HEX,
+    w.PERF_COUNTER_RAWCOUNT,
+    w.PERF_COUNTER_LARGE_RAWCOUNT,
+    w.PERF_RAW_FRACTION,
+    w.PERF_LARGE_RAW_FRACTION,
+    w.PERF_ELAPSED_TIME,
+}
+
+
+def test_every_supported_type_is_tested():
+    assert set(EXPECTED) == SUPPORTED_COUNTER_TYPES
+
+
+@pytest.mark.parametrize("counter_type", sorted(EXPECTED))
+def test_compute_counter(counter_type):
+    assert compute_counter(counter_type, "Counter", CURRENT, PREVIOUS) == pytest.approx(EXPECTED[counter_type])
+
+
+@pytest.mark.parametrize("counter_type", sorted(SUPPORTED_COUNTER_TYPES - SINGLE_SAMPLE_TYPES))
+def test_compute_counter_needs_previous_sample(counter_type):
+    assert compute_counter(counter_type, "Counter", CURRENT, None) is None
+
+
+@pytest.mark.parametrize("counter_type", sorted(SUPPORTED_COUNTER_TYPES - SINGLE_SAMPLE_TYPES))
+def test_compute_counter_without_elapsed_time(counter_type):
+    if counter_type in (w.PERF_COUNTER_DELTA, w.PERF_COUNTER_LARGE_DELTA):
+        pytest.skip("Deltas don't depend on time")
+    assert compute_counter(counter_type, "Counter", PREVIOUS, PREVIOUS) is None
+
+
+def test_compute_counter_rejects_unsupported_type():
+    with pytest.raises(ValueError):
+        compute_counter(1, "Counter", CURRENT, PREVIOUS)